@@ -1,5 +1,9 @@
 from llfbench import envs
+from llfbench.envs.vector_env import LLFVectorEnv
+from llfbench.envs.registration import MetadataRegistry, GENERIC_FEEDBACK_TYPES
+from llfbench.utils import generate_combinations_dict
 import gymnasium as gym
+from functools import partial
 
 def make(env_name, *, instruction_type=None, feedback_type=None):
     env = gym.make(env_name)
@@ -9,7 +13,35 @@ def make(env_name, *, instruction_type=None, feedback_type=None):
         env.set_feedback_type(feedback_type)
     return env
 
+def make_vec(env_name, num_envs, *, instruction_type=None, feedback_type=None,
+             asynchronous=True, autoreset=True, context=None, extractor=None, extraction_executor=None):
+    """ Make a LLFVectorEnv of `num_envs` copies of env_name. Each copy is
+        created by `make` inside its own worker process when asynchronous is True.
+        The extractions of an extractor run in this process (see LLFVectorEnv).
+    """
+    env_fn = partial(make, env_name, instruction_type=instruction_type, feedback_type=feedback_type)
+    return LLFVectorEnv([env_fn] * num_envs, asynchronous=asynchronous, autoreset=autoreset, context=context,
+                        extractor=extractor, extraction_executor=extraction_executor)
+
 def supported_types(env_name):
     """ Return the supported INSTRUCTION_TYPES and FEEDBACK_TYPES for the given env_name. """
-    env = gym.make(env_name)
+    if MetadataRegistry.contains(env_name):
+        metadata = MetadataRegistry.get(env_name)
+        return metadata.instruction_types, metadata.feedback_types
+    env = gym.make(env_name)  # not registered by llfbench
     return env.INSTRUCTION_TYPES, env.FEEDBACK_TYPES
+
+def supported_configs(env_name):
+    """ Return all the combinations of instruction_type and feedback_type
+        (including 'n', 'a' and 'm') supported by the given env_name, as a
+        list of dicts which can be passed to `make`.
+    """
+    instruction_types, feedback_types = supported_types(env_name)
+    feedback_types = list(feedback_types) + list(GENERIC_FEEDBACK_TYPES)
+    return generate_combinations_dict(dict(instruction_type=instruction_types, feedback_type=feedback_types))
+
+def reward_range(env_name):
+    """ Return the reward_range of the given env_name. """
+    if MetadataRegistry.contains(env_name):
+        return MetadataRegistry.get(env_name).reward_range
+    return gym.make(env_name).reward_range
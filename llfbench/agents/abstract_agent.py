@@ -1,3 +1,6 @@
+import copy
+
+
 class Agent:
     """ An agent that interacts with an environment with language feedback. """
 
@@ -12,3 +15,49 @@ class Agent:
 
     def act(self, *args, **kwargs):
         raise NotImplementedError
+
+    def reset_batch(self, docstrings, slots):
+        """ Start new episodes in the given slots of a batch; see act_batch.
+
+            By default, each slot gets its own deep copy of this agent, which
+            is reset with the docstring of its episode, so that the state of an
+            episode (e.g. its history) is not shared with the other slots.
+            Agents that cannot be copied (e.g. ones holding a client) should
+            override reset_batch and act_batch.
+        """
+        # the copies must not hold copies of the other slots
+        slot_agents = self.__dict__.pop('_slot_agents', {})
+        try:
+            for docstring, slot in zip(docstrings, slots):
+                agent = copy.deepcopy(self)
+                agent.reset(docstring)
+                slot_agents[slot] = agent
+        finally:
+            self._slot_agents = slot_agents
+
+    def act_batch(self, observations, feedbacks, slots, **kwargs):
+        """ Return the actions for a batch of episodes, e.g. by running all
+            the prompts in one forward pass of a model. The i-th episode is in
+            slots[i]; a slot keeps its episode until the episode ends, and is
+            then given a new one through reset_batch. Other kwargs (e.g.
+            full_information) are lists with one element per episode.
+
+            By default, this calls act of the copy of the agent of each slot
+            (see reset_batch) in turn.
+        """
+        slot_agents = getattr(self, '_slot_agents', {})
+        for slot in slots:
+            assert slot in slot_agents, f'Slot {slot} must be reset with reset_batch before act_batch.'
+        return [slot_agents[slot].act(observation, feedback, **{k: v[i] for k, v in kwargs.items()})
+                for i, (slot, observation, feedback) in enumerate(zip(slots, observations, feedbacks))]
+
+
+class AsyncAgent(Agent):
+    """ An agent whose act is a coroutine, e.g. one that waits for the
+        response of a remote model. See llfbench.agents.async_utils.
+    """
+
+    NAME = "AbstractAsyncAgent"
+
+    async def act(self, *args, **kwargs):
+        raise NotImplementedError
@@ -0,0 +1,150 @@
+import asyncio
+import inspect
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from llfbench.agents.utils import episode_seeds, make_env, get_docstring
+
+"""
+
+An asyncio evaluation loop for agents that mostly wait, e.g. on the responses
+of a remote LLM.
+
+Up to max_concurrency episodes run at the same time. Each of them is run by a
+slot that owns an env and an agent (made by make_agent), and takes the next
+episode when its current one finishes. The agent's act may be a coroutine
+(see AsyncAgent) or a regular method; the env's reset and step are run on a
+thread pool, so a slow env does not block the event loop, e.g.
+
+    scores = asyncio.run(async_evaluate(make_agent, 'llf-gridworld-v0', horizon=10, n_episodes=100,
+                                        max_concurrency=50))
+
+or evaluate_agent_async(...) outside of an event loop.
+
+"""
+
+
+async def _call(executor, fun, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(executor, lambda: fun(*args, **kwargs))
+
+
+async def async_rollout(agent, env, *, horizon, return_full_information=False, log_data=False, seed=None,
+                        executor=None):
+    """ The asyncio version of llfbench.agents.utils.rollout. The env is
+        stepped on executor (the default executor of the loop if None).
+    """
+
+    observation, info = await _call(executor, env.reset, seed=seed)
+
+    if return_full_information:
+        assert 'oracle_info' in info, 'The env must be wrapped by FullInformationWrapper.'
+
+    agent.reset(get_docstring(env, observation))
+
+    sum_of_rewards = 0.0
+    data = dict(observations=[observation], actions=[], rewards=[], dones=[], infos=[])
+
+    for i in range(horizon):
+
+        feedback = info.get('feedback', None)
+
+        if return_full_information:  # Oracle: the agent gets privileged information
+            action = agent.act(observation, feedback, full_information=info['oracle_info'])
+        else:                       # Regular agent
+            action = agent.act(observation, feedback)
+        if inspect.isawaitable(action):
+            action = await action
+
+        observation, reward, terminated, truncated, info = await _call(executor, env.step, action)
+        done = terminated or truncated
+
+        if log_data:
+            data['observations'].append(observation)
+            data['actions'].append(action)
+            data['rewards'].append(reward)
+            data['dones'].append(done)
+            data['infos'].append(info)
+        sum_of_rewards += reward
+
+        if done or info.get('success', False):
+            break
+
+    return sum_of_rewards, data
+
+
+async def async_iter_evaluate(make_agent, env_name, *, horizon, n_episodes, env_kwargs=None,
+                              return_full_information=False, log_data=False, max_concurrency=16, seed=None,
+                              executor=None):
+    """ Evaluate the agents with n_episodes rollouts, of which at most
+        max_concurrency run concurrently, and yield (episode, seed, score, data)
+        for each episode as soon as it finishes. Each episode is reset with its
+        own seed (see episode_seeds).
+
+        Args:
+            make_agent: a callable that returns a new agent; one agent is made
+            for each concurrent slot and reused over its episodes.
+
+            executor: the executor where the envs are made and stepped; by
+            default, a thread pool with one thread per slot.
+    """
+    n_slots = min(max_concurrency, n_episodes)
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=n_slots)
+    episodes = asyncio.Queue()
+    for episode_seed in enumerate(episode_seeds(seed, n_episodes)):
+        episodes.put_nowait(episode_seed)
+    results = asyncio.Queue()
+
+    async def run_slot():
+        env = None
+        try:
+            env = await _call(executor, make_env, env_name, env_kwargs, return_full_information)
+            agent = make_agent()
+            while not episodes.empty():
+                episode, episode_seed = episodes.get_nowait()
+                score, data = await async_rollout(agent, env,
+                                                  horizon=horizon,
+                                                  return_full_information=return_full_information,
+                                                  log_data=log_data,
+                                                  seed=episode_seed,
+                                                  executor=executor)
+                results.put_nowait((episode, episode_seed, score, data))
+        except Exception as e:  # raised by the consumer below
+            results.put_nowait(e)
+        finally:
+            if env is not None:
+                env.close()
+
+    slots = [asyncio.ensure_future(run_slot()) for _ in range(n_slots)]
+    try:
+        for _ in range(n_episodes):
+            result = await results.get()
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        for slot in slots:
+            slot.cancel()
+        await asyncio.gather(*slots, return_exceptions=True)
+        if own_executor:
+            executor.shutdown(wait=False)
+
+
+async def async_evaluate(make_agent, env_name, *, horizon, n_episodes, log_data=False, **kwargs):
+    """ Evaluate the agents with n_episodes rollouts like
+        llfbench.agents.utils.evaluate_agent; see async_iter_evaluate.
+    """
+    results = [result async for result in async_iter_evaluate(make_agent, env_name,
+                                                              horizon=horizon,
+                                                              n_episodes=n_episodes,
+                                                              log_data=log_data,
+                                                              **kwargs)]
+    results.sort(key=lambda result: result[0])
+    scores = np.array([score for _, _, score, _ in results])
+    data = [data for _, _, _, data in results]
+    return (scores, data) if log_data else scores
+
+
+def evaluate_agent_async(make_agent, env_name, **kwargs):
+    """ Run async_evaluate in a new event loop. """
+    return asyncio.run(async_evaluate(make_agent, env_name, **kwargs))
@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import numpy as np
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+"""
+
+A store of evaluation results in a single SQLite file, so that a long
+evaluation can be resumed and queried while it runs.
+
+Each episode is a row keyed by (env_name, instruction_type, feedback_type,
+seed, episode), where seed is the seed of the evaluation and episode is the
+index of the episode in it; the row also holds the seed of the episode, its
+score and optionally its data (encoded as JSON). A row is written in its own
+transaction as soon as the episode finishes, e.g.
+
+    store = ResultStore('results.sqlite')
+    scores = evaluate_agent(agent, 'llf-gridworld-v0', horizon=10, n_episodes=10000, seed=0, store=store)
+
+and rerunning the same call after a crash only runs the missing episodes.
+
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS episodes (
+    env_name TEXT NOT NULL,
+    instruction_type TEXT NOT NULL,
+    feedback_type TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    episode INTEGER NOT NULL,
+    episode_seed INTEGER,
+    score REAL NOT NULL,
+    data TEXT,
+    PRIMARY KEY (env_name, instruction_type, feedback_type, seed, episode)
+)
+"""
+
+
+def config_key(env_name: str, env_kwargs: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+    """ The (instruction_type, feedback_type) of an env made by llfbench.make
+        with env_kwargs, where the types not in env_kwargs are the defaults
+        registered for env_name.
+    """
+    import gymnasium as gym
+    env_kwargs = env_kwargs or {}
+    defaults = gym.envs.registry[env_name].kwargs if env_name in gym.envs.registry else {}
+    key = []
+    for name in ('instruction_type', 'feedback_type'):
+        value = env_kwargs.get(name)
+        if value is None:
+            value = defaults.get(name, '')
+        key.append(value if isinstance(value, str) else ','.join(sorted(value)))
+    return tuple(key)
+
+
+class ResultStore:
+    """ The results of evaluations, stored in a SQLite file. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        # WAL lets other processes read the results while they are written.
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        with self._connection:
+            self._connection.execute(SCHEMA)
+
+    def add(self, env_name: str, instruction_type: str, feedback_type: str, seed: int, episode: int,
+            episode_seed: Optional[int], score: float, data: Optional[Dict[str, Any]] = None):
+        """ Write the result of an episode, replacing any previous result with the same key. """
+        from llfbench.envs.trace import TraceEncoder
+        data = None if data is None else json.dumps(data, cls=TraceEncoder)
+        with self._connection:  # one transaction per episode
+            self._connection.execute('INSERT OR REPLACE INTO episodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (env_name, instruction_type, feedback_type, seed, episode, episode_seed,
+                                      float(score), data))
+
+    def completed(self, env_name: str, instruction_type: str, feedback_type: str, seed: int) -> Set[int]:
+        """ The indices of the episodes of an evaluation that are in the store. """
+        rows = self._connection.execute('SELECT episode FROM episodes WHERE env_name=? AND instruction_type=? '
+                                        'AND feedback_type=? AND seed=?',
+                                        (env_name, instruction_type, feedback_type, seed))
+        return {episode for episode, in rows}
+
+    def results(self, env_name: str, instruction_type: str, feedback_type: str, seed: int,
+                n_episodes: Optional[int] = None) -> List[Tuple[int, Optional[int], float, Optional[Dict[str, Any]]]]:
+        """ The (episode, episode_seed, score, data) of the episodes of an
+            evaluation (only the first n_episodes if given), sorted by episode.
+        """
+        rows = self._connection.execute('SELECT episode, episode_seed, score, data FROM episodes WHERE env_name=? '
+                                        'AND instruction_type=? AND feedback_type=? AND seed=? AND episode<? '
+                                        'ORDER BY episode',
+                                        (env_name, instruction_type, feedback_type, seed,
+                                         n_episodes if n_episodes is not None else 2 ** 62))
+        return [(episode, episode_seed, score, None if data is None else json.loads(data))
+                for episode, episode_seed, score, data in rows]
+
+    def scores(self, env_name: str, instruction_type: str, feedback_type: str, seed: int) -> np.ndarray:
+        """ The scores of the episodes of an evaluation, sorted by episode. """
+        return np.array([score for _, _, score, _ in self.results(env_name, instruction_type, feedback_type, seed)])
+
+    def summary(self, **where) -> List[Dict[str, Any]]:
+        """ The number of episodes, mean and std of the scores of each
+            evaluation in the store, optionally filtered by the columns of the
+            key, e.g. summary(env_name='llf-gridworld-v0').
+        """
+        columns = ('env_name', 'instruction_type', 'feedback_type', 'seed')
+        assert set(where) <= set(columns), f'Can only filter by {columns}.'
+        condition = ' AND '.join(f'{k}=?' for k in where) or '1'
+        rows = self._connection.execute(f'SELECT {", ".join(columns)}, COUNT(*), AVG(score), AVG(score * score) '
+                                        f'FROM episodes WHERE {condition} GROUP BY {", ".join(columns)}',
+                                        tuple(where.values()))
+        return [dict(zip(columns, row[:4]), n_episodes=n, mean=mean, std=float(np.sqrt(max(mean2 - mean ** 2, 0.0))))
+                for *row, n, mean, mean2 in rows]
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
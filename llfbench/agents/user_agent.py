@@ -2,7 +2,7 @@ from textwrap import dedent, indent
 import sys
 
 from llfbench.agents.abstract_agent import Agent
-from llfbench.agents.utils import extract_action, ReplayBuffer, print_color
+from llfbench.agents.utils import extract_action, ReplayBuffer, HistoryRenderer, print_color
 
 def get_multiline_input(prompt="Enter text (press Enter twice to finish):\n"):
     lines = []
@@ -16,22 +16,28 @@ def get_multiline_input(prompt="Enter text (press Enter twice to finish):\n"):
 class UserAgent(Agent):
 
     NAME = "UserAgent"
+    action_name = "Action"
 
     def __init__(self,
                  verbose=False,
                  buffer_size=1000,
                  ignore_observation=False,
-                 prompt_template=None):
+                 prompt_template=None,
+                 history_budget=None,
+                 count_tokens=len):
         """
             Args:
                 verbose: whether to print out the prompt and response
                 buffer_size: the size of the replay buffer
                 ignore_observation: whether to ignore the observation (for bandit setting)
                 prompt_template: A prompt template with two parameters if ignore_observation is True and 3 otherwise
+                history_budget: the maximal size of the history in the prompt; the oldest items are dropped beyond it
+                count_tokens: a function that returns the size of a str, e.g. in tokens (characters by default)
         """
         super().__init__()
         self.verbose = verbose
         self.buffer = ReplayBuffer(buffer_size)
+        self.history = HistoryRenderer(separator='\n', max_items=buffer_size, budget=history_budget, count=count_tokens)
         self.ignore_observation = ignore_observation
         if prompt_template is not None:
             self.prompt_template = prompt_template
@@ -75,37 +81,30 @@ class UserAgent(Agent):
     def reset(self, docstring):
         self.docstring = docstring
         self.buffer.reset()
+        self.history.reset()
 
-    @property
-    def world_info(self):
-
+    def render_item(self, item):
         if self.ignore_observation:
+            return indent(f'{self.action_name}: {item["action"]}\n\nFeedback: {item["feedback"]}\n\n\n','\t')
+        # We present the observation and feedback as
+        # you took action <action>
+        # this resulted in <observation>
+        # and you got a feedback of <feedback>
+        return f"Observation: {item['observation']}\nAction: {item['action']}\nFeedback: {item['feedback']}\n"
 
-            if len(self.buffer) == 0:
-                world_info = 'None'
-            else:
-                world_info = '\n'.join(
-                    [indent(f'{self.action_name}: {item["action"]}\n\nFeedback: {item["feedback"]}\n\n\n','\t')
-                     for item in self.buffer])
-        else:
-            # We present the observation and feedback as
-            # you took action <action>
-            # this resulted in <observation>
-            # and you got a feedback of <feedback>
-
-            if len(self.buffer) == 0:
-                world_info = 'None'
-            else:
-                world_info = "\n".join([
-                    f"Observation: {dp['observation']}\nAction: {dp['action']}\nFeedback: {dp['feedback']}\n"
-                    for dp in self.buffer])
-
-        return world_info
+    @property
+    def world_info(self):
+        # The history is rendered incrementally; see act.
+        if len(self.history) == 0:
+            return 'None'
+        return self.history.text
 
     def act(self, observation, feedback, **kwargs):
 
         # update with the latest feedback (ignored in the first call)
-        self.buffer.update(feedback=feedback, next_observation=observation)
+        if len(self.buffer) > 0:
+            self.buffer.update(feedback=feedback, next_observation=observation)
+            self.history.append(self.render_item(self.buffer[-1]))  # the last item is now complete
         world_info = self.world_info
 
         # create prompt
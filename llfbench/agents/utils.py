@@ -1,4 +1,5 @@
 import random
+import collections
 import numpy as np
 
 # print with colors (modified from Huihan's lflf)
@@ -39,33 +40,182 @@ def extract_action(response, n_actions, separator="#"):
     return random.randint(0,n_actions-1)
 
 class ReplayBuffer:
-    """ A basic replay buffer based on list. """
+    """ A fixed-capacity ring buffer that stores the items column by column.
+
+        Each field (e.g. observation, action, feedback) is a preallocated numpy
+        array of size buffer_size; fields in NUMERIC_FIELDS are float arrays and
+        the others are object arrays. Fields not given to `append` are None (or
+        nan) in the columns, and a None value of a numeric field is stored as
+        nan. Indexing returns a dict of the fields given to that item, like a
+        list of dicts would. When the buffer is full, `append` overwrites the
+        oldest item.
+    """
+
+    FIELDS = ('observation', 'action', 'feedback', 'next_observation', 'reward')
+    NUMERIC_FIELDS = ('reward',)
 
     def __init__(self, buffer_size):
+        assert buffer_size > 0
         self.buffer_size = buffer_size
-        self.buffer = []
+        self._columns = {}
+        for name in self.FIELDS:
+            self._add_column(name)
+        self._keys = np.full(buffer_size, None, dtype=object)  # the fields given to each item, in order
+        self._start = 0  # the index of the oldest item
+        self._size = 0
+
+    def _add_column(self, name):
+        if name in self.NUMERIC_FIELDS:
+            self._columns[name] = np.full(self.buffer_size, np.nan)
+        else:
+            self._columns[name] = np.full(self.buffer_size, None, dtype=object)
+
+    def _set(self, index, kwargs):
+        for name, value in kwargs.items():
+            if name not in self._columns:
+                self._add_column(name)
+            column = self._columns[name]
+            column[index] = np.nan if value is None and column.dtype != object else value
+        self._keys[index].update(dict.fromkeys(kwargs))
+
+    def _index(self, item):
+        # the index in the columns of the item-th oldest item
+        if item < 0:
+            item += self._size
+        if not 0 <= item < self._size:
+            raise IndexError('ReplayBuffer index out of range')
+        return (self._start + item) % self.buffer_size
 
     def reset(self):
-        self.buffer = []
+        for column in self._columns.values():
+            column.fill(np.nan if column.dtype != object else None)  # release the stored objects
+        self._keys.fill(None)
+        self._start = 0
+        self._size = 0
 
     def append(self, **kwargs):
-        self.buffer.append(dict(**kwargs))
-        if len(self.buffer) > self.buffer_size:
-            self.buffer.pop(0)
+        if self._size < self.buffer_size:
+            index = (self._start + self._size) % self.buffer_size
+            self._size += 1
+        else:  # overwrite the oldest item
+            index = self._start
+            self._start = (self._start + 1) % self.buffer_size
+        for name, column in self._columns.items():
+            if name not in kwargs:
+                column[index] = np.nan if column.dtype != object else None
+        self._keys[index] = {}
+        self._set(index, kwargs)
 
     def update(self, **kwargs):
         # update the last item
-        if len(self.buffer)>0:
-            self.buffer[-1].update(**kwargs)
+        if self._size > 0:
+            self._set(self._index(-1), kwargs)
+
+    def column(self, name, k=None):
+        """ The values of a field of the last k items (all by default), from
+            the oldest to the newest. This is a view of the buffer unless the
+            items wrap around the end of the ring.
+        """
+        k = self._size if k is None else min(k, self._size)
+        first = (self._start + self._size - k) % self.buffer_size
+        column = self._columns[name]
+        if first + k <= self.buffer_size:
+            return column[first:first + k]
+        return np.concatenate([column[first:], column[:first + k - self.buffer_size]])
+
+    def last(self, k):
+        """ The last k items as a dict of columns; see `column`. """
+        return {name: self.column(name, k) for name in self._columns}
+
+    def sample(self, batch_size, rng=None):
+        """ Sample a minibatch of items uniformly with replacement, as a dict of
+            columns. rng is a np.random.Generator; by default, the global numpy
+            random state (see set_seed) is used.
+        """
+        assert self._size > 0, 'Cannot sample from an empty buffer.'
+        if rng is None:
+            offsets = np.random.randint(self._size, size=batch_size)
+        else:
+            offsets = rng.integers(self._size, size=batch_size)
+        indices = (self._start + offsets) % self.buffer_size
+        return {name: column[indices] for name, column in self._columns.items()}
 
     def __len__(self):
-        return len(self.buffer)
+        return self._size
 
     def __getitem__(self, item):
-        return self.buffer[item]
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(self._size))]
+        index = self._index(item)
+        return {name: self._columns[name][index] for name in self._keys[index]}
 
     def __iter__(self):
-        return self.buffer.__iter__()
+        return (self[i] for i in range(self._size))
+
+class HistoryRenderer:
+    """ Render a history of items into text incrementally.
+
+        Each item is rendered once by `append`, and the text of the history is
+        kept up to date, so building a prompt from a history of T items costs
+        O(T) formatting overall instead of O(T^2). The oldest items are evicted
+        when there are more than max_items of them or when the size of the text
+        exceeds budget, where the size of a piece of text is measured by count,
+        e.g. len for characters or the number of tokens of a tokenizer.
+    """
+
+    def __init__(self, separator='\n', max_items=None, budget=None, count=len):
+        """
+            Args:
+                separator: the text between the rendered items
+                max_items: the maximal number of items in the history
+                budget: the maximal size of the history, measured by count
+                count: a function that returns the size of a str
+        """
+        self.separator = separator
+        self.max_items = max_items
+        self.budget = budget
+        self.count = count
+        self._separator_size = count(separator)
+        self.reset()
+
+    def reset(self):
+        self._pieces = collections.deque()  # (text, size) of each item
+        self._size = 0
+        self._text = ''
+
+    def append(self, text):
+        size = self.count(text)
+        self._pieces.append((text, size))
+        if len(self._pieces) > 1:
+            self._text += self.separator + text
+            self._size += self._separator_size + size
+        else:
+            self._text = text
+            self._size = size
+        self._evict()
+
+    def _evict(self):
+        # Always keep the newest item, even if it alone exceeds the budget.
+        cut = 0
+        while len(self._pieces) > 1 and ((self.max_items is not None and len(self._pieces) > self.max_items) or
+                                         (self.budget is not None and self._size > self.budget)):
+            text, size = self._pieces.popleft()
+            cut += len(text) + len(self.separator)
+            self._size -= size + self._separator_size
+        if cut > 0:
+            self._text = self._text[cut:]
+
+    @property
+    def text(self):
+        return self._text
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._pieces)
+
 
 def set_seed(seed, env=None):
     # torch.manual_seed(seed)
@@ -76,21 +226,25 @@ def set_seed(seed, env=None):
     #if env is not None:
     #    env.reset(seed)
 
-def rollout(agent, env, *, horizon, return_full_information=False, log_data=False, seed=None):
-    """ A basic agent evaluation loop. """
+def get_docstring(env, observation):
+    """ The problem description given to the agent at the start of an episode. """
+    default_docstring = 'This is an interactive decision making problem with language feedback.'
+    return getattr(env, 'docstring', observation if isinstance(observation, str) else default_docstring)
 
-    if return_full_information:
-        assert hasattr(env,'get_full_information')
 
-    observation = env.reset(seed=seed)
+def rollout(agent, env, *, horizon, return_full_information=False, log_data=False, seed=None):
+    """ A basic agent evaluation loop. With return_full_information, env must
+        be wrapped by FullInformationWrapper, and the agent is given the
+        outcome of every action in info['oracle_info'].
+    """
 
-    default_docstring = 'This is an interactive decision making problem with language feedback.'
+    observation, info = env.reset(seed=seed)
 
-    docstring = getattr(env, 'docstring', observation if isinstance(observation, str) else default_docstring)
+    if return_full_information:
+        assert 'oracle_info' in info, 'The env must be wrapped by FullInformationWrapper.'
 
-    agent.reset(docstring)
+    agent.reset(get_docstring(env, observation))
 
-    info = {}
     sum_of_rewards = 0.0
     data = dict(observations=[observation], actions=[], rewards=[], dones=[], infos=[])
 
@@ -99,47 +253,246 @@ def rollout(agent, env, *, horizon, return_full_information=False, log_data=Fals
         feedback = info.get('feedback', None)
 
         if return_full_information:  # Oracle: the agent gets privileged information
-            full_information = info.get('full_information', env.get_full_information())
-            action = agent.act(observation, feedback, full_information=full_information)
+            action = agent.act(observation, feedback, full_information=info['oracle_info'])
         else:                       # Regular agent
             action = agent.act(observation, feedback)
 
-        new_observation, reward, terminated, truncated, info = env.step(action)
-
-        observation = new_observation
+        observation, reward, terminated, truncated, info = env.step(action)
+        done = terminated or truncated
 
         if log_data:
-            for k in data.keys():
-                data[k].append(locals()[k[:-1]])  # removing s at the end
+            data['observations'].append(observation)
+            data['actions'].append(action)
+            data['rewards'].append(reward)
+            data['dones'].append(done)
+            data['infos'].append(info)
         sum_of_rewards += reward
 
-        if terminated or truncated or info['success']:
-            print("EPISODE DONE! Terminated: {}, truncated: {}, success: {}".format(terminated, truncated, info['success']))
+        if done or info.get('success', False):
+            print("EPISODE DONE! Terminated: {}, truncated: {}, success: {}".format(terminated, truncated, info.get('success', False)))
             break
 
     return sum_of_rewards, data
 
 
+def episode_seeds(seed, n_episodes):
+    """ Derive independent seeds for n_episodes from seed (or from fresh
+        entropy if seed is None) with np.random.SeedSequence.
+    """
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(n_episodes)]
+
+
+def make_env(env_name, env_kwargs=None, return_full_information=False):
+    """ Make an env of llfbench with the config in env_kwargs (e.g.
+        instruction_type and feedback_type).
+    """
+    import llfbench
+    env = llfbench.make(env_name, **(env_kwargs or {}))
+    if return_full_information:
+        from llfbench.envs.env_wrappers import FullInformationWrapper
+        env = FullInformationWrapper(env)
+    return env
+
+
+# The env and agent of a worker process of iter_evaluate.
+_worker_env = None
+_worker_agent = None
+
+
+def _init_worker(env_name, env_kwargs, agent, return_full_information):
+    global _worker_env, _worker_agent
+    _worker_env = make_env(env_name, env_kwargs, return_full_information)
+    _worker_agent = agent
+
+
+def _run_episode(episode, seed, horizon, return_full_information, log_data):
+    score, data = rollout(_worker_agent, _worker_env,
+                          horizon=horizon,
+                          return_full_information=return_full_information,
+                          log_data=log_data,
+                          seed=seed)
+    return episode, seed, score, data
+
+
+def iter_evaluate(agent, env_name, *, horizon, n_episodes, env_kwargs=None, return_full_information=False,
+                  log_data=False, n_workers=1, seed=None, context=None, store=None):
+    """ Evaluate an agent with n_episodes rollouts and yield
+        (episode, seed, score, data) for each episode as soon as it finishes.
+
+        Each episode is reset with its own seed (see episode_seeds). With
+        n_workers > 1, the episodes run on a pool of worker processes, each of
+        which makes its own env from env_name and env_kwargs and gets a copy of
+        the agent, so the agent needs to be picklable; the results then arrive
+        in the order in which the episodes finish.
+
+        Args:
+            context: the multiprocessing start method, e.g. 'fork' or 'spawn'.
+
+            store: a ResultStore where the result of each episode is written
+            as soon as it finishes. The episodes already in the store are
+            skipped (and not yielded), so an interrupted evaluation can be
+            resumed by running it again with the same seed.
+    """
+    todo = list(enumerate(episode_seeds(seed, n_episodes)))
+    if store is not None:
+        from llfbench.agents.result_store import config_key
+        assert seed is not None, 'A seed is needed to resume an evaluation from a store.'
+        key = (env_name, *config_key(env_name, env_kwargs), seed)
+        completed = store.completed(*key)
+        todo = [(episode, episode_seed) for episode, episode_seed in todo if episode not in completed]
+    if not todo:
+        return
+
+    def results():
+        if n_workers > 1:
+            import multiprocessing as mp
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            with ProcessPoolExecutor(max_workers=min(n_workers, len(todo)),
+                                     mp_context=mp.get_context(context),
+                                     initializer=_init_worker,
+                                     initargs=(env_name, env_kwargs, agent, return_full_information)) as executor:
+                futures = [executor.submit(_run_episode, episode, episode_seed, horizon, return_full_information,
+                                           log_data) for episode, episode_seed in todo]
+                for future in as_completed(futures):
+                    yield future.result()
+        else:
+            # a local env, so that the globals of the worker processes are left untouched
+            env = make_env(env_name, env_kwargs, return_full_information)
+            try:
+                for episode, episode_seed in todo:
+                    score, data = rollout(agent, env,
+                                          horizon=horizon,
+                                          return_full_information=return_full_information,
+                                          log_data=log_data,
+                                          seed=episode_seed)
+                    yield episode, episode_seed, score, data
+            finally:
+                env.close()
+
+    for episode, episode_seed, score, data in results():
+        if store is not None:
+            store.add(*key, episode, episode_seed, score, data if log_data else None)
+        yield episode, episode_seed, score, data
+
+
 def evaluate_agent(agent, env, *, horizon, n_episodes, return_full_information=False, log_data=False,
-                   n_workers=1, seed=None):
-    """ Evaluate an agent with n_episodes rollouts. """
-
-    _rollout = lambda: rollout(agent, env,
-                               horizon=horizon,
-                               log_data=log_data,
-                               return_full_information=return_full_information,
-                               seed=seed)
-
-    if n_workers > 1:
-        import ray
-        ray_rollout = ray.remote(_rollout)
-        results = [ray_rollout.remote() for _ in range(n_episodes)]
-        results = ray.get(results)
+                   n_workers=1, seed=None, env_kwargs=None, context=None, store=None):
+    """ Evaluate an agent with n_episodes rollouts, each of which uses its own
+        seed derived from seed.
+
+        env is either an env or the name of a registered env, which is made
+        with env_kwargs. With n_workers > 1, the episodes run in worker
+        processes (see iter_evaluate), which needs env to be a name.
+
+        With a ResultStore as store (which also needs env to be a name), only
+        the episodes not in the store are run, and the results of all the
+        episodes are then read from the store; their data is decoded from JSON.
+    """
+    if isinstance(env, str):
+        results = sorted(iter_evaluate(agent, env,
+                                       horizon=horizon,
+                                       n_episodes=n_episodes,
+                                       env_kwargs=env_kwargs,
+                                       return_full_information=return_full_information,
+                                       log_data=log_data,
+                                       n_workers=n_workers,
+                                       seed=seed,
+                                       context=context,
+                                       store=store), key=lambda result: result[0])
+        if store is not None:
+            from llfbench.agents.result_store import config_key
+            results = store.results(env, *config_key(env, env_kwargs), seed, n_episodes=n_episodes)
+        results = [(score, data) for _, _, score, data in results]
     else:
-        results = [_rollout() for _ in range(n_episodes)]
+        assert n_workers == 1, 'Pass the env name to evaluate with n_workers > 1, so that each worker makes its own env.'
+        assert store is None, 'Pass the env name to evaluate with a store.'
+        results = [rollout(agent, env,
+                           horizon=horizon,
+                           log_data=log_data,
+                           return_full_information=return_full_information,
+                           seed=episode_seed) for episode_seed in episode_seeds(seed, n_episodes)]
 
     # Extract the scores and data
     scores = [score for score, _ in results]
     scores = np.array(scores)
     data = [data for _, data in results]
     return (scores, data) if log_data else scores
+
+
+def iter_lockstep(agent, env_name, *, batch_size, horizon, n_episodes, env_kwargs=None,
+                  return_full_information=False, log_data=False, seed=None):
+    """ Evaluate a batched agent (see Agent.act_batch) with n_episodes
+        rollouts, batch_size of which advance together, and yield
+        (episode, seed, score, data) for each episode as soon as it finishes.
+
+        Each slot of the batch has its own env, made from env_name and
+        env_kwargs. A finished episode leaves the batch, and its slot takes the
+        next episode in the queue, until the queue is empty. Each episode is
+        reset with its own seed (see episode_seeds).
+    """
+    queue = collections.deque(enumerate(episode_seeds(seed, n_episodes)))
+    envs = [make_env(env_name, env_kwargs, return_full_information) for _ in range(min(batch_size, n_episodes))]
+    active = {}  # slot -> the state of the episode in the slot
+
+    def start(slots):
+        slots = list(slots)[:len(queue)]
+        docstrings = []
+        for slot in slots:
+            episode, episode_seed = queue.popleft()
+            observation, info = envs[slot].reset(seed=episode_seed)
+            if return_full_information:
+                assert 'oracle_info' in info, 'The env must be wrapped by FullInformationWrapper.'
+            active[slot] = dict(episode=episode, seed=episode_seed, observation=observation, info=info, t=0,
+                                score=0.0, data=dict(observations=[observation], actions=[], rewards=[], dones=[],
+                                                     infos=[]))
+            docstrings.append(get_docstring(envs[slot], observation))
+        if slots:
+            agent.reset_batch(docstrings, slots)
+
+    try:
+        start(range(len(envs)))
+        while active:
+            slots = sorted(active)
+            episodes = [active[slot] for slot in slots]
+            kwargs = {}
+            if return_full_information:  # Oracle: the agent gets privileged information
+                kwargs['full_information'] = [episode['info']['oracle_info'] for episode in episodes]
+            actions = agent.act_batch([episode['observation'] for episode in episodes],
+                                      [episode['info'].get('feedback', None) for episode in episodes],
+                                      slots, **kwargs)
+            finished = []
+            for slot, episode, action in zip(slots, episodes, actions):
+                observation, reward, terminated, truncated, info = envs[slot].step(action)
+                done = terminated or truncated
+                if log_data:
+                    data = episode['data']
+                    data['observations'].append(observation)
+                    data['actions'].append(action)
+                    data['rewards'].append(reward)
+                    data['dones'].append(done)
+                    data['infos'].append(info)
+                episode.update(observation=observation, info=info, t=episode['t'] + 1,
+                               score=episode['score'] + reward)
+                if done or info.get('success', False) or episode['t'] == horizon:
+                    del active[slot]
+                    finished.append(slot)
+                    yield episode['episode'], episode['seed'], episode['score'], episode['data']
+            start(finished)
+    finally:
+        for env in envs:
+            env.close()
+
+
+def evaluate_agent_lockstep(agent, env_name, *, batch_size, horizon, n_episodes, log_data=False, **kwargs):
+    """ Evaluate a batched agent with n_episodes rollouts like evaluate_agent;
+        see iter_lockstep.
+    """
+    results = sorted(iter_lockstep(agent, env_name,
+                                   batch_size=batch_size,
+                                   horizon=horizon,
+                                   n_episodes=n_episodes,
+                                   log_data=log_data,
+                                   **kwargs), key=lambda result: result[0])
+    scores = np.array([score for _, _, score, _ in results])
+    data = [data for _, _, _, data in results]
+    return (scores, data) if log_data else scores
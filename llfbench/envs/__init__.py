@@ -1,4 +1,7 @@
 import importlib
+# Each subpackage only registers its envs from a static ENVIRONMENTS tuple. The
+# env modules and their dependencies are imported by make_env, i.e. when
+# llfbench.make instantiates the env.
 from llfbench.envs import gridworld
 from llfbench.envs import bandits
 from llfbench.envs import optimization
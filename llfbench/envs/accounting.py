@@ -0,0 +1,178 @@
+import threading
+import gymnasium as gym
+from typing import Any, Callable, Dict, Optional, Tuple
+
+"""
+
+Accounting of the size of the prompts given to agents by LLF-Bench envs.
+
+PromptAccountingWrapper measures the instruction, observation and feedback of
+the observation dict returned by every reset and step, in characters and
+optionally in tokens counted by a local tokenizer, e.g.
+
+    encoding = tiktoken.get_encoding('cl100k_base')
+    accountant = PromptAccountant()
+    env = PromptAccountingWrapper(llfbench.make('llf-metaworld-pick-place-v2'), accountant,
+                                  count_tokens=lambda text: len(encoding.encode(text)))
+    ...
+    accountant.stats()  # {env_id: {feedback_type: {field: {'count': ..., 'chars': ..., 'tokens': ..., ...}}}}
+
+The sizes are aggregated per env id, feedback type and field (plus a 'total'
+of the fields of each observation). An accountant can be shared by the envs
+of a run, including envs stepped in threads.
+
+"""
+
+FIELDS = ('instruction', 'observation', 'feedback')
+
+
+class FieldStats:
+    """ The aggregated size of a field of the observation dicts. """
+
+    __slots__ = ('count', 'chars', 'tokens', 'max_chars', 'max_tokens')
+
+    def __init__(self):
+        self.count = 0  # the number of observations where the field is not None
+        self.chars = 0
+        self.tokens = 0
+        self.max_chars = 0
+        self.max_tokens = 0
+
+    def add(self, chars: int, tokens: int):
+        self.count += 1
+        self.chars += chars
+        self.tokens += tokens
+        if chars > self.max_chars:
+            self.max_chars = chars
+        if tokens > self.max_tokens:
+            self.max_tokens = tokens
+
+    def asdict(self) -> Dict[str, Any]:
+        return dict(count=self.count,
+                    chars=self.chars,
+                    mean_chars=self.chars / self.count if self.count else 0.0,
+                    max_chars=self.max_chars,
+                    tokens=self.tokens,
+                    mean_tokens=self.tokens / self.count if self.count else 0.0,
+                    max_tokens=self.max_tokens)
+
+
+class PromptAccountant:
+    """ The sizes of the observation dicts, aggregated per env id, feedback type and field. """
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str, str], FieldStats] = {}
+        self._lock = threading.Lock()
+
+    def add(self, env_id: str, feedback_type: str, sizes: Dict[str, Tuple[int, int]]):
+        """ Add the (chars, tokens) of the fields of an observation dict. The
+            fields that are None should not be in sizes.
+        """
+        with self._lock:
+            for field, (chars, tokens) in sizes.items():
+                self._get(env_id, feedback_type, field).add(chars, tokens)
+            self._get(env_id, feedback_type, 'total').add(sum(c for c, _ in sizes.values()),
+                                                          sum(t for _, t in sizes.values()))
+
+    def _get(self, env_id, feedback_type, field):
+        key = (env_id, feedback_type, field)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = FieldStats()
+        return stats
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, Dict[str, Any]]]]:
+        """ The aggregated sizes, as {env_id: {feedback_type: {field: stats}}}. """
+        with self._lock:
+            result = {}
+            for (env_id, feedback_type, field), stats in self._stats.items():
+                result.setdefault(env_id, {}).setdefault(feedback_type, {})[field] = stats.asdict()
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+def feedback_type_key(feedback_type) -> str:
+    # 'n', 'a', 'm', or the sorted types of a subset of FEEDBACK_TYPES joined by ','
+    return feedback_type if isinstance(feedback_type, str) else ','.join(sorted(feedback_type))
+
+
+class PromptAccountingWrapper(gym.Wrapper):
+    """
+        Measure the size of the instruction, observation and feedback of the
+        observation dict of every reset and step, and add it to a
+        PromptAccountant. Observations that are not strings are measured by
+        their str().
+    """
+
+    def __init__(self, env, accountant: Optional[PromptAccountant] = None,
+                 count_tokens: Optional[Callable[[str], int]] = None,
+                 env_id: Optional[str] = None, attach_to_info: bool = False):
+        """
+            Args:
+                env: An env with an LLFWrapper.
+
+                accountant: The PromptAccountant, which can be shared by
+                several envs. If None, the wrapper has its own.
+
+                count_tokens: A function returning the number of tokens of a
+                text, e.g. with a local tokenizer. If None, only the characters
+                are counted and the tokens are 0.
+
+                env_id: The env id of the aggregated sizes. If None, the id of
+                env.spec is used.
+
+                attach_to_info: Whether to add the (chars, tokens) of each
+                field to info['prompt_size'].
+        """
+        super().__init__(env)
+        self.accountant = PromptAccountant() if accountant is None else accountant
+        self.count_tokens = count_tokens
+        if env_id is None:
+            env_id = env.spec.id if env.spec is not None else type(env.unwrapped).__name__
+        self.env_id = env_id
+        self.attach_to_info = attach_to_info
+        self._last = {}  # field -> (text, tokens), since e.g. the instruction is often repeated
+
+    def measure(self, observation: Dict[str, Any]) -> Dict[str, Tuple[int, int]]:
+        """ The (chars, tokens) of the fields of an observation dict that are not None. """
+        sizes = {}
+        for field in FIELDS:
+            text = observation.get(field)
+            if text is None:
+                continue
+            if not isinstance(text, str):
+                text = str(text)
+            tokens = 0
+            if self.count_tokens is not None:
+                last = self._last.get(field)
+                if last is not None and last[0] == text:
+                    tokens = last[1]
+                else:
+                    tokens = self.count_tokens(text)
+                    self._last[field] = (text, tokens)
+            sizes[field] = (len(text), tokens)
+        return sizes
+
+    def _account(self, observation, info):
+        sizes = self.measure(observation)
+        feedback_type = feedback_type_key(self.env.get_wrapper_attr('feedback_type'))
+        self.accountant.add(self.env_id, feedback_type, sizes)
+        if self.attach_to_info:
+            info['prompt_size'] = sizes
+
+    def reset(self, *, seed=None, options=None):
+        observation, info = self.env.reset(seed=seed, options=options)
+        self._account(observation, info)
+        return observation, info
+
+    def step(self, action):
+        observation, reward, terminated, truncated, info = self.env.step(action)
+        self._account(observation, info)
+        return observation, reward, terminated, truncated, info
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, Dict[str, Any]]]]:
+        """ The aggregated sizes of the accountant (see PromptAccountant.stats). """
+        return self.accountant.stats()
@@ -0,0 +1,107 @@
+import re
+import numpy as np
+import gymnasium as gym
+from typing import Any, Dict, List, Sequence, Union
+
+"""
+
+Parse the text actions of agents (e.g. LLM responses) into the action space of
+an env, without evaluating the text.
+
+Numbers are read with a precompiled regex, so responses like
+
+    '[0.1, -0.2, 0.3, 1e-2]', 'Action: 0.1 -0.2 0.3 0.01', '2', 'I move 2.'
+
+are parsed, whereas a response that does not fit the action space gives an
+ActionParseError, whose message is meant to be returned as feedback.
+
+"""
+
+# A number is delimited, so that a malformed token like '1.2.3' is not read as 1.2 and .3.
+NUMBER = re.compile(r'(?<![\w.])(?<![\w.][-+])[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?(?!\w|\.\d)')
+INTEGER = re.compile(r'(?<![\w.])[-+]?\d+(?!\d|\.\d|[eE][-+]?\d)')
+
+
+class ActionParseError(ValueError):
+    """ The text of an action does not fit the action space. """
+
+    def __init__(self, text: str, reason: str):
+        super().__init__(f'Cannot parse action {text!r}: {reason}')
+        self.text = text
+        self.reason = reason
+
+    def asdict(self) -> Dict[str, str]:
+        return dict(text=self.text, reason=self.reason)
+
+
+def _bracketed(text: str) -> str:
+    # Only read the numbers in the outermost brackets if there are any, so
+    # that e.g. 'Step 3: [0.1, 0.2]' gives [0.1, 0.2].
+    start, end = text.find('['), text.rfind(']')
+    return text[start + 1:end] if -1 < start < end else text
+
+
+class ActionParser:
+    """ Parse text into an action of a Box, Discrete, MultiDiscrete or Text space. """
+
+    def __init__(self, action_space: gym.Space):
+        if isinstance(action_space, gym.spaces.Box):
+            self._parse = self._parse_box
+        elif isinstance(action_space, gym.spaces.Discrete):
+            self._parse = self._parse_discrete
+        elif isinstance(action_space, gym.spaces.MultiDiscrete):
+            self._parse = self._parse_multi_discrete
+        elif isinstance(action_space, gym.spaces.Text):
+            self._parse = self._parse_text
+        else:
+            raise NotImplementedError(f'Unsupported action space {action_space}')
+        self.action_space = action_space
+
+    def parse(self, text: str) -> Any:
+        """ Parse a text action; raise ActionParseError if it does not fit the action space. """
+        if not isinstance(text, str):
+            raise ActionParseError(repr(text), f'expected a str, but got {type(text).__name__}')
+        return self._parse(text)
+
+    def parse_batch(self, texts: Sequence[str]) -> List[Union[Any, ActionParseError]]:
+        """ Parse a list of text actions. The action of a text that cannot be
+            parsed is replaced by its ActionParseError.
+        """
+        actions = []
+        for text in texts:
+            try:
+                actions.append(self.parse(text))
+            except ActionParseError as e:
+                actions.append(e)
+        return actions
+
+    def _numbers(self, text, pattern, size):
+        numbers = pattern.findall(_bracketed(text))
+        if len(numbers) != size:
+            raise ActionParseError(text, f'expected {size} number{"s" if size > 1 else ""}, but found {len(numbers)}')
+        return numbers
+
+    def _parse_box(self, text):
+        space = self.action_space
+        numbers = self._numbers(text, NUMBER, int(np.prod(space.shape)))
+        return np.array([float(x) for x in numbers], dtype=space.dtype).reshape(space.shape)
+
+    def _parse_discrete(self, text):
+        space = self.action_space
+        stripped = text.strip()
+        numbers = [stripped] if INTEGER.fullmatch(stripped) else self._numbers(text, INTEGER, 1)
+        action = int(numbers[0])
+        if not space.start <= action < space.start + space.n:
+            raise ActionParseError(text, f'{action} is not in [{space.start}, {space.start + space.n - 1}]')
+        return action
+
+    def _parse_multi_discrete(self, text):
+        space = self.action_space
+        numbers = self._numbers(text, INTEGER, space.nvec.size)
+        action = np.array([int(x) for x in numbers], dtype=space.dtype).reshape(space.shape)
+        if np.any(action < 0) or np.any(action >= space.nvec):
+            raise ActionParseError(text, f'each entry must be in [0, nvec) with nvec={space.nvec.tolist()}')
+        return action
+
+    def _parse_text(self, text):
+        return text
@@ -1,6 +1,4 @@
-from gymnasium.envs.registration import register
-from llfbench.envs.alfworld.alfworld import Alfworld
-from llfbench.envs.alfworld.wrapper import AlfworldWrapper
+from llfbench.envs.registration import register
 
 
 
@@ -8,6 +6,12 @@ ENVIRONMENTS = (
     'alfworld-v0',
 )
 
+# The metadata of AlfworldWrapper, which imports its INSTRUCTION_TYPES and FEEDBACK_TYPES
+# from here, used without building the env.
+INSTRUCTION_TYPES = ('b',)
+FEEDBACK_TYPES = ('r', 'hn', 'hp', 'fn', 'fp')
+REWARD_RANGE = (float('-inf'), float('inf'))
+
 
 def make_env(env_name,
              instruction_type='b',
@@ -15,6 +19,8 @@ def make_env(env_name,
              ):
 
     """ Make the original env and wrap it with the LLFWrapper. """
+    from llfbench.envs.alfworld.alfworld import Alfworld
+    from llfbench.envs.alfworld.wrapper import AlfworldWrapper
     assert env_name.startswith("alfworld"), f"alfworld environment {env_name} must start with alfworld"
     env = Alfworld(instruction_type=instruction_type, feedback_type=feedback_type)
     return AlfworldWrapper(env, instruction_type=instruction_type, feedback_type=feedback_type)
@@ -25,5 +31,8 @@ for env_name in ENVIRONMENTS:
     register(
         id=f"llf-{env_name}",
         entry_point='llfbench.envs.alfworld:make_env',
-        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b')
+        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b'),
+        instruction_types=INSTRUCTION_TYPES,
+        feedback_types=FEEDBACK_TYPES,
+        reward_range=REWARD_RANGE
     )
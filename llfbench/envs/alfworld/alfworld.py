@@ -1,18 +1,18 @@
 import os
 import sys
-import random
 import string
 import gymnasium as gym
 
 from llfbench.envs.alfworld.prompts import *
 from llfbench.envs.llf_env import Feedback
 from llfbench.envs.alfworld.alfworld_download import download_alfworld_data
+from llfbench.envs.alfworld import INSTRUCTION_TYPES, FEEDBACK_TYPES
 
 
 class Alfworld(gym.Env):
 
     # Basic (b), partial (p), and complete (c)
-    INSTRUCTION_TYPES = ('b')        # ('b', 'p', 'c')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/alfworld/__init__.py
 
     # Feedback type:
     # r: reward
@@ -20,7 +20,7 @@ class Alfworld(gym.Env):
     # hp: hindsight positive
     # fn: future negative
     # fp: future positive
-    FEEDBACK_TYPES = ('r', 'hn', 'hp', 'fn', 'fp')
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/alfworld/__init__.py
 
     def __init__(self, instruction_type, feedback_type):
 
@@ -102,6 +102,7 @@ class Alfworld(gym.Env):
 
     def reset(self, *, seed=None, options=None):
 
+        super().reset(seed=seed)  # seeds self.np_random, used in the feedback
         if seed is not None:
             self.seed(seed)
 
@@ -157,7 +158,7 @@ class Alfworld(gym.Env):
                 bad_actions = list(past_admissible_actions)
                 bad_actions.remove(past_opt_action)
 
-                avoid_action = random.choice(bad_actions)
+                avoid_action = bad_actions[self.np_random.integers(len(bad_actions))]
 
                 if action == avoid_action:
                     feedback.hn = self.format(mistake_bad_action_descp, avoid_action=avoid_action)
@@ -191,7 +192,7 @@ class Alfworld(gym.Env):
                 bad_actions = list(admissible_actions)
                 bad_actions.remove(opt_action)
 
-                avoid_action = random.choice(bad_actions)
+                avoid_action = bad_actions[self.np_random.integers(len(bad_actions))]
 
                 feedback.fn = self.format(avoid_bad_action_descp, avoid_action=avoid_action)
 
@@ -1,11 +1,16 @@
 from typing import Dict, Any, Tuple, Union
 from llfbench.envs.llf_env import LLFWrapper
+from llfbench.envs.alfworld import prompts
+from llfbench.envs.utils import intern_templates
+from llfbench.envs.alfworld import INSTRUCTION_TYPES, FEEDBACK_TYPES
+
+intern_templates(prompts)  # add the templates to the bank of template ids
 
 
 class AlfworldWrapper(LLFWrapper):
 
     # Basic (b), partial (p), and complete (c)
-    INSTRUCTION_TYPES = ('b')        # ('b', 'p', 'c')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/alfworld/__init__.py
 
     # Feedback type:
     # n: none
@@ -15,7 +20,7 @@ class AlfworldWrapper(LLFWrapper):
     # hp: hindsight positive
     # fn: future negative
     # fp: future positive
-    FEEDBACK_TYPES = ('r', 'hn', 'hp', 'fn', 'fp')
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/alfworld/__init__.py
 
     def __init__(self, env, instruction_type, feedback_type):
         super().__init__(env, instruction_type, feedback_type)
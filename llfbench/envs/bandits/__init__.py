@@ -1,9 +1,4 @@
-import gym as old_gym
-import gymnasium as gym
-from gymnasium.envs.registration import register
-from llfbench.utils import generate_combinations_dict
-from llfbench.envs.bandits.wrapper import BanditGymWrapper
-import gym_bandits  # this is needed so that gym_bandits is registered
+from llfbench.envs.registration import register
 
 
 ENVIRONMENTS = (
@@ -17,12 +12,21 @@ ENVIRONMENTS = (
     'BanditTwoArmedLowLowFixed-v0',
 )
 
+# The metadata of BanditGymWrapper, which imports its INSTRUCTION_TYPES and FEEDBACK_TYPES
+# from here, used without building the env.
+INSTRUCTION_TYPES = ('b', 'p', 'c')
+FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp', 'fn')
+REWARD_RANGE = (0, 1.0)
+
 
 def make_env(env_name,
              instruction_type='b',
              feedback_type='a',
              ):
     """ Make the original env and wrap it with the LLFWrapper. """
+    import gym as old_gym
+    import gym_bandits  # this is needed so that gym_bandits is registered
+    from llfbench.envs.bandits.wrapper import BanditGymWrapper
     env = old_gym.make(env_name)  # env_name is the original env name of gym_bandits
     # we don't pass arguments here, because _reset in BanditGymWrapper calls __init__ of the env without arguments.
     return BanditGymWrapper(env, instruction_type=instruction_type, feedback_type=feedback_type)
@@ -33,5 +37,8 @@ for env_name in ENVIRONMENTS:
     register(
         id=f"llf-bandits-{env_name}",
         entry_point='llfbench.envs.bandits:make_env',
-        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b')
+        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b'),
+        instruction_types=INSTRUCTION_TYPES,
+        feedback_types=FEEDBACK_TYPES,
+        reward_range=REWARD_RANGE
     )
\ No newline at end of file
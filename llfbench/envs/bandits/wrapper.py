@@ -1,21 +1,30 @@
 from typing import SupportsFloat
 import gym as old_gym
+import copy
 import numpy as np
 from llfbench.envs.env_wrappers import TerminalFreeWrapper, RandomActionOrderWrapper, EnvCompatibility
 from llfbench.envs.llf_env import LLFWrapper, Feedback
+from llfbench.envs.utils import get_rng_state, set_rng_state, intern_templates, global_np_random
 from llfbench.envs.bandits.prompts import *
+from llfbench.envs.bandits import prompts
+from llfbench.envs.bandits import INSTRUCTION_TYPES, FEEDBACK_TYPES
+
+intern_templates(prompts)  # add the templates to the bank of template ids
 
 
 class BanditGymWrapper(LLFWrapper):
 
     """ This is a wrapper for gym_bandits. """
 
-    INSTRUCTION_TYPES = ('b', 'p', 'c')
-    FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp', 'fn')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/bandits/__init__.py
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/bandits/__init__.py
 
     def __init__(self, env, instruction_type, feedback_type):
         env = TerminalFreeWrapper(RandomActionOrderWrapper(EnvCompatibility(env)))
         super().__init__(env, instruction_type, feedback_type)
+        # gym_bandits samples from the global numpy random state, which
+        # follows this one while the bandit env is built or stepped.
+        self._bandit_rng = np.random.RandomState()
 
     @property
     def reward_range(self):
@@ -23,44 +32,67 @@ class BanditGymWrapper(LLFWrapper):
 
     def _reset(self, seed=None, options=None):
         options = options or {}
-        self._bandit_env.__init__(**options)  # gym_bandits implement the reset at the init for some reason.
+        self._bandit_rng = np.random.RandomState(seed)
+        with global_np_random(self._bandit_rng):
+            self._bandit_env.__init__(**options)  # gym_bandits implement the reset at the init for some reason.
         self.seed(seed)
         self.env.reset()  # bandit env has no observation
         docstring =  self._bandit_env.__doc__
         n_actions = self.env.action_space.n
         instruction = docstring +'\n' + self.format(b_instruction, low=0, high=n_actions-1)
         if self.instruction_type=='p':  # Give info of a bad action.
-            bad_action = np.random.choice(np.delete(np.arange(self.env.action_space.n), self._best_arm))
+            bad_action = self._paraphrase_rng.choice(np.delete(np.arange(self.env.action_space.n), self._best_arm))
             instruction += '\n'+self.format(p_instruction, bad_action=bad_action, reward=self._expected_reward(bad_action))
         if self.instruction_type=='c':
             instruction += '\n'+self.format(c_instruction, best_arm=self._best_arm)
         return dict(instruction=instruction, observation=None, feedback=None), {'success':False}
 
     def _step(self, action):
-        observation, reward, terminated, truncated, info = self.env.step(action)
+        with global_np_random(self._bandit_rng):
+            observation, reward, terminated, truncated, info = self.env.step(action)
         feedback = Feedback()
         feedback_type = self._feedback_type
 
+        requests = {}  # feedback type -> (prompts, kwargs), formatted together below
         if 'r' in feedback_type:  # reward feedback
-            feedback.r = self.format(r_feedback, reward=reward)  # base reward feedback
+            requests['r'] = (r_feedback, dict(reward=reward))  # base reward feedback
         if 'hp' in feedback_type:  # hindsight positive: explaination on why something is correct
             if action == self._best_arm:
-                feedback.hp = self.format(hp_feedback)
+                requests['hp'] = (hp_feedback, dict())
         if 'hn' in feedback_type:  # hindsight negative: explaination on why something is incorrect
             if action != self._best_arm:
-                feedback.hn = self.format(hn_feedback)
-        assert feedback.hn is None or feedback.hp is None, 'Cannot have both hp and hn feedback'
+                requests['hn'] = (hn_feedback, dict())
+        assert 'hn' not in requests or 'hp' not in requests, 'Cannot have both hp and hn feedback'
         if 'fp' in feedback_type:  # future positive: suggestion of things to do
-            feedback.fp = self.format(fp_feedback, best_arm=self._best_arm, reward=self._expected_reward(self._best_arm))
+            requests['fp'] = (fp_feedback, dict(best_arm=self._best_arm, reward=self._expected_reward(self._best_arm)))
         if 'fn' in feedback_type:  # future negative: suggestion of things to avoid
-            bad_action = np.random.choice(np.delete(np.arange(self.env.action_space.n), self._best_arm))
-            feedback.fn = self.format(fn_feedback, bad_action=bad_action, reward=self._expected_reward(bad_action))
+            bad_action = self._paraphrase_rng.choice(np.delete(np.arange(self.env.action_space.n), self._best_arm))
+            requests['fn'] = (fn_feedback, dict(bad_action=bad_action, reward=self._expected_reward(bad_action)))
+        for k, v in zip(requests, self.format_batch(list(requests.values()))):
+            feedback[k] = v
         observation = dict(instruction=None, observation=None, feedback=feedback)
 
         info['success'] = action==self._best_arm
 
         return observation, float(reward), terminated, truncated, info
 
+    def _get_state(self):
+        bandit_env = self._bandit_env
+        return dict(p_dist=copy.deepcopy(bandit_env.p_dist),
+                    r_dist=copy.deepcopy(bandit_env.r_dist),
+                    np_random=get_rng_state(bandit_env._np_random),
+                    bandit_rng=get_rng_state(self._bandit_rng),
+                    action_order=self.env.env.get_state())
+
+    def _set_state(self, state):
+        bandit_env = self._bandit_env
+        bandit_env.p_dist = copy.deepcopy(state['p_dist'])
+        bandit_env.r_dist = copy.deepcopy(state['r_dist'])
+        if state['np_random'] is not None:
+            set_rng_state(bandit_env.np_random, state['np_random'])
+        set_rng_state(self._bandit_rng, state['bandit_rng'])
+        self.env.env.set_state(state['action_order'])
+
     @property
     def _bandit_env(self): # This is hardcoded for gym_bandits
         env = self.env
@@ -1,5 +1,4 @@
 import gymnasium as gym
-import copy
 import numpy as np
 import random
 import traceback
@@ -7,6 +6,7 @@ import string
 import gym as old_gym
 from typing import Any, Optional
 from gymnasium.wrappers.compatibility import LegacyEnv
+from llfbench.envs.action_parser import ActionParser, ActionParseError
 
 
 def space_compatibility(old_space: old_gym.Space) -> gym.Space:
@@ -46,6 +46,7 @@ class EnvCompatibility(gym.wrappers.EnvCompatibility):
     """ This fixes the bugs that the original EnvCompatibility
         1. does not convert the observation and action space.
         2. does not pass the __getattr__ to the wrapped env.
+        3. does not use the np_random of the wrapped env.
     """
     def __init__(self, old_env: LegacyEnv, render_mode: Optional[str] = None):
         super().__init__(old_env, render_mode)
@@ -55,25 +56,30 @@ class EnvCompatibility(gym.wrappers.EnvCompatibility):
     def __getattr__(self, name: str) -> Any:  # The wrapped env should behave like the original env.
         return getattr(self.env, name)
 
+    @property
+    def np_random(self):  # The random generator of the original env, which is seeded by its seed method.
+        return self.env.np_random
+
+    @np_random.setter
+    def np_random(self, value):
+        self.env.np_random = value
+
 
 class TextWrapper(gym.Wrapper):
     # This is a wrapper that can be applied on top of LLFWrapper to turn into a text-based env.
     RMIN = 0.0  # TODO maybe get this from the env
 
+    def __init__(self, env):
+        super().__init__(env)
+        self.action_parser = ActionParser(env.action_space)
+
     def _parse_action(self, action):
         # parse action from string to internal action space
-        # TODO
-        if isinstance(self.env.action_space, gym.spaces.Discrete):
-            action = int(action)
-        elif isinstance(self.env.action_space, gym.spaces.Box):
-            locals_dict = {}
-            exec("action = np.array({})".format(action), globals(), locals_dict)
-            action = locals_dict['action']
-        elif isinstance(self.env.action_space, gym.spaces.Text):
-            pass
-        else:
-            raise NotImplementedError
-        return action
+        return self.action_parser.parse(action)
+
+    def parse_actions(self, actions):
+        """ Parse a batch of text actions; see ActionParser.parse_batch. """
+        return self.action_parser.parse_batch(actions)
 
     def _parse_observation(self, observation):
         # Maybe parse the observation dict to string?
@@ -83,11 +89,16 @@ class TextWrapper(gym.Wrapper):
     def step(self, action):
         assert type(action) == str
         try:
-            action = self._parse_action(action)
-            observation, reward, done, tuncated, info =  self.env.step(action)
-        except Exception as e:  # Treat the exception as feedback
-            if e == NotImplementedError:
-                raise NotImplementedError
+            parsed_action = self._parse_action(action)
+        except ActionParseError as e:  # Treat the parse error as feedback
+            observation = dict(instruction=None, observation=None, feedback=str(e))
+            info = {'success': False, 'parse_error': e.asdict()}
+            return self._parse_observation(observation), self.RMIN, False, False, info
+        try:
+            observation, reward, done, tuncated, info = self.env.step(parsed_action)
+        except NotImplementedError:
+            raise
+        except Exception:  # Treat the exception as feedback
             feedback = f"Cannot parse action {action}.\n{traceback.format_exc()}"
             observation = dict(instruction=None, observation=None, feedback=feedback)
             reward = self.RMIN
@@ -104,16 +115,27 @@ class TerminalFreeWrapper(gym.Wrapper):
         return observation, reward, False, False, info
 
 class RandomActionOrderWrapper(gym.Wrapper):
+    """
+        Shuffle the order of the actions of a Discrete action space at every
+        reset. The permutation is drawn from the np_random of the wrapped env,
+        and internal_action and external_action also accept arrays of actions.
+    """
 
     def __init__(self, env):
         assert isinstance(env.action_space, gym.spaces.Discrete)
         super().__init__(env)
-        self.__action_table = None
+        self.__permutation = None  # external action -> internal action
+        self.__inverse = None  # internal action -> external action
 
     def reset(self, *, seed=None, options=None):
-        self.__action_table = [i for i in range(self.env.action_space.n)]
-        np.random.shuffle(self.__action_table)
-        return self.env.reset(seed=seed, options=options)
+        observation, info = self.env.reset(seed=seed, options=options)
+        self.__set_permutation(self.np_random.permutation(self.env.action_space.n))
+        return observation, info
+
+    def __set_permutation(self, permutation):
+        self.__permutation = permutation
+        self.__inverse = np.empty_like(permutation)
+        self.__inverse[permutation] = np.arange(len(permutation))
 
     def step(self, action):
         action = self.internal_action(action)
@@ -121,35 +143,99 @@ class RandomActionOrderWrapper(gym.Wrapper):
 
     def internal_action(self, action):
         # map action from the external action space to the internal action space
-        return self.__action_table[action]
+        action = self.__permutation[action]
+        return int(action) if action.ndim == 0 else action
 
     def external_action(self, action):
         # map action from the internal action space to the external action space
-        return self.__action_table.index(action)
+        action = self.__inverse[action]
+        return int(action) if action.ndim == 0 else action
+
+    def get_state(self):
+        return self.__permutation.copy()
+
+    def set_state(self, state):
+        self.__set_permutation(np.array(state))
 
 
 class FullInformationWrapper(gym.Wrapper):
     """
-        This wrapper assumes env supports pickle serialization.
+        Add the outcome of every action to info['oracle_info'] at reset and
+        step, i.e., a dict mapping each action of the Discrete action space to
+        the observation, reward, terminated, truncated and (verbalized)
+        feedback that taking the action would give.
+
+        The outcomes are computed by branching from a snapshot of the env (see
+        LLFWrapper.get_state), which is restored afterwards, so the oracle does
+        not change the rollout. With n_workers > 1, the actions are evaluated on
+        a pool of worker processes, each of which holds an env created by
+        env_fn, e.g., functools.partial(llfbench.make, env_name). The env made
+        by env_fn must have the same instruction and feedback types as env.
     """
-    def __init__(self, env):
+    def __init__(self, env, n_workers: int = 1, env_fn=None, context=None):
         assert isinstance(env.action_space, gym.spaces.Discrete)
         super().__init__(env)
+        self._pool = None
+        if n_workers > 1:
+            assert env_fn is not None, 'env_fn is needed to create the envs of the workers.'
+            from llfbench.envs.vector_env import LLFVectorEnv
+            self._pool = LLFVectorEnv([env_fn] * min(n_workers, env.action_space.n), asynchronous=True,
+                                      autoreset=False, context=context)
+            self._pool.reset()  # the envs can be stepped only after a reset
+
+    def _get_state(self):
+        return self.env.get_wrapper_attr('get_state')()
+
+    def _set_state(self, state):
+        self.env.get_wrapper_attr('set_state')(state)
 
     def oracle_info(self):
-        full_information = dict()
-        for i in range(self.env.action_space.n):
-            env = copy.deepcopy(self.env)
-            observation, reward, terminal, info = env.step(i)
-            full_information[i] = dict(
-                observation=observation,
-                reward=reward,
-                terminal=terminal,
-                feedback=info['feedback'],
-            )
-        return full_information
+        actions = list(range(self.env.action_space.n))
+        state = self._get_state()
+        if self._pool is None:
+            outcomes = []
+            # the look-ahead steps are not timed nor recorded, like the state they are restored
+            with self.env.get_wrapper_attr('suspend_instrumentation')():
+                for action in actions:
+                    self._set_state(state)
+                    observation, reward, terminated, truncated, _ = self.env.step(action)
+                    outcomes.append((observation, reward, terminated, truncated))
+            self._set_state(state)
+        else:
+            outcomes = self._pool_outcomes(state, actions)
+        return {action: dict(observation=observation,
+                             reward=reward,
+                             terminated=terminated,
+                             truncated=truncated,
+                             feedback=observation['feedback'])
+                for action, (observation, reward, terminated, truncated) in zip(actions, outcomes)}
+
+    def _pool_outcomes(self, state, actions):
+        # Evaluate the actions in rounds of one action per worker; the last
+        # round is padded with the first action.
+        n = self._pool.num_envs
+        outcomes = []
+        for i in range(0, len(actions), n):
+            batch = actions[i:i + n]
+            self._pool.call('set_state', state)
+            observations, rewards, terminated, truncated, _ = self._pool.step(batch + [actions[0]] * (n - len(batch)))
+            for j in range(len(batch)):
+                observation = {k: v[j] for k, v in observations.items()}
+                outcomes.append((observation, float(rewards[j]), bool(terminated[j]), bool(truncated[j])))
+        return outcomes
+
+    def reset(self, *, seed=None, options=None):
+        observation, info = self.env.reset(seed=seed, options=options)
+        info['oracle_info'] = self.oracle_info()
+        return observation, info
 
     def step(self, action):
         observation, reward, terminated, truncated, info = self.env.step(action)
         info['oracle_info'] = self.oracle_info()
         return observation, reward, terminated, truncated, info
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        return super().close()
@@ -1,12 +1,16 @@
-from gymnasium.envs.registration import register
-from llfbench.envs.gridworld.gridworld import Gridworld
-from llfbench.envs.gridworld.wrapper import GridworldWrapper
+from llfbench.envs.registration import register
 
 
 ENVIRONMENTS = (
     'gridworld-v0',
 )
 
+# The metadata of GridworldWrapper, which imports its INSTRUCTION_TYPES and FEEDBACK_TYPES
+# from here, used without building the env.
+INSTRUCTION_TYPES = ('b', 'p', 'c')
+FEEDBACK_TYPES = ('r', 'hn', 'hp', 'fn', 'fp')
+REWARD_RANGE = (0, 1.0)
+
 
 def make_env(env_name,
              instruction_type='b',
@@ -14,6 +18,8 @@ def make_env(env_name,
              ):
 
     """ Make the original env and wrap it with the LLFWrapper. """
+    from llfbench.envs.gridworld.gridworld import Gridworld
+    from llfbench.envs.gridworld.wrapper import GridworldWrapper
     env = Gridworld(instruction_type=instruction_type, feedback_type=feedback_type)
     # we don't pass arguments here, because _reset in BanditGymWrapper calls __init__ of the env without arguments.
     return GridworldWrapper(env, instruction_type=instruction_type, feedback_type=feedback_type)
@@ -24,5 +30,8 @@ for env_name in ENVIRONMENTS:
     register(
         id=f"llf-{env_name}",
         entry_point='llfbench.envs.gridworld:make_env',
-        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b')
+        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b'),
+        instruction_types=INSTRUCTION_TYPES,
+        feedback_types=FEEDBACK_TYPES,
+        reward_range=REWARD_RANGE
     )
@@ -8,12 +8,14 @@ from llfbench.envs.gridworld import prompts
 from llfbench.envs.gridworld.room import Room
 from llfbench.envs.gridworld.scene import Scene
 from llfbench.envs.llf_env import Feedback
+from llfbench.envs.utils import get_rng_state, set_rng_state
+from llfbench.envs.gridworld import INSTRUCTION_TYPES, FEEDBACK_TYPES
 
 
 class Gridworld(gym.Env):
 
     # Basic (b), partial (p), and complete (c)
-    INSTRUCTION_TYPES = ('b', 'p', 'c')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/gridworld/__init__.py
 
     # Feedback type:
     # r: reward
@@ -21,7 +23,7 @@ class Gridworld(gym.Env):
     # hp: hindsight positive
     # fn: future negative
     # fp: future positive
-    FEEDBACK_TYPES = ('r', 'hn', 'hp', 'fn', 'fp')
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/gridworld/__init__.py
 
     # feedback_level="gold"
     def __init__(self, num_rooms=20, horizon=20, fixed=True, instruction_type="c", feedback_type="hp", min_goal_dist=4):
@@ -44,6 +46,10 @@ class Gridworld(gym.Env):
 
         self.fixed = fixed
 
+        # The env has its own random generator so that it is not affected by
+        # other envs in the same process.
+        self.random = random.Random()
+
         # Counters that may have to be reset
         self.instruction = None
         self.current_timestep = 0.0
@@ -52,7 +58,25 @@ class Gridworld(gym.Env):
         self.goal_prev_visited = False
 
     def seed(self, seed=None):
-        random.seed(seed)
+        self.random.seed(seed)
+
+    def get_state(self):
+        # The scene is not modified within an episode, so it is shared rather
+        # than copied.
+        return dict(scene=self.current_scene,
+                    room=self.current_room,
+                    timestep=self.current_timestep,
+                    goal_prev_visited=self.goal_prev_visited,
+                    instruction=self.instruction,
+                    random=get_rng_state(self.random))
+
+    def set_state(self, state):
+        self.current_scene = state['scene']
+        self.current_room = state['room']
+        self.current_timestep = state['timestep']
+        self.goal_prev_visited = state['goal_prev_visited']
+        self.instruction = state['instruction']
+        set_rng_state(self.random, state['random'])
 
     def make_scene(self):
 
@@ -60,7 +84,7 @@ class Gridworld(gym.Env):
         # We start by creating a room
         # We add between 1-4 edges, we create new rooms and add them to the queue
 
-        scene = Scene()
+        scene = Scene(rng=self.random)
         queue = deque()
 
         room = scene.create_random_empty_room(pos=(0, 0))
@@ -80,8 +104,8 @@ class Gridworld(gym.Env):
                 # All directions from this room has been connected
                 continue
 
-            num_dir = random.randint(1, len(available_directions) - 1)
-            chosen_directions = random.sample(available_directions, k=num_dir)
+            num_dir = self.random.randint(1, len(available_directions) - 1)
+            chosen_directions = self.random.sample(available_directions, k=num_dir)
 
             for i, dir_to in enumerate(chosen_directions):
 
@@ -97,11 +121,11 @@ class Gridworld(gym.Env):
                     break
 
         indices = list(range(0, scene.num_rooms()))
-        random.shuffle(indices)
+        self.random.shuffle(indices)
 
         for i in indices:
-            if len(available_objects) > 0 and random.random() < 0.25:
-                obj = random.choice(available_objects)
+            if len(available_objects) > 0 and self.random.random() < 0.25:
+                obj = self.random.choice(available_objects)
                 room = scene.get_room(i)
                 room.add_object(obj=obj)
                 available_objects.remove(obj)
@@ -109,7 +133,7 @@ class Gridworld(gym.Env):
         # Add start room
         rooms = scene.get_rooms()
 
-        goal_room = random.choice(rooms)
+        goal_room = self.random.choice(rooms)
         goal_room.add_goal()
         scene.get_add_goal_room(goal_room=goal_room)
 
@@ -123,7 +147,7 @@ class Gridworld(gym.Env):
         if len(rooms) == 0:
             rooms = [ngbr_room for ngbr_room, path in scene.bfs_path.items() if ngbr_room != goal_room]
 
-        start_room = random.choice(rooms)
+        start_room = self.random.choice(rooms)
         scene.get_add_start_room(start_room=start_room)
 
         return scene
@@ -199,7 +223,7 @@ class Gridworld(gym.Env):
                                    f"room {room.get_name()} which has treasure.")
 
         if partial:
-            r = 0.4 + random.random() * 0.2
+            r = 0.4 + self.random.random() * 0.2
             partial_len = int(len(path_descps) * r)
             opt_path_desc = " ".join(path_descps[:partial_len])
         else:
@@ -286,7 +310,7 @@ class Gridworld(gym.Env):
 
                 all_wrong_directions = list(Scene.DIRECTIONS)
                 all_wrong_directions.remove(old_gold_action)
-                avoid_action = random.choice(all_wrong_directions)
+                avoid_action = self.random.choice(all_wrong_directions)
 
                 if avoid_action != Scene.DIRECTIONS[action]:
                     feedback.hn = self.format(prompts.hn_success_descp, avoid_action=avoid_action)
@@ -323,7 +347,7 @@ class Gridworld(gym.Env):
                 all_directions = list(Scene.DIRECTIONS)
                 all_directions.remove(gold_action)
 
-                avoid_action = random.choice(all_directions)
+                avoid_action = self.random.choice(all_directions)
 
                 feedback.fn = self.format(prompts.fn, avoid_action=avoid_action, new_room=self.current_room.get_name())
 
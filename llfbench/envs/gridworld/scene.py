@@ -12,7 +12,8 @@ class Scene:
     SOUTH = "south"  # Action 3
     DIRECTIONS = [NORTH, EAST, WEST, SOUTH]
 
-    def __init__(self):
+    def __init__(self, rng=random):
+        self.rng = rng  # a random.Random instance, or the random module
         self.rooms = []
 
         self.start_room = None
@@ -57,7 +58,7 @@ class Scene:
 
     def create_random_empty_room(self, pos):
 
-        room_type = random.choice(Room.ROOM_TYPES)
+        room_type = self.rng.choice(Room.ROOM_TYPES)
 
         if room_type not in self.room_ctr:
             self.room_ctr[room_type] = 0
@@ -1,11 +1,16 @@
 from typing import Dict, Any, Tuple, Union
 from llfbench.envs.llf_env import LLFWrapper
+from llfbench.envs.gridworld import prompts
+from llfbench.envs.utils import intern_templates
+from llfbench.envs.gridworld import INSTRUCTION_TYPES, FEEDBACK_TYPES
+
+intern_templates(prompts)  # add the templates to the bank of template ids
 
 
 class GridworldWrapper(LLFWrapper):
 
     # Basic (b), partial (p), and complete (c)
-    INSTRUCTION_TYPES = ('b', 'p', 'c')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/gridworld/__init__.py
 
     # Feedback type:
     # n: none
@@ -15,7 +20,7 @@ class GridworldWrapper(LLFWrapper):
     # hp: hindsight positive
     # fn: future negative
     # fp: future positive
-    FEEDBACK_TYPES = ('r', 'hn', 'hp', 'fn', 'fp')
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/gridworld/__init__.py
 
     def __init__(self, env, instruction_type, feedback_type):
         super().__init__(env, instruction_type, feedback_type)
@@ -44,3 +49,9 @@ class GridworldWrapper(LLFWrapper):
         self.env.instruction_type = self.instruction_type
         self.env.feedback_type = self._feedback_type
         return self.env.step(action)
+
+    def _get_state(self):
+        return self.env.get_state()
+
+    def _set_state(self, state):
+        self.env.set_state(state)
@@ -1,18 +1,24 @@
 import gymnasium as gym
-from gymnasium.envs.registration import register
-from llfbench.utils import generate_combinations_dict
-from llfbench.envs.highway.wrapper import HighwayWrapper
+from llfbench.envs.registration import register
 
 ENVIRONMENTS = (
     'parking-v0',
 )
 
+# The metadata of HighwayWrapper, which imports its INSTRUCTION_TYPES and FEEDBACK_TYPES
+# from here, used without building the env. The reward range is computed from
+# the default config of parking-v0, i.e. ((collision_reward - 1) * controlled_vehicles, 0.0).
+INSTRUCTION_TYPES = ('b',)
+FEEDBACK_TYPES = ('r', 'hp', 'hn')
+REWARD_RANGE = (-6.0, 0.0)
+
 
 def make_env(env_name,
              instruction_type='b',
              feedback_type='a',
              ):
     """ Make the original env and wrap it with the LLFWrapper. """
+    from llfbench.envs.highway.wrapper import HighwayWrapper
     env = gym.make(env_name)
     return HighwayWrapper(env, instruction_type=instruction_type, feedback_type=feedback_type)
 
@@ -21,5 +27,8 @@ for env_name in ENVIRONMENTS:
     register(
         id=f"llf-highway-{env_name}",
         entry_point='llfbench.envs.highway:make_env',
-        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b')
+        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b'),
+        instruction_types=INSTRUCTION_TYPES,
+        feedback_types=FEEDBACK_TYPES,
+        reward_range=REWARD_RANGE
     )
\ No newline at end of file
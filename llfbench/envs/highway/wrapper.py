@@ -1,15 +1,25 @@
+import copy
 import numpy as np
 import json
 from llfbench.envs.llf_env import LLFWrapper, Feedback
+from llfbench.envs.utils import get_rng_state, set_rng_state, intern_templates
 from llfbench.envs.highway.prompts import *
+from llfbench.envs.highway import prompts
+from llfbench.envs.highway import INSTRUCTION_TYPES, FEEDBACK_TYPES
+
+intern_templates(prompts)  # add the templates to the bank of template ids
 
 
 class HighwayWrapper(LLFWrapper):
 
     """ This is a wrapper for highway-env. """
 
-    INSTRUCTION_TYPES = ('b')
-    FEEDBACK_TYPES = ('r', 'hp', 'hn')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/highway/__init__.py
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/highway/__init__.py
+
+    # The attributes of the vehicles and objects that change within an episode.
+    OBJECT_STATE_ATTRIBUTES = ('position', 'heading', 'speed', 'lane_index', 'lane', 'crashed', 'hit', 'impact',
+                               'action', 'history', 'log')
 
     def __init__(self, env, instruction_type, feedback_type):
         super().__init__(env, instruction_type, feedback_type)
@@ -50,6 +60,44 @@ class HighwayWrapper(LLFWrapper):
 
         return return_observation, reward, terminated, truncated, info
 
+    def _get_state(self):
+        # The road, its objects, and the action and observation types are
+        # rebuilt at every reset, so the snapshot keeps references to them
+        # together with the dynamic attributes of the objects.
+        env = self.env.unwrapped
+        road = env.road
+        objects = [(obj, {k: copy.copy(getattr(obj, k)) for k in self.OBJECT_STATE_ATTRIBUTES if hasattr(obj, k)})
+                   for obj in road.vehicles + road.objects]
+        return dict(road=road,
+                    vehicles=list(road.vehicles),
+                    objects=list(road.objects),
+                    controlled_vehicles=list(env.controlled_vehicles),
+                    goal=getattr(env, 'goal', None),
+                    action_type=env.action_type,
+                    observation_type=env.observation_type,
+                    object_states=objects,
+                    time=env.time,
+                    steps=env.steps,
+                    done=env.done,
+                    last_action=copy.copy(getattr(env.action_type, 'last_action', None)),
+                    np_random=get_rng_state(env.np_random))
+
+    def _set_state(self, state):
+        env = self.env.unwrapped
+        env.road = state['road']
+        env.road.vehicles = list(state['vehicles'])
+        env.road.objects = list(state['objects'])
+        env.controlled_vehicles = list(state['controlled_vehicles'])
+        env.goal = state['goal']
+        env.action_type, env.observation_type = state['action_type'], state['observation_type']
+        for obj, attributes in state['object_states']:
+            for k, v in attributes.items():
+                setattr(obj, k, copy.copy(v))
+        env.time, env.steps, env.done = state['time'], state['steps'], state['done']
+        if state['last_action'] is not None:
+            env.action_type.last_action = copy.copy(state['last_action'])
+        set_rng_state(env.np_random, state['np_random'])
+
     def textualize_observation(self, observation):
         text_observation = 'Desired goal:' + np.array2string(observation['desired_goal'], precision=3)
         #text_observation += '\nAchieved goal:' + np.array2string(observation['achieved_goal'], precision=3)
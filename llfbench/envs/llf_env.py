@@ -1,8 +1,9 @@
 import gymnasium as gym
 import numpy as np
-from typing import Dict, Any, Tuple, Union, List, Callable, Set
-from llfbench.envs.utils import format
-import parse
+import contextlib
+from typing import Dict, Any, Tuple, Union, List, Callable, Set, NamedTuple, Iterable
+from llfbench.envs.utils import sample_template_indices, compile_template, template_id, get_rng_state, set_rng_state
+from llfbench.envs.timing import StageTimer
 import sys, string
 
 """
@@ -29,15 +30,17 @@ An example env name is: gridworld-b-fn-v0
 
 """
 
-from dataclasses import dataclass, asdict
-
-@dataclass
 class Feedback:
-    r: Union[str,None] = None
-    hp: Union[str,None] = None
-    hn: Union[str,None] = None
-    fp: Union[str,None] = None
-    fn: Union[str,None] = None
+    """ The feedback of a step, one field per feedback type.
+
+        Feedback is created and verbalized at every step, so it is a slotted
+        record: fields are read and written in O(1) via attributes or keys,
+        e.g. feedback.hp or feedback['hp'], and `items` iterates over the
+        fields without copying them.
+    """
+
+    FIELDS = ('r', 'hp', 'hn', 'fp', 'fn')
+    __slots__ = FIELDS
 
     def __init__(self, r=None, hp=None, hn=None, fp=None, fn=None):
         self.r = r
@@ -46,23 +49,57 @@ class Feedback:
         self.fp = fp
         self.fn = fn
 
+    def items(self):
+        """ Iterate over (feedback type, value) pairs in the order of FIELDS. """
+        for k in self.FIELDS:
+            yield k, getattr(self, k)
+
     def asdict(self):
         """
         get a python dictionary
         """
-        return asdict(self)
+        return {k: getattr(self, k) for k in self.FIELDS}
 
     def __setitem__(self, k, v):
         setattr(self, k, v)
 
     def __getitem__(self, k):
-        return eval(f"self.{k}")
+        return getattr(self, k)
 
     def __delitem__(self, k):
         self[k] = None
 
     def __contains__(self, item):
-        return item in self.__dict__
+        return item in self.FIELDS
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.FIELDS)
+
+    __hash__ = None  # mutable, like the dataclass it replaces
+
+    def __repr__(self):
+        return 'Feedback(' + ', '.join(f'{k}={getattr(self, k)!r}' for k in self.FIELDS) + ')'
+
+
+class FeedbackTemplate(NamedTuple):
+    """ Structured feedback emitted by a base environment.
+
+        `key` is the name of a set of paraphrased prompts in the prompts module
+        of the environment (LLFWrapper.PROMPTS), and `kwargs` are used to
+        format the selected prompt. This lets LLFWrapper paraphrase the
+        feedback directly, instead of parsing an English sentence back with
+        `reformat`.
+
+        A field of a didactic Feedback can be a string, a FeedbackTemplate, or
+        a list of strings and FeedbackTemplates, which are concatenated after
+        rendering.
+    """
+    key: str
+    kwargs: Dict[str, Any]
+
+FeedbackValue = Union[None, str, FeedbackTemplate, List[Union[str, FeedbackTemplate]]]
 
 class LLFWrapper(gym.Wrapper):
     """
@@ -102,6 +139,18 @@ class LLFWrapper(gym.Wrapper):
     INSTRUCTION_TYPES = ('b', 'p', 'c')
     FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp', 'fn')  # these are the basic feedback types
 
+    # The module of paraphrased prompts that FeedbackTemplate keys refer to.
+    PROMPTS = None
+
+    # The stage timer, which is None unless enable_timing is called.
+    _timer = None
+    _attach_timing = False
+
+    # The (template_id, kwargs, rendered text) of the templates formatted in
+    # the current reset or step, which is None unless enable_template_records
+    # is called.
+    _template_records = None
+
     # r: reward,
     # hp: hindsight positive
     # hn: hindsight negative
@@ -129,6 +178,9 @@ class LLFWrapper(gym.Wrapper):
         self.set_instruction_type(instruction_type) # This is the external api.
         self.set_feedback_type(feedback_type)  # This is the external api.
         self.set_paraphrase_method('random')
+        # Each env owns its random generator for paraphrasing and sampling
+        # feedback types, so envs sharing a process don't affect each other.
+        self._paraphrase_rng = np.random.default_rng()
         self.observation_space = gym.spaces.Dict({"observation": self.env.observation_space,
                                                   "feedback": gym.spaces.Text(sys.maxsize, charset=string.printable),
                                                   "instruction": gym.spaces.Text(sys.maxsize, charset=string.printable)})
@@ -188,7 +240,7 @@ class LLFWrapper(gym.Wrapper):
         if feedback_type == 'a': # using auto
             feedback_type = set(self.FEEDBACK_TYPES)  # need to compute all
         if feedback_type == 'm': # using mixture  # TODO a better name
-            feedback_type = set([np.random.choice(list(set(self.FEEDBACK_TYPES)))])  # str
+            feedback_type = set([self.FEEDBACK_TYPES[self._paraphrase_rng.integers(len(self.FEEDBACK_TYPES))]])  # str
         assert isinstance(feedback_type, set)
         # At this point, it should be a subset of FEEDBACK_TYPES.
         for f in feedback_type:
@@ -212,12 +264,164 @@ class LLFWrapper(gym.Wrapper):
         assert method == 'random' or type(method) == int or callable(method)
         self._paraphrase_method = method
 
+    def enable_timing(self, attach_to_info: bool = False):
+        """ Time the stages of reset and step, i.e.,
+
+            - 'reset': _reset
+            - 'step': _step
+            - 'paraphrase': format and format_batch (also used by reformat
+              and render_templates)
+            - 'verbalize': _verbalize_feedback
+            - 'obs_check': obs_check
+
+            Stages can be nested, e.g., 'step' includes the 'paraphrase' done in
+            _step. Calling this again clears the collected stats.
+
+            Args:
+                attach_to_info: Whether to add the durations of the stages of
+                each reset and step to info['timing'].
+        """
+        self._timer = StageTimer()
+        self._attach_timing = attach_to_info
+
+    def disable_timing(self):
+        self._timer = None
+        self._attach_timing = False
+
+    def timing_stats(self) -> Dict[str, Dict[str, Any]]:
+        """ Return the count, total, mean, min, max, and histogram of the
+            durations (in seconds) of each stage. See enable_timing.
+        """
+        return {} if self._timer is None else self._timer.stats()
+
+    def enable_template_records(self):
+        """ Add the (template_id, field, kwargs) of every template formatted
+            in a reset or step to info['templates'], in the order they are
+            formatted. The template of an id is given by
+            llfbench.envs.utils.get_template, so the records can be logged
+            instead of (or next to) the rendered text (see TraceRecorder), and
+            grouped by template.
+
+            field is the feedback type (r, hp, hn, fp, fn) of the feedback, or
+            'instruction' or 'observation', in which the rendered template
+            is, or None if it is in none of them.
+
+            The templates selected by a callable paraphrase method are not
+            recorded.
+        """
+        self._template_records = []
+
+    def disable_template_records(self):
+        self._template_records = None
+
+    @contextlib.contextmanager
+    def suspend_instrumentation(self):
+        """ Neither time nor record the templates of the resets and steps in
+            this context, e.g. the look-ahead steps of FullInformationWrapper,
+            which the agent does not take. The timing stats and the template
+            records of the last reset or step are left as they were.
+        """
+        timer, records = self._timer, self._template_records
+        self._timer, self._template_records = None, None
+        try:
+            yield
+        finally:
+            self._timer, self._template_records = timer, records
+
+    def _tag_template_records(self, observation: Dict[str, Any], feedback: Union[Feedback, None] = None) \
+            -> List[Tuple[int, Union[str, None], Dict[str, Any]]]:
+        # Tag each record with the first field whose text contains the
+        # rendered template (the feedback before it is verbalized).
+        fields = [] if feedback is None else [(k, v) for k, v in feedback.items() if isinstance(v, str)]
+        fields += [(k, observation[k]) for k in ('instruction', 'observation') if isinstance(observation[k], str)]
+        return [(tid, next((k for k, text in fields if rendered and rendered in text), None), kwargs)
+                for tid, kwargs, rendered in self._template_records]
+
     def format(self, prompts: List[str], **kwargs) -> str:
         """ A helper method for selecting from a set of paraphrased prompts."""
+        if self._timer is not None:
+            start = self._timer.now()
+        if callable(self.paraphrase_method):
+            formatted = self.paraphrase_method(prompts, **kwargs)  # This essentially overrides `format` method.
+        else:
+            template = prompts[sample_template_indices([len(prompts)], self.paraphrase_method,
+                                                       rng=self._paraphrase_rng)[0]]
+            formatted = template.format(**kwargs)
+            if self._template_records is not None:
+                self._template_records.append((template_id(template), kwargs, formatted))
+        if self._timer is not None:
+            self._timer.record('paraphrase', start)
+        return formatted
+
+    def format_batch(self, requests: List[Tuple[List[str], Dict[str, Any]]]) -> List[str]:
+        """ Format many sets of paraphrased prompts at once, e.g., all the
+            feedback of a step. The templates are selected with a single call
+            to the random generator.
+
+            Args:
+                requests: A list of (prompts, kwargs) pairs.
+
+            Returns:
+                A list of formatted strings, one for each request.
+        """
+        if len(requests) == 0:
+            return []
+        if self._timer is not None:
+            start = self._timer.now()
         if callable(self.paraphrase_method):
-            return self.paraphrase_method(prompts, **kwargs)  # This essentially overrides `format` method.
+            formatted = [self.paraphrase_method(prompts, **kwargs) for prompts, kwargs in requests]
         else:
-            return format(prompts, self.paraphrase_method, **kwargs)
+            indices = sample_template_indices([len(prompts) for prompts, _ in requests],
+                                              self.paraphrase_method, rng=self._paraphrase_rng)
+            formatted = [prompts[i].format(**kwargs) for i, (prompts, kwargs) in zip(indices, requests)]
+            if self._template_records is not None:
+                self._template_records.extend((template_id(prompts[i]), kwargs, text)
+                                              for i, (prompts, kwargs), text in zip(indices, requests, formatted))
+        if self._timer is not None:
+            self._timer.record('paraphrase', start)
+        return formatted
+
+    def render_templates(self, values: List[FeedbackValue]) -> List[Union[str, None]]:
+        """ Render structured feedback values into strings.
+
+            The templates of all the values are selected in a single call (see
+            format_batch). None and empty values are rendered as None.
+
+            Args:
+                values: A list of strings, FeedbackTemplates, or lists of them.
+        """
+        parts, requests = [], []
+        for value in values:
+            if value is None or (not isinstance(value, FeedbackTemplate) and len(value) == 0):
+                parts.append(None)
+                continue
+            if not isinstance(value, list):
+                value = [value]
+            part = []
+            for segment in value:
+                if isinstance(segment, FeedbackTemplate):
+                    part.append(len(requests))  # placeholder of the rendered template
+                    requests.append((getattr(self.PROMPTS, segment.key), segment.kwargs))
+                else:
+                    part.append(segment)
+            parts.append(part)
+        rendered = self.format_batch(requests)
+        return [None if part is None else ''.join(rendered[s] if isinstance(s, int) else s for s in part)
+                for part in parts]
+
+    def render_feedback(self, feedback: Feedback, feedback_type: Union[Iterable[str], None] = None) -> Feedback:
+        """ Render a didactic Feedback, whose fields may be structured, into a
+            Feedback of strings.
+
+            Args:
+                feedback: The didactic Feedback from the base environment.
+
+                feedback_type: The feedback types to render. The other fields
+                are set to None. If None, all the fields are rendered.
+        """
+        keys = [k for k in Feedback.FIELDS if feedback_type is None or k in feedback_type]
+        rendered = self.render_templates([feedback[k] for k in keys])
+        return Feedback(**dict(zip(keys, rendered)))
 
     def reformat(self, original: Union[str, None], prompts: List[str], template=None) -> str:
         """ A helper method for reformatting a string using a template.
@@ -246,7 +450,7 @@ class LLFWrapper(gym.Wrapper):
         if original is None:
             return original
         template = template or prompts[0]
-        parsed = parse.search(template, original)
+        parsed = compile_template(template).search(original)
         if parsed is None:
             paraphrased = original
         else:
@@ -264,9 +468,24 @@ class LLFWrapper(gym.Wrapper):
 
     def reset(self, *, seed : Union[int,None] = None, options : Union[Dict[str, Any],None] = None) -> Tuple[Union[str, Dict[str, str]], Dict[str, Any]]:
         """ Reset the environment and return the initial observation."""
-        np.random.seed(seed)  # for paraphrasing
-        observation, info = self._reset(seed=seed, options=options)
-        self.obs_check(observation)
+        self._paraphrase_rng = np.random.default_rng(seed)  # for paraphrasing
+        if self._template_records is not None:
+            self._template_records = []
+        timer = self._timer
+        if timer is None:
+            observation, info = self._reset(seed=seed, options=options)
+            self.obs_check(observation)
+        else:
+            timer.begin()
+            start = timer.now()
+            observation, info = self._reset(seed=seed, options=options)
+            start = timer.record('reset', start)
+            self.obs_check(observation)
+            timer.record('obs_check', start)
+            if self._attach_timing:
+                info['timing'] = timer.current()
+        if self._template_records is not None:
+            info['templates'] = self._tag_template_records(observation)
         assert observation['feedback'] is None, "The feedback must be None in the initial observation."
         assert observation['instruction'] is not None, "The instruction must be provided in the initial observation."
         assert info['success'] is False, "The info['success'] must be False in the initial observation."
@@ -286,10 +505,30 @@ class LLFWrapper(gym.Wrapper):
 
     def step(self, action: Any) -> Tuple[Dict[str, Any], float, bool, bool,  Dict[str, Any]]:
         """ Step the environment and return the observation, reward, terminal, and info."""
-        observation, reward, terminal, truncated, info = self._step(action)
-        self.obs_check(observation)
-        if observation['feedback'] is not None:
-            observation['feedback'] = self._verbalize_feedback(observation['feedback'])
+        if self._template_records is not None:
+            self._template_records = []
+        timer = self._timer
+        if timer is None:
+            observation, reward, terminal, truncated, info = self._step(action)
+            self.obs_check(observation)
+            feedback = observation['feedback']
+            if observation['feedback'] is not None:
+                observation['feedback'] = self._verbalize_feedback(observation['feedback'])
+        else:
+            timer.begin()
+            start = timer.now()
+            observation, reward, terminal, truncated, info = self._step(action)
+            start = timer.record('step', start)
+            self.obs_check(observation)
+            start = timer.record('obs_check', start)
+            feedback = observation['feedback']
+            if observation['feedback'] is not None:
+                observation['feedback'] = self._verbalize_feedback(observation['feedback'])
+                timer.record('verbalize', start)
+            if self._attach_timing:
+                info['timing'] = timer.current()
+        if self._template_records is not None:
+            info['templates'] = self._tag_template_records(observation, feedback)
         assert 'success' in info
         return observation, reward, terminal, truncated, info
 
@@ -313,12 +552,43 @@ class LLFWrapper(gym.Wrapper):
         """
         raise NotImplementedError
 
+    def get_state(self) -> Dict[str, Any]:
+        """ Return a snapshot of the env, which can be restored by set_state,
+            e.g., to branch from the current step. The snapshot includes the
+            state of the random generators, so the restored env produces the
+            same observations and feedback as the env would have.
+        """
+        return dict(paraphrase_rng=get_rng_state(self._paraphrase_rng), env=self._get_state())
+
+    def set_state(self, state: Dict[str, Any]):
+        """ Restore a snapshot returned by get_state. The snapshot is not
+            modified, so it can be restored many times.
+        """
+        set_rng_state(self._paraphrase_rng, state['paraphrase_rng'])
+        self._set_state(state['env'])
+
+    def _get_state(self) -> Any:
+        """ Implement this in the subclass.
+
+            Returns:
+                A compact snapshot of the wrapped env (and of any state kept by
+                the subclass), e.g., positions and counters instead of a deep
+                copy of the env.
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support get_state.')
+
+    def _set_state(self, state: Any):
+        """ Implement this in the subclass to restore the snapshot returned by
+            _get_state.
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support set_state.')
+
     def _verbalize_feedback(self, feedback_dict: Feedback) -> str:
         """ Implement this in the subclass to get the desired feedback string.
         """
 
         feedback = []
-        for k, v in feedback_dict.asdict().items():
+        for k, v in feedback_dict.items():
             if v is not None:
                 feedback.append(f'{str(v)}')
         return ' '.join(feedback)
\ No newline at end of file
@@ -1,24 +1,76 @@
 import gymnasium as gym
-from gymnasium.envs.registration import register
-from llfbench.utils import generate_combinations_dict
-from llfbench.envs.metaworld.wrapper import MetaworldWrapper
-from collections import defaultdict
-import importlib
-import metaworld
-import random
-import time
-from gymnasium.wrappers import TimeLimit
-import numpy as np
+from gymnasium.utils import seeding
+from llfbench.envs.registration import register
 
-BENCHMARK = metaworld.MT1
-ENVIRONMENTS = tuple(BENCHMARK.ENV_NAMES)
+# The names of metaworld.MT1.ENV_NAMES. They are listed here so that the envs
+# can be registered without importing metaworld and mujoco.
+ENVIRONMENTS = (
+    'assembly-v2',
+    'basketball-v2',
+    'bin-picking-v2',
+    'box-close-v2',
+    'button-press-topdown-v2',
+    'button-press-topdown-wall-v2',
+    'button-press-v2',
+    'button-press-wall-v2',
+    'coffee-button-v2',
+    'coffee-pull-v2',
+    'coffee-push-v2',
+    'dial-turn-v2',
+    'disassemble-v2',
+    'door-close-v2',
+    'door-lock-v2',
+    'door-open-v2',
+    'door-unlock-v2',
+    'hand-insert-v2',
+    'drawer-close-v2',
+    'drawer-open-v2',
+    'faucet-open-v2',
+    'faucet-close-v2',
+    'hammer-v2',
+    'handle-press-side-v2',
+    'handle-press-v2',
+    'handle-pull-side-v2',
+    'handle-pull-v2',
+    'lever-pull-v2',
+    'pick-place-wall-v2',
+    'pick-out-of-hole-v2',
+    'pick-place-v2',
+    'plate-slide-v2',
+    'plate-slide-side-v2',
+    'plate-slide-back-v2',
+    'plate-slide-back-side-v2',
+    'peg-insert-side-v2',
+    'peg-unplug-side-v2',
+    'soccer-v2',
+    'stick-push-v2',
+    'stick-pull-v2',
+    'push-v2',
+    'push-wall-v2',
+    'push-back-v2',
+    'reach-v2',
+    'reach-wall-v2',
+    'shelf-place-v2',
+    'sweep-into-v2',
+    'sweep-v2',
+    'window-open-v2',
+    'window-close-v2',
+)
+
+# The metadata of MetaworldWrapper, which imports its INSTRUCTION_TYPES and FEEDBACK_TYPES
+# from here, used without building the env.
+INSTRUCTION_TYPES = ('b',)
+FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp')
+REWARD_RANGE = (0, 10)
 
 def make_env(env_name,
              instruction_type='b',
              feedback_type='a',
              ):
     """ Make the original env and wrap it with the LLFWrapper. """
-    benchmark = BENCHMARK(env_name)
+    import metaworld
+    from llfbench.envs.metaworld.wrapper import MetaworldWrapper
+    benchmark = metaworld.MT1(env_name)
     env = benchmark.train_classes[env_name]()
     class Wrapper(gym.Wrapper):
          # a small wrapper to make sure the task is set
@@ -31,9 +83,10 @@ def make_env(env_name,
         def env_name(self):
             return env_name
         def reset(self, *, seed=None, options=None):
-            random.seed(seed)
-            np.random.seed(seed)
-            task = random.choice(benchmark.train_tasks)
+            # the task is drawn from the np_random of the env, not the global random state
+            if seed is not None:
+                self.np_random, _ = seeding.np_random(seed)
+            task = benchmark.train_tasks[self.np_random.integers(len(benchmark.train_tasks))]
             self.env.set_task(task)
             return self.env.reset(seed=seed, options=options)
     env = Wrapper(env)
@@ -45,5 +98,8 @@ for env_name in ENVIRONMENTS:
     register(
         id=f"llf-metaworld-{env_name}",
         entry_point='llfbench.envs.metaworld:make_env',
-        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b')
+        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b'),
+        instruction_types=INSTRUCTION_TYPES,
+        feedback_types=FEEDBACK_TYPES,
+        reward_range=REWARD_RANGE
     )
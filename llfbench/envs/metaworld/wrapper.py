@@ -1,22 +1,28 @@
 from typing import Dict, SupportsFloat, Union
 import numpy as np
 from llfbench.envs.llf_env import LLFWrapper, Feedback
+from llfbench.envs.utils import get_rng_state, set_rng_state, intern_templates
 from llfbench.envs.metaworld.prompts import *
+from llfbench.envs.metaworld import prompts
 from llfbench.envs.metaworld.gains import P_GAINS
+from llfbench.envs.metaworld import INSTRUCTION_TYPES, FEEDBACK_TYPES
 import metaworld
 import importlib
+import copy
 import json
 from textwrap import dedent, indent
 from metaworld.policies.policy import move
 from metaworld.policies.action import Action
 from metaworld.policies import SawyerDrawerOpenV1Policy, SawyerDrawerOpenV2Policy, SawyerReachV2Policy
 
+intern_templates(prompts)  # add the templates to the bank of template ids
+
 class MetaworldWrapper(LLFWrapper):
 
     """ This is wrapper for gym_bandits. """
 
-    INSTRUCTION_TYPES = ('b') #('b', 'p', 'c')
-    FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/metaworld/__init__.py
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/metaworld/__init__.py
 
     def __init__(self, env, instruction_type, feedback_type):
         super().__init__(env, instruction_type, feedback_type)
@@ -170,6 +176,35 @@ class MetaworldWrapper(LLFWrapper):
         info['success'] = bool(info['success'])
         return dict(instruction=None, observation=observation, feedback=feedback), float(reward), terminated, truncated, info
 
+    def _get_state(self):
+        # The task is set at reset, so only the MuJoCo sim and the counters of
+        # the episode are saved.
+        mw_env = self.mw_env
+        data = mw_env.data
+        return dict(qpos=data.qpos.copy(),
+                    qvel=data.qvel.copy(),
+                    mocap_pos=data.mocap_pos.copy(),
+                    mocap_quat=data.mocap_quat.copy(),
+                    time=data.time,
+                    curr_path_length=mw_env.curr_path_length,
+                    prev_obs=copy.copy(mw_env._prev_obs),
+                    last_stable_obs=copy.copy(mw_env._last_stable_obs),
+                    current_observation=copy.copy(self._current_observation),
+                    np_random=get_rng_state(mw_env.np_random))
+
+    def _set_state(self, state):
+        mw_env = self.mw_env
+        data = mw_env.data
+        data.mocap_pos[:] = state['mocap_pos']
+        data.mocap_quat[:] = state['mocap_quat']
+        mw_env.set_state(state['qpos'], state['qvel'])  # this also calls mj_forward
+        data.time = state['time']
+        mw_env.curr_path_length = state['curr_path_length']
+        mw_env._prev_obs = copy.copy(state['prev_obs'])
+        mw_env._last_stable_obs = copy.copy(state['last_stable_obs'])
+        self._current_observation = copy.copy(state['current_observation'])
+        set_rng_state(mw_env.np_random, state['np_random'])
+
     def _reset(self, *, seed=None, options=None):
         self._current_observation, info = self.env.reset(seed=seed, options=options)
         observation = self.textualize_observation(self._current_observation)
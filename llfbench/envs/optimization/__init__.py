@@ -1,6 +1,4 @@
-import numpy as np
-from gymnasium.envs.registration import register
-from llfbench.envs.optimization.wrapper import LossLandscapeGymWrapper
+from llfbench.envs.registration import register
 
 ENVIRONMENTS = (
     'Booth',
@@ -9,12 +7,26 @@ ENVIRONMENTS = (
     'SixHumpCamel',
 )
 
+# The metadata of LossLandscapeGymWrapper, which imports its INSTRUCTION_TYPES and FEEDBACK_TYPES
+# from here, used without building the env.
+# The reward range of each loss is (-max y at the corners of the domain, -min_y),
+# see LossLandscapeBase.get_min_reward.
+INSTRUCTION_TYPES = ('b',)
+FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp', 'fn')
+REWARD_RANGES = {
+    'Booth': (-2594.0, 0.0),
+    'McCormick': (-44.098473, 1.9133),
+    'Rosenbrock': (-11106.0, 0.0),
+    'SixHumpCamel': (-55.733333333333334, 1.0316),
+}
+
 def make_env(env_name,
              instruction_type='b',
              feedback_type='r',
              **kwargs):
     """ Make the original env and wrap it with the LLFWrapper. """
     import importlib
+    from llfbench.envs.optimization.wrapper import LossLandscapeGymWrapper
     LossCls = getattr(importlib.import_module("llfbench.envs.optimization.loss_descent"), env_name)
     env = LossCls(**kwargs)  # `feedback` doesn't matter here, as we will override it.
     return LossLandscapeGymWrapper(env, instruction_type=instruction_type, feedback_type=feedback_type)
@@ -24,4 +36,7 @@ for env_name in ENVIRONMENTS:
         id=f"llf-optimization-{env_name}-v0",
         entry_point='llfbench.envs.optimization:make_env',
         kwargs={'env_name': env_name, 'instruction_type': 'b', 'feedback_type': 'a'},
+        instruction_types=INSTRUCTION_TYPES,
+        feedback_types=FEEDBACK_TYPES,
+        reward_range=REWARD_RANGES[env_name]
     )
\ No newline at end of file
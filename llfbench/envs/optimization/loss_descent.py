@@ -7,7 +7,8 @@ import numpy as np
 from textwrap import dedent, indent
 
 from gym.utils import seeding
-from llfbench.envs.llf_env import Feedback
+from llfbench.envs.llf_env import Feedback, FeedbackTemplate
+from llfbench.envs.utils import get_rng_state, set_rng_state
 import string
 
 class LossLandscapeBase(gym.Env):
@@ -102,6 +103,19 @@ class LossLandscapeBase(gym.Env):
         self._np_random, seed = seeding.np_random(seed)
         return [seed]
 
+    def get_state(self):
+        return dict(prev_x=None if self.prev_x is None else self.prev_x.copy(),
+                    left_attempts=self.left_attempts,
+                    np_random=get_rng_state(self._np_random))
+
+    def set_state(self, state):
+        self.prev_x = None if state['prev_x'] is None else state['prev_x'].copy()
+        self.left_attempts = state['left_attempts']
+        if state['np_random'] is None:
+            self._np_random = None
+        else:
+            set_rng_state(self.np_random, state['np_random'])
+
     @property
     def np_random(self):
         """Lazily seed the PRNG since this is expensive and only needed if sampling from this space."""
@@ -125,7 +139,8 @@ class LossLandscapeBase(gym.Env):
 
     def step(self, action):
         # observation, reward, terminal, info
-        didactic_feedback = Feedback(r="", hp="", hn="", fp="", fn="")
+        # The didactic feedback is structured; see FeedbackTemplate and prompts.py.
+        didactic_feedback = Feedback(r="", hp=[], hn=[], fp=[], fn=[])
 
         x, stop = self.text_extract(action)
         if x is None and stop is False:
@@ -136,11 +151,8 @@ class LossLandscapeBase(gym.Env):
 
         if stop:
             success = np.abs(self.callable_func(self.prev_x) - self.min_y) < 1e-2
-            didactic_feedback['r'] = f'You have chosen to stop at {self.prev_x}.'
-            if success:
-                didactic_feedback['r'] += ' You have reached the minimum!'
-            else:
-                didactic_feedback['r'] += ' You have not reached the minimum!'
+            didactic_feedback['r'] = [f'You have chosen to stop at {self.prev_x}. ',
+                                      FeedbackTemplate('r_feedback_pos' if success else 'r_feedback_neg', {})]
             return None, float(self.callable_func(self.prev_x)), True, {'success': success,
                                                                 'feedback': didactic_feedback}
 
@@ -148,7 +160,7 @@ class LossLandscapeBase(gym.Env):
 
         if np.abs(loss - self.min_y) < 1e-2:
             # r_pos
-            didactic_feedback['r'] = 'You have reached the minimum!'
+            didactic_feedback['r'] = FeedbackTemplate('r_feedback_pos', {})
             return "Function outputs y: {}\nYou have reached the minimum!".format(self.min_y), -self.min_y, True, {
                 'original_feedback': 'You have reached the minimum!', 'feedback': didactic_feedback,
                 "success": True}
@@ -160,7 +172,7 @@ class LossLandscapeBase(gym.Env):
         obs += "Output:"
 
         # TODO: what's the diff between r and observation?
-        didactic_feedback['r'] = "You have not reached the minimum!"
+        didactic_feedback['r'] = FeedbackTemplate('r_feedback_neg', {})
         feedback = ""  # y is not minimized yet. Keep going!
 
         # not changing original feedback
@@ -198,32 +210,33 @@ class LossLandscapeBase(gym.Env):
         prev_x1_direction = 'Increasing' if change_x1 > 0 else 'Decreasing'  # take the opposite of gradient
         prev_x2_direction = 'Increasing' if change_x2 > 0 else 'Decreasing'
 
-        if np.sign(change_x1) == np.sign(-prev_dx1):
-            didactic_feedback['hp'] += f"You chose {action} from {self.prev_x}. {prev_x1_direction} the first number {self.prev_x[0]} does minimize y.\n"
-        else:
-            didactic_feedback['hn'] += f"You chose {action} from {self.prev_x}. {prev_x1_direction} the first number {self.prev_x[0]} does not minimize y.\n"
-
-        if np.sign(change_x2) == np.sign(-prev_dx2):
-            didactic_feedback['hp'] += f"You chose {action} from {self.prev_x}. {prev_x2_direction} the second number {self.prev_x[1]} does minimize y."
-        else:
-            didactic_feedback['hn'] += f"You chose {action} from {self.prev_x}. {prev_x2_direction} the second number {self.prev_x[1]} does not minimize y."
+        # e.g. "You chose {action} from {prev_x}. {increasing} the first number {x2} does (not) minimize y."
+        ft = 'hp' if np.sign(change_x1) == np.sign(-prev_dx1) else 'hn'
+        didactic_feedback[ft] += [FeedbackTemplate(f'{ft}_feedback_dim1', dict(action=action, prev_x=self.prev_x,
+                                                                             increasing=prev_x1_direction, x2=self.prev_x[0])),
+                                  '\n']
+        ft = 'hp' if np.sign(change_x2) == np.sign(-prev_dx2) else 'hn'
+        didactic_feedback[ft] += [FeedbackTemplate(f'{ft}_feedback_dim2', dict(action=action, prev_x=self.prev_x,
+                                                                             increasing=prev_x2_direction, x2=self.prev_x[1]))]
 
         dx = self.grad_func(x)
         dx1, dx2 = dx[0], dx[1]
         x1_direction = 'smaller' if dx1 > 0 else 'larger'  # take the opposite of gradient
         x2_direction = 'smaller' if dx2 > 0 else 'larger'
+        # e.g. "You chose {x}. Choose a {smaller} number than {x2} to minimize y."
         if dx1 != 0:
-            didactic_feedback['fp'] += f"You chose {action}. Choose a {x1_direction} number than {x[0]} to minimize y.\n"
+            didactic_feedback['fp'] += [FeedbackTemplate('fp_feedback_dim1', dict(x=action, smaller=x1_direction, x2=x[0])), '\n']
         if dx2 != 0:
-            didactic_feedback['fp'] += f"You chose {action}. Choose a {x2_direction} number than {x[1]} to minimize y.\n"
+            didactic_feedback['fp'] += [FeedbackTemplate('fp_feedback_dim2', dict(x=action, smaller=x2_direction, x2=x[1])), '\n']
 
         flipped_x1_direction = 'smaller' if dx1 < 0 else 'larger'  # take the opposite of gradient
         flipped_x2_direction = 'smaller' if dx2 < 0 else 'larger'
 
+        # e.g. "You chose {x}. Do not choose a {smaller} number than {x2} to minimize y."
         if dx1 != 0:
-            didactic_feedback['fn'] += f"You chose {action}. Do not choose a {flipped_x1_direction} number than {x[0]} to minimize y."
+            didactic_feedback['fn'] += [FeedbackTemplate('fn_feedback_dim1', dict(x=action, smaller=flipped_x1_direction, x2=x[0])), '\n']
         if dx2 != 0:
-            didactic_feedback['fn'] += f"You chose {action}. Do not choose a {flipped_x2_direction} number than {x[1]} to minimize y."
+            didactic_feedback['fn'] += [FeedbackTemplate('fn_feedback_dim2', dict(x=action, smaller=flipped_x2_direction, x2=x[1]))]
 
         self.prev_x = x
         self.left_attempts -= 1
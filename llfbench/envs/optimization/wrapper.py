@@ -1,7 +1,13 @@
+import re
 from llfbench.envs.env_wrappers import TerminalFreeWrapper, EnvCompatibility
-from llfbench.envs.llf_env import LLFWrapper, Feedback
+from llfbench.envs.llf_env import LLFWrapper
 # from llfbench.envs.loss_landscape.loss_descent import
 from llfbench.envs.optimization.prompts import *
+from llfbench.envs.optimization import prompts
+from llfbench.envs.utils import register_templates
+from llfbench.envs.optimization import INSTRUCTION_TYPES, FEEDBACK_TYPES
+
+register_templates(prompts)  # compile the templates used in reformat once
 
 """
 The original env produces support for both
@@ -13,8 +19,9 @@ This wrapper will only produce didactic feedback
 
 
 class LossLandscapeGymWrapper(LLFWrapper):
-    INSTRUCTION_TYPES = ('b')
-    FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp', 'fn')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/optimization/__init__.py
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/optimization/__init__.py
+    PROMPTS = prompts
 
     def __init__(self, env, instruction_type, feedback_type):
         super().__init__(TerminalFreeWrapper(EnvCompatibility(env)), instruction_type, feedback_type)
@@ -31,38 +38,30 @@ class LossLandscapeGymWrapper(LLFWrapper):
         observation, reward, terminated, truncated, info = self.env.step(action)
         didactic_feedback = info['feedback']
         del info['feedback']
-        del info['original_feedback']
+        info.pop('original_feedback', None)
 
         assert 'success' in info
 
-        paraphrased_feedback = Feedback()
-
-        for feedback_type in self._feedback_type:
-            if feedback_type == 'r':
-                feedback = self.reformat(didactic_feedback[feedback_type], r_feedback_pos, template=r_feedback_pos_template)
-                feedback = self.reformat(feedback, r_feedback_neg, template=r_feedback_neg_template)
-                paraphrased_feedback.r = feedback
-            elif feedback_type in didactic_feedback and didactic_feedback[feedback_type] != "":
-                temp_dim1 = eval("{}_feedback_dim1_template".format(feedback_type))
-                feedback = self.reformat(didactic_feedback[feedback_type],
-                                         eval("{}_feedback_dim1".format(feedback_type)),
-                                         template=temp_dim1)
-                temp_dim2 = eval("{}_feedback_dim2_template".format(feedback_type))
-                feedback = self.reformat(feedback,
-                                         eval("{}_feedback_dim2".format(feedback_type)),
-                                         template=temp_dim2)
-
-                # this is to fix a capitalization issue in paraphrasing
-                if '. Increasing' not in feedback:
-                    feedback = feedback.replace("Increasing", 'increasing')
-                elif '. Decreasing' not in feedback:
-                    feedback = feedback.replace("Decreasing", 'decreasing')
-
-                paraphrased_feedback[feedback_type] = feedback
+        paraphrased_feedback = self.render_feedback(didactic_feedback, self._feedback_type)
+
+        # this is to fix a capitalization issue in paraphrasing: the
+        # direction is capitalized unless it starts a sentence
+        for feedback_type in ('hp', 'hn'):
+            if paraphrased_feedback[feedback_type] is not None:
+                paraphrased_feedback[feedback_type] = re.sub(
+                    r'(^|\n|\. )?(Increasing|Decreasing)',
+                    lambda m: m.group(0) if m.group(1) is not None else m.group(2).lower(),
+                    paraphrased_feedback[feedback_type])
 
         observation = dict(instruction=None, observation=observation, feedback=paraphrased_feedback)
         return observation, reward, terminated, truncated, info
 
+    def _get_state(self):
+        return self._loss_env.get_state()
+
+    def _set_state(self, state):
+        self._loss_env.set_state(state)
+
     @property
     def _loss_env(self):
         return self.env.env.env
@@ -1,7 +1,4 @@
-import numpy as np
-from gymnasium.envs.registration import register
-from llfbench.utils import generate_combinations_dict
-from llfbench.envs.poem.wrapper import PoemGymWrapper
+from llfbench.envs.registration import register
 
 ENVIRONMENTS = (
     'Haiku',
@@ -10,6 +7,12 @@ ENVIRONMENTS = (
     'SyllableConstrainedPoem',
 )
 
+# The metadata of PoemGymWrapper, which imports its INSTRUCTION_TYPES and FEEDBACK_TYPES
+# from here, used without building the env.
+INSTRUCTION_TYPES = ('b',)
+FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp', 'fn')
+REWARD_RANGE = (0.0, 1.0)
+
 def make_env(env_name,
              instruction_type='b',
              feedback_type='r',
@@ -17,6 +20,7 @@ def make_env(env_name,
                   ):
     """ Make the original env and wrap it with the LLFWrapper. """
     import importlib
+    from llfbench.envs.poem.wrapper import PoemGymWrapper
     PoemCls = getattr(importlib.import_module("llfbench.envs.poem.formal_poems"), env_name)
     env = PoemCls(**kwargs)  # `feedback` doesn't matter here, as we will override it.
     return PoemGymWrapper(env, instruction_type=instruction_type, feedback_type=feedback_type)
@@ -27,5 +31,8 @@ for env_name in ENVIRONMENTS:
     register(
         id=f"llf-poem-{env_name}-v0",
         entry_point='llfbench.envs.poem:make_env',
-        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b')
+        kwargs=dict(env_name=env_name, feedback_type='a', instruction_type='b'),
+        instruction_types=INSTRUCTION_TYPES,
+        feedback_types=FEEDBACK_TYPES,
+        reward_range=REWARD_RANGE
     )
\ No newline at end of file
@@ -1,3 +1,4 @@
+import copy
 import random
 import re
 from string import punctuation
@@ -11,7 +12,9 @@ import string
 from gym.utils import seeding
 
 from llfbench.utils.parser_utils import SimpleGuidanceParser
-from llfbench.envs.llf_env import Feedback
+from llfbench.utils.llm_cache import CachedLLM
+from llfbench.envs.llf_env import Feedback, FeedbackTemplate
+from llfbench.envs.utils import get_rng_state, set_rng_state
 
 
 class PoemUtil:
@@ -20,6 +23,12 @@ class PoemUtil:
         super().__init__(*args, **kwargs)  # forwards all unused arguments
         self.cmudict = cmudict.dict()
 
+    def extract(self, a):
+        # extract the poem from the action with the extractor, through the shared executor if any
+        if self.extraction_executor is None:
+            return self.extractor(a)
+        return self.extraction_executor.extract(self.extractor, a)
+
     def simple_syllable_count(self, word):
         # can also use pip syllables library
         text = word.lower()
@@ -74,12 +83,47 @@ class PoemUtil:
     def seed(self, seed):
         pass
 
+    # The attributes that the reset of the poem env samples.
+    STATE_ATTRIBUTES = ('assignment',)
+
+    def get_state(self):
+        state = {k: copy.copy(getattr(self, k)) for k in self.STATE_ATTRIBUTES}
+        state['np_random'] = get_rng_state(self._np_random)
+        return state
+
+    def set_state(self, state):
+        for k in self.STATE_ATTRIBUTES:
+            setattr(self, k, copy.copy(state[k]))
+        set_rng_state(self._np_random, state['np_random'])
+
+    # helpers for the structured didactic feedback of syllable errors
+    # error_info and success_info are lists of [i, line, count, diff]
+
+    def line_error_suffix(self, error_info):
+        # e.g. ", but lines 1,3 do not."
+        suffix = ", but lines " if len(error_info) > 1 else ", but line "
+        suffix += ",".join(f"{tup[0] + 1}" for tup in error_info)
+        suffix += " do not." if len(error_info) > 1 else " does not."
+        return suffix
+
+    def correct_lines_description(self, success_info):
+        # e.g. "line 1 has 5 syllables,line 2 has 7 syllables"
+        return ",".join(f"line {i + 1} has {count} syllables" for i, line, count, diff in success_info)
+
+    def syllable_fp_feedback(self, error_info, syllable_reqs):
+        fp = [FeedbackTemplate('syllable_fp_feedback_1', {}), '\n']
+        for (i, line, count, diff), k in zip(error_info, syllable_reqs):
+            improv_direction = "more" if diff > 0 else "less"
+            fp += [FeedbackTemplate('syllable_fp_feedback_2', dict(line=line, count=count, k=k,
+                                                                   improv_direction=improv_direction)), '\n']
+        return fp
+
 
 class PoemExtractor(object):
     # use LLM to extract the poem
     # just in case more things were written
-    def __init__(self, llm, silent=True):
-        self.llm = llm
+    def __init__(self, llm, silent=True, cache=None):
+        # cache: a ResponseCache of the responses of llm (see llfbench.utils.llm_cache)
         self.prompt = SimpleGuidanceParser("""
 {{#system~}}
 You are a helpful assistant.
@@ -98,6 +142,7 @@ Only return the poem line by line, including space.
 {{gen 'poem' temperature=0.7}}
 {{~/assistant}}
 """)
+        self.llm = llm if cache is None else CachedLLM(llm, cache, params=self.prompt.gen_params)
 
     def __call__(self, content):
         messages = self.prompt(content=content)
@@ -106,11 +151,14 @@ Only return the poem line by line, including space.
 
 
 class Haiku(PoemUtil, gym.Env):
+    STATE_ATTRIBUTES = ('assignment', 'syllable_req', 'syllable_req_str')
+
     def __init__(self, feedback=0, use_extractor=False, seed=None):
         self.assignment = f"Can you write me a haiku? A haiku is a poem that consists of three phrases composed of 17 syllables in a 5, 7, 5 pattern."
         self.form_name = 'Haiku'
         self.use_extractor = use_extractor
         self.extractor = None
+        self.extraction_executor = None
 
         self.feedback = feedback
         self.syllable_req = [5, 7, 5]
@@ -132,8 +180,11 @@ class Haiku(PoemUtil, gym.Env):
         self._np_random, seed = seeding.np_random(seed)
         return [seed]
 
-    def initialize_text_extractor(self, poem_extractor: PoemExtractor):
+    def initialize_text_extractor(self, poem_extractor: PoemExtractor, executor=None):
+        # executor: an ExtractionExecutor shared with other envs (see llfbench.utils.extraction)
         self.extractor = poem_extractor
+        self.extraction_executor = executor
+        self.use_extractor = True
 
     def line_number_incorrect(self, observed_num):
         # The line number is incorrect.
@@ -141,11 +192,16 @@ class Haiku(PoemUtil, gym.Env):
 
         improv_direction = "more" if observed_num < len(self.syllable_req) else "less"
 
+        # The didactic feedback is structured; see FeedbackTemplate and prompts.py.
         didactic_feedback = Feedback()
-        didactic_feedback.r = f"The generated {self.form_name} is incorrect."
-        didactic_feedback.fp = f"Write a {self.form_name} that has exactly {len(self.syllable_req)} lines. Write {improv_direction} lines."
-        didactic_feedback.fn = f"Do not write a {self.form_name} that has more or less lines than {len(self.syllable_req)}."
-        didactic_feedback.hn = f"You wrote {observed_num} lines but the poem needs to be have exactly {len(self.syllable_req)} lines."
+        didactic_feedback.r = FeedbackTemplate('r_feedback_neg', dict(form_name=self.form_name))
+        didactic_feedback.fp = FeedbackTemplate('line_number_fp_feedback', dict(form_name=self.form_name,
+                                                                               syllable_req_len=len(self.syllable_req),
+                                                                               improv_direction=improv_direction))
+        didactic_feedback.fn = FeedbackTemplate('line_number_fn_feedback', dict(form_name=self.form_name,
+                                                                               syllable_req_len=len(self.syllable_req)))
+        didactic_feedback.hn = FeedbackTemplate('line_number_hn_feedback', dict(observed_num=observed_num,
+                                                                               syllable_req_len=len(self.syllable_req)))
 
         if self.feedback == 0:
             feedback = f"The generated {self.form_name} is incorrect."
@@ -191,33 +247,18 @@ class Haiku(PoemUtil, gym.Env):
         didactic_feedback = Feedback()
         if len(error_info) == 0:  # success
             # this is the only place sucess feedback is produced
-            didactic_feedback.r = f"The generated {self.form_name} is correct. Congrats! You have successfully produced a poem that matches the assignment description."
-            feedback = didactic_feedback.r
+            feedback = f"The generated {self.form_name} is correct. Congrats! You have successfully produced a poem that matches the assignment description."
+            didactic_feedback.r = FeedbackTemplate('r_feedback_pos', dict(form_name=self.form_name))
             return feedback, didactic_feedback
         else:
-            didactic_feedback.r = f"The generated {self.form_name} is incorrect."
-            didactic_feedback.hn = f"{self.form_name} needs to have exactly {'-'.join(self.syllable_req_str)} syllables in {len(self.syllable_req)} lines"
-            didactic_feedback.hn += ", but lines " if len(error_info) > 1 else ", but line "
-            for tup in error_info:
-                i, line, count, diff = tup
-                # feedback +=  f'The line: "{line}" has {count} syllables. It should only have {self.syllable} syllables' + '\n'
-                didactic_feedback.hn += f"{i + 1},"
-            didactic_feedback.hn = didactic_feedback.hn[:-1]
-            didactic_feedback.hn += " do not." if len(error_info) > 1 else " does not."
-
-            didactic_feedback.hp = "These lines are correct because they have the correct syllables: "
-            for tup in success_info:
-                i, line, count, diff = tup
-                didactic_feedback.hp += f"line {i + 1} has {count} syllables,"
-            didactic_feedback.hp = didactic_feedback.hp[:-1]
-            didactic_feedback.hp += "."
-
-            didactic_feedback.fp = "Here are some suggestions to fix your error:\n"
-            for tup in error_info:
-                i, line, count, diff = tup
-                improv_direction = "more" if diff > 0 else "less"
-                didactic_feedback.fp += f'The line: "{line}" has {count} syllables. It should only have {self.syllable_req[i]} syllables. '
-                didactic_feedback.fp += f'You should rewrite the line to have {improv_direction} syllables.' + '\n'
+            didactic_feedback.r = FeedbackTemplate('r_feedback_neg', dict(form_name=self.form_name))
+            didactic_feedback.hn = [FeedbackTemplate('syllable_hn_feedback', dict(form_name=self.form_name,
+                                                                                 X='-'.join(self.syllable_req_str),
+                                                                                 syllable_req_len=len(self.syllable_req))),
+                                    self.line_error_suffix(error_info)]
+            didactic_feedback.hp = FeedbackTemplate('syllable_hp_feedback',
+                                                    dict(correct_lines=self.correct_lines_description(success_info)))
+            didactic_feedback.fp = self.syllable_fp_feedback(error_info, [self.syllable_req[tup[0]] for tup in error_info])
 
         # now we know there's an error
         if self.feedback == 0:
@@ -261,7 +302,7 @@ class Haiku(PoemUtil, gym.Env):
             if self.extractor is None:
                 raise Exception(
                     "Must pass in an extractor through initialize_text_extractor before using the extractor.")
-            a = self.extractor(a)
+            a = self.extract(a)
 
         feedbacks, didactic_feedback = [], Feedback()
         success = True
@@ -345,6 +386,8 @@ class LineSyllableConstrainedPoem(Haiku):
 
 
 class SyllableConstrainedPoem(PoemUtil, gym.Env):
+    STATE_ATTRIBUTES = ('assignment', 'syllable')
+
     def __init__(self, syllable=7, feedback=0, use_extractor=False, seed=None):
 
         super().__init__()
@@ -357,6 +400,7 @@ class SyllableConstrainedPoem(PoemUtil, gym.Env):
 
         self.cmudict = cmudict.dict()
         self.extractor = None
+        self.extraction_executor = None
 
         self.action_space = gym.spaces.Text(sys.maxsize, charset=string.printable)
         self.observation_space = gym.spaces.Text(sys.maxsize, charset=string.printable)
@@ -380,8 +424,11 @@ class SyllableConstrainedPoem(PoemUtil, gym.Env):
         self._np_random, seed = seeding.np_random(seed)
         return [seed]
 
-    def initialize_text_extractor(self, poem_extractor: PoemExtractor):
+    def initialize_text_extractor(self, poem_extractor: PoemExtractor, executor=None):
+        # executor: an ExtractionExecutor shared with other envs (see llfbench.utils.extraction)
         self.extractor = poem_extractor
+        self.extraction_executor = executor
+        self.use_extractor = True
 
     def get_line_feedback(self, text):
         success = True
@@ -408,12 +455,12 @@ class SyllableConstrainedPoem(PoemUtil, gym.Env):
             if self.extractor is None:
                 raise Exception(
                     "Must pass in an extractor through initialize_text_extractor before using the extractor.")
-            a = self.extractor(a)
+            a = self.extract(a)
         success, frac, error_info, success_info = self.get_line_feedback(a)
 
         if success:
             feedback = f"The generated poem is correct. Congrats! You have successfully produced a poem that matches the assignment description."
-            didactic_feedback = Feedback(r=feedback)
+            didactic_feedback = Feedback(r=FeedbackTemplate('r_feedback_pos', dict(form_name='poem')))
             return self.assignment, frac, False, {'frac': frac, 'original_feedback': feedback,
                                                   'feedback': didactic_feedback, 'success': True}
 
@@ -443,29 +490,11 @@ class SyllableConstrainedPoem(PoemUtil, gym.Env):
         terminal = False  # one step environment
 
         didactic_feedback = Feedback()
-        didactic_feedback.r = "The generated poem is incorrect."
-
-        didactic_feedback.hn = f"The poem needs to have exactly {self.syllable} syllables in all lines"
-        didactic_feedback.hn += ", but lines " if len(error_info) > 1 else ", but line "
-        for tup in error_info:
-            i, line, count, diff = tup
-            didactic_feedback.hn += f"{i + 1},"
-        didactic_feedback.hn = didactic_feedback.hn[:-1]
-        didactic_feedback.hn += " do not." if len(error_info) > 1 else " does not."
-
-        didactic_feedback.hp = "These lines are correct because they have the correct syllables: "
-        for tup in success_info:
-            i, line, count, diff = tup
-            didactic_feedback.hp += f"line {i + 1} has {count} syllables,"
-        didactic_feedback.hp = didactic_feedback.hp[:-1]
-        didactic_feedback.hp += "."
-
-        didactic_feedback.fp = "Here are some suggestions to fix your error:\n"
-        for tup in error_info:
-            i, line, count, diff = tup
-            improv_direction = "more" if diff > 0 else "less"
-            didactic_feedback.fp += f'The line: "{line}" has {count} syllables. It should only have {self.syllable} syllables. '
-            didactic_feedback.fp += f'You should rewrite the line to have {improv_direction} syllables.' + '\n'
+        didactic_feedback.r = FeedbackTemplate('r_feedback_neg', dict(form_name='poem'))
+        didactic_feedback.hn = f"The poem needs to have exactly {self.syllable} syllables in all lines" + self.line_error_suffix(error_info)
+        didactic_feedback.hp = FeedbackTemplate('syllable_hp_feedback',
+                                                dict(correct_lines=self.correct_lines_description(success_info)))
+        didactic_feedback.fp = self.syllable_fp_feedback(error_info, [self.syllable] * len(error_info))
 
         out = self.assignment, frac, terminal, {'frac': frac, 'original_feedback': feedback,
                                                 "feedback": didactic_feedback, 'success': False}
@@ -3,11 +3,17 @@ from llfbench.envs.env_wrappers import TerminalFreeWrapper, EnvCompatibility
 from llfbench.envs.llf_env import LLFWrapper, Feedback
 from llfbench.envs.poem.formal_poems import Haiku, Tanka, LineSyllableConstrainedPoem, SyllableConstrainedPoem
 from llfbench.envs.poem.prompts import *
+from llfbench.envs.poem import prompts
+from llfbench.envs.utils import register_templates
+from llfbench.envs.poem import INSTRUCTION_TYPES, FEEDBACK_TYPES
+
+register_templates(prompts)  # compile the templates used in reformat once
 
 class PoemGymWrapper(LLFWrapper):
 
-    INSTRUCTION_TYPES = ('b')
-    FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp', 'fn')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/poem/__init__.py
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/poem/__init__.py
+    PROMPTS = prompts
 
     def __init__(self, env, instruction_type, feedback_type):
         super().__init__(TerminalFreeWrapper(EnvCompatibility(env)), instruction_type, feedback_type)
@@ -35,26 +41,7 @@ class PoemGymWrapper(LLFWrapper):
         del info['feedback']
         del info['original_feedback']
 
-        paraphrased_feedback = Feedback()
-        for feedback_type in self._feedback_type:
-            feedback = didactic_feedback[feedback_type]
-            if feedback_type == 'r':
-                feedback = self.reformat(feedback, r_feedback_pos)
-                feedback = self.reformat(feedback, r_feedback_neg)
-            elif feedback_type == 'hn':
-                feedback = self.reformat(feedback, line_number_hn_feedback)
-                feedback = self.reformat(feedback, syllable_hn_feedback)
-            elif feedback_type == 'hp':
-                feedback = self.reformat(feedback, syllable_hp_feedback)
-            elif feedback_type == 'fp':
-                feedback = self.reformat(feedback, line_number_fp_feedback)
-                feedback = self.reformat(feedback, syllable_fp_feedback_1)
-                feedback = self.reformat(feedback, syllable_fp_feedback_2)
-            elif feedback_type == 'fn':
-                feedback = self.reformat(feedback, line_number_fn_feedback)
-            else:
-                raise ValueError(f'Unknown feedback type: {feedback_type}')
-            paraphrased_feedback[feedback_type] = feedback
+        paraphrased_feedback = self.render_feedback(didactic_feedback, self._feedback_type)
 
         observation = dict(instruction=None, observation=None, feedback=paraphrased_feedback)
 
@@ -71,12 +58,18 @@ class PoemGymWrapper(LLFWrapper):
         """
 
         feedback = []
-        for k, v in feedback_dict.asdict().items():
+        for k, v in feedback_dict.items():
             if v is not None:
                 line = self.fix_sentence_capitalization(f'{str(v)}')
                 feedback.append(line)
         return ' '.join(feedback)
 
+    def _get_state(self):
+        return self._poem_env.get_state()
+
+    def _set_state(self, state):
+        self._poem_env.set_state(state)
+
     @property
     def _poem_env(self):
         return self.env.env.env
\ No newline at end of file
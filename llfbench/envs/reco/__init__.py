@@ -1,17 +1,22 @@
-from gymnasium.envs.registration import register
-from llfbench.utils import generate_combinations_dict
-from llfbench.envs.reco.wrapper import MovieRecGymWrapper
+from llfbench.envs.registration import register
 
 environments = [
     'movie'
 ]
 
+# The metadata of MovieRecGymWrapper, which imports its INSTRUCTION_TYPES and FEEDBACK_TYPES
+# from here, used without building the env.
+INSTRUCTION_TYPES = ('b',)
+FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp', 'fn')
+REWARD_RANGE = (0, 1)
+
 def make_env(env_name,
              instruction_type='b',
              feedback_type='r',
              **kwargs):
     """ Make the original env and wrap it with the LLFWrapper. """
     import importlib
+    from llfbench.envs.reco.wrapper import MovieRecGymWrapper
     MovieCls = getattr(importlib.import_module("llfbench.envs.reco.movie_rec"), 'MovieRec')
     env = MovieCls(**kwargs)  # `feedback` doesn't matter here, as we will override it.
     return MovieRecGymWrapper(env, instruction_type=instruction_type, feedback_type=feedback_type)
@@ -19,5 +24,8 @@ def make_env(env_name,
 register(
     id=f"llf-reco-{environments[0]}-v0",
     entry_point='llfbench.envs.reco:make_env',
-    kwargs=dict(env_name=environments[0], feedback_type='a', instruction_type='b')
+    kwargs=dict(env_name=environments[0], feedback_type='a', instruction_type='b'),
+    instruction_types=INSTRUCTION_TYPES,
+    feedback_types=FEEDBACK_TYPES,
+    reward_range=REWARD_RANGE
 )
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import copy
 import gym
 import sys
 import json
@@ -15,7 +16,9 @@ from gym.utils import seeding
 from textwrap import dedent, indent
 
 from llfbench.utils.parser_utils import SimpleGuidanceParser
-from llfbench.envs.llf_env import Feedback
+from llfbench.utils.llm_cache import CachedLLM
+from llfbench.envs.llf_env import Feedback, FeedbackTemplate
+from llfbench.envs.utils import get_rng_state, set_rng_state
 
 
 def get_details_via_omdb(title, verbose=False):
@@ -146,7 +149,7 @@ class RecommendationQueryGenerator:
         profile = {
             "type_": self._np_random.choice(self.TYPES),
             "year_ranges": self._np_random.choice(list(self.YEAR_RANGE.keys()), self._np_random.randint(0, 2+1)).tolist(),  # len(cls.YEAR_RANGE)
-            "genre": self._np_random.choice(self.GENRES, self._np_random.randint(0, 2+1)),  # len(cls.GENRES)  # Include None as an option
+            "genre": self._np_random.choice(self.GENRES, self._np_random.randint(0, 2+1)).tolist(),  # len(cls.GENRES)  # Include None as an option
             "age_restriction": self._np_random.choice([None] + self.AGE_RESTRICTED, 1, p=[0.4, 0.2, 0.2, 0.2]).tolist()[0],
             "sampled_start_exp_idx": self._np_random.randint(0, 9+1),
             "sampled_end_exp_idx": self._np_random.randint(0, 4+1)
@@ -227,8 +230,8 @@ class RecommendationQueryGenerator:
 class RecContentExtractor(object):
     # use LLM to extract the poem
     # just in case more things were written
-    def __init__(self, llm, silent=True):
-        self.llm = llm
+    def __init__(self, llm, silent=True, cache=None):
+        # cache: a ResponseCache of the responses of llm (see llfbench.utils.llm_cache)
         self.prompt = SimpleGuidanceParser(dedent("""
         {{#system~}}
         You are a helpful assistant.
@@ -252,6 +255,7 @@ class RecContentExtractor(object):
         {{gen 'content' temperature=0}}
         {{~/assistant}}
         """))
+        self.llm = llm if cache is None else CachedLLM(llm, cache, params=self.prompt.gen_params)
 
     def __call__(self, content):
         messages = self.prompt(content=content)
@@ -259,6 +263,14 @@ class RecContentExtractor(object):
         return response
 
 
+def parse_rec_movies(content):
+    # the list of movies extracted by RecContentExtractor; raise an exception if it is not valid
+    rec_movies = json.loads(content)
+    assert type(rec_movies) == list
+    assert "title" in rec_movies[0].keys()
+    return rec_movies
+
+
 class MovieRec(gym.Env):
     YEAR_RANGE = {
         "recent": "past few years",
@@ -273,6 +285,7 @@ class MovieRec(gym.Env):
         assert self.feedback_level in {0, 0.5, 1}
 
         self.extractor = None
+        self.extraction_executor = None
         self.query_generator = RecommendationQueryGenerator(seed=seed)
 
         self.profile = None
@@ -295,8 +308,23 @@ class MovieRec(gym.Env):
         self._np_random, seed = seeding.np_random(seed)
         return [seed]
 
-    def initialize_text_extractor(self, content_extractor: RecContentExtractor):
+    def get_state(self):
+        return dict(profile=copy.deepcopy(self.profile),
+                    np_random=get_rng_state(self._np_random),
+                    query_generator_np_random=get_rng_state(self.query_generator._np_random))
+
+    def set_state(self, state):
+        self.profile = copy.deepcopy(state['profile'])
+        if state['np_random'] is None:
+            self._np_random = None
+        else:
+            set_rng_state(self.np_random, state['np_random'])
+        set_rng_state(self.query_generator._np_random, state['query_generator_np_random'])
+
+    def initialize_text_extractor(self, content_extractor: RecContentExtractor, executor=None):
+        # executor: an ExtractionExecutor shared with other envs (see llfbench.utils.extraction)
         self.extractor = content_extractor
+        self.extraction_executor = executor
 
     def generate_request_query(self):
         return self.query_generator.generate_query(**self.profile)
@@ -319,19 +347,20 @@ class MovieRec(gym.Env):
         # and reveal profile gradually in the feedback (through likes/dislikes, or explicit request)
         return self.generate_request_query()
 
-    def extract_with_retry(self, a):
-        retry = 3
-        rec_movies = None
+    def extract_with_retry(self, a, retry=3):
+        # the list of recommended movies in the action, or None if the extraction fails retry times
+        if self.extraction_executor is not None:
+            try:
+                return self.extraction_executor.extract(self.extractor, a, validate=parse_rec_movies)
+            except Exception:
+                return None
 
+        rec_movies = None
         while retry > 0:
             try:
-                a = self.extractor(a)
-                # we can add a retry here if json fails to parse
-                rec_movies = json.loads(a)
-                assert type(rec_movies) == list
-                assert "title" in rec_movies[0].keys()
+                rec_movies = parse_rec_movies(self.extractor(a))
                 break
-            except:
+            except Exception:
                 retry -= 1
 
         return rec_movies
@@ -345,6 +374,10 @@ class MovieRec(gym.Env):
 
         return separator.join(items_list[:-1]) + last_separator + items_list[-1]
 
+    def _list_items(self, items_list):
+        # e.g. "Movie 1, Movie 2," which is the list of items in didactic feedback
+        return ' '.join(f"{item}," for item in items_list)
+
     def check_movie_year(self, movie_year, profile_years):
         # because we got rid of hallucinations before
         # now everything is fine if we have missing data
@@ -405,11 +438,12 @@ class MovieRec(gym.Env):
 
         if len(error_items) == 0:
             didactic_feedback = Feedback(
-                r=f"The recommended movies are all from the {correct_years}, great!")
+                r=FeedbackTemplate('year_r_pos', dict(correct_years=correct_years)))
             return True, None, didactic_feedback, {'unsatisfied': []}
 
         feedback = f"The recommended {self.profile['type_']}s are not from the {correct_years}."
-        didactic_feedback = Feedback(r=feedback)
+        kwargs = dict(movie=self.profile['type_'], correct_years=correct_years)
+        didactic_feedback = Feedback(r=FeedbackTemplate('year_r_neg', kwargs))
 
         if first_order:
             for item in error_items:
@@ -417,28 +451,18 @@ class MovieRec(gym.Env):
             feedback += f" I want {self.profile['type_']}s from the {correct_years}."
 
         if len(success_items) > 0:
-            hp = f"These {self.profile['type_']}s are indeed from the {correct_years}:"
-            for item in success_items:
-                hp += f" {item[0]} is from {item[1]},"
-            didactic_feedback.hp = hp
+            rest = self._list_items([f"{item[0]} is from {item[1]}" for item in success_items])
+            didactic_feedback.hp = FeedbackTemplate('year_hp', dict(kwargs, rest=rest))
 
         if len(error_items) > 0:
-            hn = f"These {self.profile['type_']}s are not from the {correct_years}:"
-            for item in error_items:
-                hn += f" {item[0]} is from {item[1]},"
-            didactic_feedback.hn = hn
+            rest = self._list_items([f"{item[0]} is from {item[1]}" for item in error_items])
+            didactic_feedback.hn = FeedbackTemplate('year_hn', dict(kwargs, rest=rest))
 
-        fp = f"Recommend {self.profile['type_']}s that are from {correct_years}, like"
-        for item in success_items:
-            fp += f" {item[0]},"
-        fp += '.'
-        didactic_feedback.fp = fp
+        rest = self._list_items([item[0] for item in success_items]) + '.'
+        didactic_feedback.fp = FeedbackTemplate('year_fp', dict(kwargs, rest=rest))
 
-        fn = f"Do not recommend {self.profile['type_']}s that are not from {correct_years}, like"
-        for item in error_items:
-            fn += f" {item[0]},"
-        fn += '.'
-        didactic_feedback.fn = fn
+        rest = self._list_items([item[0] for item in error_items]) + '.'
+        didactic_feedback.fn = FeedbackTemplate('year_fn', dict(kwargs, rest=rest))
 
         return False, feedback, didactic_feedback, {"unsatisfied": [item[0] for item in error_items]}
 
@@ -452,14 +476,16 @@ class MovieRec(gym.Env):
             else:
                 success_items.append((title, movie_genres))
 
+        genres = self._list_to_string(profile_genres, last_separator=' and ')
         if len(error_items) == 0 and len(success_items) > 0:
             didactic_feedback = Feedback(
-                r=f"The recommended {self.profile['type_']}s are all {self._list_to_string(profile_genres, last_separator=' and ')}, nice!")
+                r=FeedbackTemplate('genre_r_pos', dict(movie=self.profile['type_'], action_comedy_movie=genres)))
             return True, None, didactic_feedback, {'unsatisfied': []}
 
-        feedback = f"The recommendations are not all {self._list_to_string(profile_genres, last_separator=' and ')} {self.profile['type_']}s."
+        feedback = f"The recommendations are not all {genres} {self.profile['type_']}s."
 
-        didactic_feedback = Feedback(r=feedback)
+        didactic_feedback = Feedback(r=FeedbackTemplate('genre_r_neg', dict(action_comedy_movie=f"{genres} {self.profile['type_']}")))
+        kwargs = dict(movie=self.profile['type_'], action_comedy=genres)
 
         if first_order:
             for item in error_items:
@@ -467,28 +493,18 @@ class MovieRec(gym.Env):
             feedback += f" I want {self.profile['type_']}s that are {self._list_to_string(profile_genres, last_separator=' and ')}."
 
         if len(success_items) > 0:
-            hp = f"These {self.profile['type_']}s are indeed {self._list_to_string(profile_genres, last_separator=' and ')}:"
-            for item in success_items:
-                hp += f" {item[0]} is {self._list_to_string(item[1])},"
-            didactic_feedback.hp = hp
+            rest = self._list_items([f"{item[0]} is {self._list_to_string(item[1])}" for item in success_items])
+            didactic_feedback.hp = FeedbackTemplate('genre_hp', dict(kwargs, rest=rest))
 
         if len(error_items) > 0:
-            hn = f"These {self.profile['type_']}s are not {self._list_to_string(profile_genres, last_separator=' and ')}:"
-            for item in error_items:
-                hn += f" {item[0]} is {self._list_to_string(item[1])},"
-            didactic_feedback.hn = hn
+            rest = self._list_items([f"{item[0]} is {self._list_to_string(item[1])}" for item in error_items])
+            didactic_feedback.hn = FeedbackTemplate('genre_hn', dict(kwargs, rest=rest))
 
-        fp = f"Recommend {self.profile['type_']}s that are {self._list_to_string(profile_genres, last_separator=' and ')}, like"
-        for item in success_items:
-            fp += f" {item[0]},"
-        fp += '.'
-        didactic_feedback.fp = fp
+        rest = self._list_items([item[0] for item in success_items]) + '.'
+        didactic_feedback.fp = FeedbackTemplate('genre_fp', dict(kwargs, rest=rest))
 
-        fn = f"Do not recommend {self.profile['type_']}s that are not {self._list_to_string(profile_genres, last_separator=' and ')}, not like"
-        for item in error_items:
-            fn += f" {item[0]},"
-        fn += '.'
-        didactic_feedback.fn = fn
+        rest = self._list_items([item[0] for item in error_items]) + '.'
+        didactic_feedback.fn = FeedbackTemplate('genre_fn', dict(kwargs, rest=rest))
 
         return False, feedback, didactic_feedback, {"unsatisfied": [item[0] for item in error_items]}
 
@@ -518,7 +534,7 @@ class MovieRec(gym.Env):
 
         if len(error_items) == 0 and len(success_items) > 0:
             didactic_feedback = Feedback(
-                r=f"What you recommended are {self.profile['type_']}s, nice!")
+                r=FeedbackTemplate('type_r_pos', dict(movie=self.profile['type_'])))
             return True, None, didactic_feedback, {'unsatisfied': []}
         elif  len(error_items) == 0 and len(success_items) == 0:
             didactic_feedback = Feedback(
@@ -532,31 +548,21 @@ class MovieRec(gym.Env):
                 feedback += f" Please suggest {profile_type}s instead."
 
             didactic_feedback = Feedback(
-                r=f"The recommended items are not all {profile_type}s.")
+                r=FeedbackTemplate('type_r_neg', dict(movie=profile_type)))
 
             if len(success_items) > 0:
-                hp = f"These items are indeed all {profile_type}s:"
-                for item in success_items:
-                    hp += f" {item[0]},"
-                didactic_feedback.hp = hp
+                rest = self._list_items([item[0] for item in success_items])
+                didactic_feedback.hp = FeedbackTemplate('type_hp', dict(movie=profile_type, rest=rest))
 
             if len(error_items) > 0:
-                hn = f"These items are not all {profile_type}s:"
-                for item in error_items:
-                    hn += f" {item[0]} is {item[1]},"
-                didactic_feedback.hn = hn
-
-            fp = f"Recommend {profile_type}s, like"
-            for item in success_items:
-                fp += f" {item[0]},"
-            fp += '.'
-            didactic_feedback.fp = fp
-
-            fn = f"Do not recommend items that are not {profile_type}s, like"
-            for item in error_items:
-                fn += f" {item[0]},"
-            fn += '.'
-            didactic_feedback.fn = fn
+                rest = self._list_items([f"{item[0]} is {item[1]}" for item in error_items])
+                didactic_feedback.hn = FeedbackTemplate('type_hn', dict(movie=profile_type, rest=rest))
+
+            rest = self._list_items([item[0] for item in success_items]) + '.'
+            didactic_feedback.fp = FeedbackTemplate('type_fp', dict(movie=profile_type, rest=rest))
+
+            rest = self._list_items([item[0] for item in error_items]) + '.'
+            didactic_feedback.fn = FeedbackTemplate('type_fn', dict(movie=profile_type, rest=rest))
 
             return False, feedback, didactic_feedback, {'unsatisfied': error_items}
 
@@ -586,7 +592,8 @@ class MovieRec(gym.Env):
 
         if len(error_items) == 0:
             didactic_feedback = Feedback(
-                r=f"The recommended {self.profile['type_']}s are all {profile_age_restriction}, awesome!")
+                r=FeedbackTemplate('child_friendly_r_pos', dict(movie=self.profile['type_'],
+                                                                child_friendly=profile_age_restriction)))
             return True, None, didactic_feedback, {'unsatisfied': []}
         else:
             feedback = self._list_to_string(error_items)
@@ -595,32 +602,20 @@ class MovieRec(gym.Env):
             if first_order:
                 feedback += f" Please suggest {profile_age_restriction} {profile_type}s instead."
 
-            didactic_feedback = Feedback(
-                r=f"The recommended {self.profile['type_']}s are not all {profile_age_restriction}.")
+            kwargs = dict(movie=self.profile['type_'], child_friendly=profile_age_restriction)
+            didactic_feedback = Feedback(r=FeedbackTemplate('child_friendly_r_neg', kwargs))
 
             if len(success_items) > 0:
-                hp = f"These {self.profile['type_']}s are indeed {profile_age_restriction}:"
-                for item in success_items:
-                    hp += f" {item},"
-                didactic_feedback.hp = hp
+                didactic_feedback.hp = FeedbackTemplate('child_friendly_hp', dict(kwargs, rest=self._list_items(success_items)))
 
             if len(error_items) > 0:
-                hn = f"These {self.profile['type_']}s are not {profile_age_restriction}:"
-                for item in error_items:
-                    hn += f" {item},"
-                didactic_feedback.hn = hn
-
-            fp = f"Recommend {self.profile['type_']}s that are {profile_age_restriction}, like"
-            for item in success_items:
-                fp += f" {item},"
-            fp += '.'
-            didactic_feedback.fp = fp
-
-            fn = f"Do not recommend {self.profile['type_']}s that are not {profile_age_restriction}, like"
-            for item in error_items:
-                fn += f" {item[0]},"
-            fn += '.'
-            didactic_feedback.fn = fn
+                didactic_feedback.hn = FeedbackTemplate('child_friendly_hn', dict(kwargs, rest=self._list_items(error_items)))
+
+            rest = self._list_items(success_items) + '.'
+            didactic_feedback.fp = FeedbackTemplate('child_friendly_fp', dict(kwargs, rest=rest))
+
+            rest = self._list_items(error_items) + '.'
+            didactic_feedback.fn = FeedbackTemplate('child_friendly_fn', dict(kwargs, rest=rest))
 
             return False, feedback, didactic_feedback, {'unsatisfied': error_items}
 
@@ -633,7 +628,7 @@ class MovieRec(gym.Env):
                 success_items.append(title)
 
         if len(error_items) == 0:
-            didactic_feedback = Feedback(r=f"I can find all the recommended {self.profile['type_']}s, nice!")
+            didactic_feedback = Feedback(r=FeedbackTemplate('hallucination_r_pos', dict(movie=self.profile['type_'])))
             return True, None, didactic_feedback, {'unsatisfied': []}
         else:
             feedback = "I can't find " + self._list_to_string(error_items) + " on the internet."
@@ -642,32 +637,19 @@ class MovieRec(gym.Env):
             if first_order:
                 feedback += f" Are they even real? Please suggest {self.profile['type_']}s that actually exist."
 
-            didactic_feedback = Feedback(
-                r=f"I can't find some of the recommended {self.profile['type_']}s on the internet.")
+            # The templates of hallucination feedback end before the list of items.
+            kwargs = dict(movie=self.profile['type_'])
+            didactic_feedback = Feedback(r=FeedbackTemplate('hallucination_r_neg', kwargs))
 
             if len(success_items) > 0:
-                hp = f"I can find these {self.profile['type_']}s on the internet:"
-                for item in success_items:
-                    hp += f" {item},"
-                didactic_feedback.hp = hp
+                didactic_feedback.hp = [FeedbackTemplate('hallucination_hp', kwargs), ' ' + self._list_items(success_items)]
 
             if len(error_items) > 0:
-                hn = f"I can't find these {self.profile['type_']}s on the internet:"
-                for item in error_items:
-                    hn += f" {item},"
-                didactic_feedback.hn = hn
-
-            fp = f"Recommend {self.profile['type_']}s that I can find online, like:"
-            for item in success_items:
-                fp += f" {item},"
-            fp += '.'
-            didactic_feedback.fp = fp
-
-            fn = f"Do not recommend {self.profile['type_']}s that I can't find online, like:"
-            for item in error_items:
-                fn += f" {item},"
-            fn += '.'
-            didactic_feedback.fn = fn
+                didactic_feedback.hn = [FeedbackTemplate('hallucination_hn', kwargs), ' ' + self._list_items(error_items)]
+
+            didactic_feedback.fp = [FeedbackTemplate('hallucination_fp', kwargs), ' ' + self._list_items(success_items) + '.']
+
+            didactic_feedback.fn = [FeedbackTemplate('hallucination_fn', kwargs), ' ' + self._list_items(error_items) + '.']
 
             return False, feedback, didactic_feedback, {'unsatisfied': error_items}
 
@@ -764,6 +746,11 @@ class MovieRec(gym.Env):
         if self.profile is None:
             raise Exception("Must call env.reset() before calling env.step()")
 
+        if self.extractor is not None and type(a) != list:
+            rec_movies = self.extract_with_retry(a)
+            if rec_movies is not None:  # otherwise, the feedback below shows the action of the agent
+                a = rec_movies
+
         if self.extractor is None and type(a) != list:
             try:
                 a = eval(a)
@@ -786,7 +773,7 @@ class MovieRec(gym.Env):
             return self.generate_request_query(), 0, False, {"raw_action": a,
                                                              "original_feedback": "You didn't recommend anything to me.",
                                                              'feedback': {"no_rec": Feedback(
-                                                                 r="You didn't recommend anything to me.")},
+                                                                 r=FeedbackTemplate('no_rec_r_neg', {}))},
                                                              "item_errors": {},
                                                              'success': False}
 
@@ -1,11 +1,17 @@
 from llfbench.envs.env_wrappers import TerminalFreeWrapper, EnvCompatibility
 from llfbench.envs.llf_env import LLFWrapper, Feedback
 from llfbench.envs.reco.prompts import *
+from llfbench.envs.reco import prompts
+from llfbench.envs.utils import register_templates
 from llfbench.envs.reco.movie_rec import MovieRec
+from llfbench.envs.reco import INSTRUCTION_TYPES, FEEDBACK_TYPES
+
+register_templates(prompts)  # compile the templates used in reformat once
 
 class MovieRecGymWrapper(LLFWrapper):
-    INSTRUCTION_TYPES = ('b')  # , 'p', 'c')
-    FEEDBACK_TYPES = ('r', 'hp', 'hn', 'fp', 'fn')
+    INSTRUCTION_TYPES = INSTRUCTION_TYPES  # see llfbench/envs/reco/__init__.py
+    FEEDBACK_TYPES = FEEDBACK_TYPES  # see llfbench/envs/reco/__init__.py
+    PROMPTS = prompts
 
     def __init__(self, env, instruction_type, feedback_type):
         super().__init__(TerminalFreeWrapper(EnvCompatibility(env)), instruction_type, feedback_type)
@@ -25,54 +31,38 @@ class MovieRecGymWrapper(LLFWrapper):
     def _step(self, action):
         observation, reward, terminated, truncated, info = self.env.step(action)
         didactic_feedback = info['feedback']
-        del info['original_feedback']
+        info.pop('original_feedback', None)
         del info['feedback']
 
-        attribute_list = ["hallucination", "type", "genre", "year", "child_friendly"]
-
-        paraphrased_feedback = Feedback(r="", hp="", hn="", fp="", fn="")
-
-        for attribute in attribute_list:
-            if attribute not in didactic_feedback:
-                continue
-
-            for feedback_type in self._feedback_type:
-                if didactic_feedback[attribute][feedback_type] is None:
-                    continue
-
-                if feedback_type == 'r':
-                    r_pos_temp = eval(f"{attribute}_r_pos_template")
-                    r_pos = eval(f"{attribute}_r_pos")
-                    feedback = self.reformat(didactic_feedback[attribute][feedback_type], r_pos, template=r_pos_temp)
-
-                    r_neg_temp = eval(f"{attribute}_r_neg_template")
-                    r_neg = eval(f"{attribute}_r_neg")
-                    feedback = self.reformat(feedback, r_neg, template=r_neg_temp)
-
-                    paraphrased_feedback.r += feedback + '\n'
-
-                else:
-                    # if LLM suggestion is correct on the attribute, some feedback might not show up
-                    # like, r is filled, but not hn
-                    feedback_temp = eval(f"{attribute}_{feedback_type}_template")
-                    feedback_prompts = eval(f"{attribute}_{feedback_type}")
-                    feedback = self.reformat(didactic_feedback[attribute][feedback_type], feedback_prompts, template=feedback_temp)
-
-                    paraphrased_feedback[feedback_type] += feedback + '\n'
-
-        if 'no_rec' in didactic_feedback:
-            feedback = self.reformat(didactic_feedback['no_rec'].r,
-                                                no_rec_r_neg, template=no_rec_r_neg_template)
-            paraphrased_feedback.r += feedback + '\n'
-
-        # manually set things to None for consistency
-        for ftype in ['r', 'hp', 'hn', 'fp', 'fn']:
-            if paraphrased_feedback[ftype] == '':
-                paraphrased_feedback[ftype] = None
+        if isinstance(didactic_feedback, Feedback):  # the action has an invalid format
+            didactic_feedbacks = [didactic_feedback]
+        else:
+            attribute_list = ["hallucination", "type", "genre", "year", "child_friendly", "no_rec"]
+            didactic_feedbacks = [didactic_feedback[attribute] for attribute in attribute_list
+                                  if attribute in didactic_feedback]
+
+        # render the feedback of all the attributes at once
+        feedback_type = self._feedback_type
+        feedback_types = [ft for ft in self.FEEDBACK_TYPES if ft in feedback_type]
+        rendered = self.render_templates([feedback[ft] for feedback in didactic_feedbacks for ft in feedback_types])
+
+        paraphrased_feedback = Feedback()
+        for i, ft in enumerate(feedback_types):
+            # if LLM suggestion is correct on the attribute, some feedback might not show up
+            # like, r is filled, but not hn
+            lines = [line for line in rendered[i::len(feedback_types)] if line is not None]
+            if len(lines) > 0:
+                paraphrased_feedback[ft] = ''.join(line + '\n' for line in lines)
 
         observation = dict(instruction=None, observation=observation, feedback=paraphrased_feedback)
         return observation, reward, terminated, truncated, info
 
+    def _get_state(self):
+        return self._movie_rec_env.get_state()
+
+    def _set_state(self, state):
+        self._movie_rec_env.set_state(state)
+
     @property
     def _movie_rec_env(self):
         return self.env.env.env
@@ -0,0 +1,79 @@
+from typing import Dict, Any, Tuple, Sequence, NamedTuple
+from gymnasium.envs.registration import register as gym_register
+
+"""
+
+The metadata of the registered LLF-Bench envs.
+
+Each env subpackage registers its envs with `register` below, which forwards
+to gymnasium's register and also records the supported instruction types,
+feedback types and reward range of the env. These can then be queried without
+constructing the env, which can be expensive (e.g. building a MuJoCo sim or a
+TextWorld game).
+
+"""
+
+# 'n' (none), 'a' (all), 'm' (mixed) are supported by every LLFWrapper on top
+# of its own FEEDBACK_TYPES.
+GENERIC_FEEDBACK_TYPES = ('n', 'a', 'm')
+
+
+class EnvMetadata(NamedTuple):
+    instruction_types: Tuple[str, ...]
+    feedback_types: Tuple[str, ...]
+    reward_range: Tuple[float, float]
+
+
+class MetadataRegistry:
+    """ The metadata of the registered envs, keyed by env id. """
+
+    _metadata: Dict[str, EnvMetadata] = {}
+
+    @classmethod
+    def add(cls,
+            env_id: str,
+            instruction_types: Sequence[str],
+            feedback_types: Sequence[str],
+            reward_range: Tuple[float, float]):
+        # tuple(...) so that a list, or a str such as 'b' for a single type,
+        # gives the same tuple of types as the wrappers.
+        cls._metadata[env_id] = EnvMetadata(tuple(instruction_types), tuple(feedback_types), tuple(reward_range))
+
+    @classmethod
+    def get(cls, env_id: str) -> EnvMetadata:
+        if env_id not in cls._metadata:
+            raise KeyError(f'No metadata is registered for {env_id}.')
+        return cls._metadata[env_id]
+
+    @classmethod
+    def contains(cls, env_id: str) -> bool:
+        return env_id in cls._metadata
+
+    @classmethod
+    def env_ids(cls) -> Tuple[str, ...]:
+        return tuple(cls._metadata)
+
+
+def register(id: str,
+             entry_point: str,
+             kwargs: Dict[str, Any],
+             instruction_types: Sequence[str],
+             feedback_types: Sequence[str],
+             reward_range: Tuple[float, float]):
+    """ Register an env to gymnasium and record its metadata.
+
+        Args:
+            id: The env id, e.g. 'llf-gridworld-v0'.
+
+            entry_point: The entry point passed to gymnasium's register.
+
+            kwargs: The kwargs passed to the entry point.
+
+            instruction_types: The INSTRUCTION_TYPES of the LLFWrapper of the env.
+
+            feedback_types: The FEEDBACK_TYPES of the LLFWrapper of the env.
+
+            reward_range: The reward_range of the env.
+    """
+    gym_register(id=id, entry_point=entry_point, kwargs=kwargs)
+    MetadataRegistry.add(id, instruction_types, feedback_types, reward_range)
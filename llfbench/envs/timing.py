@@ -0,0 +1,88 @@
+import time
+from typing import Any, Dict
+
+"""
+
+Low-overhead timers for the stages of LLFWrapper.reset and LLFWrapper.step.
+
+The durations of each stage are aggregated into a count, a total, a min, a
+max, and a histogram with power-of-two buckets in microseconds, i.e. bucket i
+counts the durations in [2^(i-1), 2^i) us (bucket 0 counts those below 1 us).
+
+"""
+
+N_BUCKETS = 32  # the last bucket also counts all the durations above ~36 min
+
+
+class StageStats:
+    """ The aggregated durations of a stage. """
+
+    __slots__ = ('count', 'total', 'min', 'max', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.histogram = [0] * N_BUCKETS
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        self.histogram[min(int(duration * 1e6).bit_length(), N_BUCKETS - 1)] += 1
+
+    def asdict(self) -> Dict[str, Any]:
+        return dict(count=self.count,
+                    total=self.total,
+                    mean=self.total / self.count if self.count else 0.0,
+                    min=self.min if self.count else 0.0,
+                    max=self.max,
+                    # the upper bound of the bucket in us -> count
+                    histogram={2 ** i: n for i, n in enumerate(self.histogram) if n > 0})
+
+
+class StageTimer:
+    """ Time named stages and aggregate their durations.
+
+        Usage:
+            start = timer.now()
+            ...  # stage a
+            start = timer.record('a', start)
+            ...  # stage b
+            timer.record('b', start)
+    """
+
+    now = staticmethod(time.perf_counter)
+
+    def __init__(self):
+        self._stats = {}
+        self._current = {}
+
+    def begin(self):
+        """ Start a new call (reset or step); see `current`. """
+        self._current = {}
+
+    def record(self, stage: str, start: float) -> float:
+        """ Record the duration of a stage that began at `start` and return
+            the current time, which can be used as the start of the next stage.
+        """
+        end = time.perf_counter()
+        duration = end - start
+        stats = self._stats.get(stage)
+        if stats is None:
+            stats = self._stats[stage] = StageStats()
+        stats.add(duration)
+        self._current[stage] = self._current.get(stage, 0.0) + duration
+        return end
+
+    def current(self) -> Dict[str, float]:
+        """ The total duration of each stage since the last `begin`. """
+        return dict(self._current)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """ The aggregated durations of each stage. """
+        return {stage: stats.asdict() for stage, stats in self._stats.items()}
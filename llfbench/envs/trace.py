@@ -0,0 +1,375 @@
+import os
+import glob
+import gzip
+import json
+import queue
+import atexit
+import string
+import threading
+import functools
+import numpy as np
+import gymnasium as gym
+from typing import Any, Dict, Iterator, List, Tuple, Union
+from llfbench.envs.llf_env import Feedback
+from llfbench.envs.utils import get_template
+
+"""
+
+Streaming traces of LLF-Bench episodes.
+
+TraceRecorder is a wrapper that writes one JSON record for every reset and
+step of the env, e.g.
+
+    {"episode": 0, "step": 0, "seed": 0, "observation": {...}, "info": {...}}
+    {"episode": 0, "step": 1, "action": ..., "observation": {...}, "reward": 0.0,
+     "terminated": false, "truncated": false, "info": {...}}
+
+where observation['feedback'] is the verbalized feedback returned by the env.
+The records are encoded in the calling thread and handed over to a background
+thread through a bounded queue; that thread writes them into gzip compressed
+JSONL chunks of at most `chunk_size` records each,
+
+    path/trace-00000.jsonl.gz, path/trace-00001.jsonl.gz, ...
+
+so memory stays bounded however long the run is. TraceReader iterates over
+the records (or episodes) of a trace lazily, one chunk at a time. Closing the
+recorder writes the last chunk; the writers that are still open when the
+interpreter exits are closed then.
+
+With compact_templates=True, the instruction and the feedback are stored as
+the (template_id, field, kwargs) records of the paraphrased templates they
+are made of (see LLFWrapper.enable_template_records), e.g.
+
+    {"episode": 0, "step": 1, "observation": {"feedback": [0, " ", 1], ...},
+     "templates": [[2570561062, "r", []], [3260423470, "hp", ["x = [1.0, 2.0]"]]], ...}
+
+i.e. a list of segments, each of which is either a literal string or the
+index of a template record (and so are the fields of the didactic Feedback in info['feedback']), and
+the kwargs of a record are stored as the list of the values of the fields of
+its template, in order.
+The templates of the ids are saved in path/templates.json, and TraceReader
+renders the text back from the segments.
+
+"""
+
+CHUNK_PATTERN = 'trace-{:05d}.jsonl.gz'
+TEMPLATES_FILE = 'templates.json'
+COMPACT_KEYS = ('instruction', 'feedback')
+
+
+class TraceEncoder(json.JSONEncoder):
+    """ A JSON encoder for the objects found in observations and infos. """
+
+    def default(self, obj):
+        if isinstance(obj, Feedback):
+            return obj.asdict()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, (set, frozenset)):
+            return list(obj)
+        # Do not stop a long run because of an object that cannot be encoded.
+        return repr(obj)
+
+
+class TraceWriter:
+    """ Write JSON records into compressed JSONL chunks in a background thread. """
+
+    _STOP = object()
+
+    def __init__(self, path: str, chunk_size: int = 10000, buffer_size: int = 1000, compresslevel: int = 6):
+        """
+            Args:
+                path: The directory where the chunks are written.
+
+                chunk_size: The maximal number of records in a chunk.
+
+                buffer_size: The maximal number of records waiting to be
+                written. `write` blocks when the buffer is full.
+
+                compresslevel: The gzip compression level.
+        """
+        assert chunk_size > 0 and buffer_size > 0
+        os.makedirs(path, exist_ok=True)
+        assert not glob.glob(os.path.join(path, 'trace-*.jsonl.gz')), f'{path} already contains a trace.'
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compresslevel = compresslevel
+        self.closed = False
+        self.encoder = TraceEncoder()
+        self.templates = {}  # the templates of the ids in the trace, saved in TEMPLATES_FILE
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        _open_writers.add(self)
+
+    def _run(self):
+        n_chunks, n_records, file = 0, 0, None
+        try:
+            while True:
+                line = self._queue.get()
+                try:
+                    if line is self._STOP:
+                        break
+                    if file is None:
+                        chunk_path = os.path.join(self.path, CHUNK_PATTERN.format(n_chunks))
+                        file = gzip.open(chunk_path, 'wt', encoding='utf-8', compresslevel=self.compresslevel)
+                    file.write(line)
+                    n_records += 1
+                    if n_records == self.chunk_size:
+                        file.close()
+                        file, n_chunks, n_records = None, n_chunks + 1, 0
+                finally:
+                    self._queue.task_done()
+        except Exception as e:
+            self._error = e
+            while True:  # unblock the callers of write
+                line = self._queue.get()
+                self._queue.task_done()
+                if line is self._STOP:
+                    break
+        finally:
+            if file is not None:
+                file.close()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise RuntimeError(f'Writing the trace to {self.path} failed.') from self._error
+
+    def write(self, record: Dict[str, Any]):
+        """ Encode the record and add it to the write buffer. """
+        assert not self.closed, 'The trace writer has been closed.'
+        self._check_error()
+        # Encode now, since the objects in the record may be modified later.
+        self._queue.put(self.encoder.encode(record) + '\n')
+
+    def _save_templates(self):
+        if self.templates:
+            with open(os.path.join(self.path, TEMPLATES_FILE), 'w') as f:
+                json.dump({str(tid): template for tid, template in self.templates.items()}, f)
+
+    def flush(self):
+        """ Wait until all the buffered records are written. """
+        self._queue.join()
+        self._save_templates()
+        self._check_error()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        _open_writers.discard(self)
+        self._queue.put(self._STOP)
+        self._thread.join()
+        try:
+            self._save_templates()
+        finally:
+            self._check_error()
+
+
+# The writers that are not closed yet. Their thread is a daemon, which would be
+# killed at exit with the last chunk unwritten, so they are closed by atexit.
+_open_writers = set()
+
+
+@atexit.register
+def _close_open_writers():
+    for writer in list(_open_writers):
+        try:
+            writer.close()
+        except Exception:
+            pass  # the other writers are still closed
+
+
+def compact_text(text: str, rendered: List[Union[str, None]]) -> List[Union[str, int]]:
+    """ Split text into segments, each of which is either a literal string or
+        the index of a rendered template in `rendered` (None if it cannot be
+        used), such that joining the segments gives back the text.
+    """
+    segments, start, unused = [], 0, {i for i, r in enumerate(rendered) if r}
+    while True:
+        # the earliest (then longest) rendered template in the rest of the text
+        best = None
+        for i in sorted(unused):
+            position = text.find(rendered[i], start)
+            if position >= 0 and (best is None or (position, -len(rendered[i])) < best[:2]):
+                best = (position, -len(rendered[i]), i)
+        if best is None:
+            break
+        position, _, i = best
+        if position > start:
+            segments.append(text[start:position])
+        segments.append(i)
+        start = position + len(rendered[i])
+        unused.discard(i)
+    if start < len(text):
+        segments.append(text[start:])
+    return segments
+
+
+@functools.lru_cache(maxsize=None)
+def template_fields(template: str) -> Tuple[str, ...]:
+    """ The names of the fields of a template, in order, e.g. ('x', 'y') for '{x[0]} and {y:.2f}'. """
+    names = []
+    for _, name, _, _ in string.Formatter().parse(template):
+        if name:
+            name = name.split('.')[0].split('[')[0]
+            if name not in names:
+                names.append(name)
+    return tuple(names)
+
+
+def render_segments(segments: List[Union[str, int]], templates: List[Any], bank: Dict[int, str]) -> str:
+    """ Join the segments of compact_text, where the templates are the
+        (template_id, field, values) records of a trace record.
+    """
+    def render(tid, values):
+        template = bank[tid]
+        return template.format(**dict(zip(template_fields(template), values)))
+    return ''.join(s if isinstance(s, str) else render(templates[s][0], templates[s][2]) for s in segments)
+
+
+class TraceRecorder(gym.Wrapper):
+    """
+        Record the observation, action, reward, terminated, truncated and info
+        of every reset and step of the env into a trace. See TraceWriter for the
+        arguments.
+
+        With compact_templates=True, the instruction and feedback are stored as
+        template records instead of text (see the module docstring), and the
+        env must have an LLFWrapper.
+    """
+
+    def __init__(self, env, path: str, chunk_size: int = 10000, buffer_size: int = 1000,
+                 compresslevel: int = 6, record_info: bool = True, compact_templates: bool = False):
+        super().__init__(env)
+        self.writer = TraceWriter(path, chunk_size=chunk_size, buffer_size=buffer_size, compresslevel=compresslevel)
+        self.record_info = record_info
+        self.compact_templates = compact_templates
+        if compact_templates:
+            self.env.get_wrapper_attr('enable_template_records')()
+        self._episode = -1
+        self._step = 0
+
+    def _compact(self, record, info):
+        # Replace the instruction and the feedback by the template records in info.
+        records = info.get('templates', [])
+        templates, rendered = [], []
+        for tid, field, kwargs in records:
+            template = get_template(tid)
+            values, text = self._values(template, kwargs)
+            templates.append([tid, field, values])
+            rendered.append(text)
+            self.writer.templates[tid] = template
+        observation = dict(record['observation'])
+        for key in COMPACT_KEYS:
+            if isinstance(observation.get(key), str):
+                observation[key] = compact_text(observation[key], rendered)
+        record['observation'] = observation
+        record['templates'] = templates
+        if 'info' in record:
+            record['info'] = {k: v for k, v in info.items() if k != 'templates'}
+            # the didactic feedback, whose fields are the rendered templates
+            if isinstance(info.get('feedback'), Feedback):
+                record['info']['feedback'] = {k: compact_text(v, rendered) if isinstance(v, str) else v
+                                              for k, v in info['feedback'].items()}
+
+    def _values(self, template, kwargs):
+        # The values of the fields of the template, stored as JSON, and the
+        # rendered text, or None if the values do not render the same text.
+        # Values that are not JSON types (e.g. numpy arrays, whose JSON lists
+        # are printed differently) are stored as strings if needed.
+        try:
+            names = template_fields(template)
+            raw = [kwargs[k] for k in names]
+            text = template.format(**kwargs)
+            for values in (raw, [v if isinstance(v, (str, int, float, bool, type(None))) else str(v) for v in raw]):
+                values = json.loads(self.writer.encoder.encode(values))
+                if template.format(**dict(zip(names, values))) == text:
+                    return values, text
+        except (KeyError, IndexError, ValueError, TypeError):
+            pass
+        return [], None
+
+    def _write(self, record, info):
+        if self.record_info:
+            record['info'] = info
+        if self.compact_templates:
+            self._compact(record, info)
+        self.writer.write(record)
+
+    def reset(self, *, seed=None, options=None):
+        observation, info = self.env.reset(seed=seed, options=options)
+        self._episode += 1
+        self._step = 0
+        self._write(dict(episode=self._episode, step=self._step, seed=seed, observation=observation), info)
+        return observation, info
+
+    def step(self, action):
+        observation, reward, terminated, truncated, info = self.env.step(action)
+        self._step += 1
+        self._write(dict(episode=self._episode, step=self._step, action=action, observation=observation,
+                         reward=reward, terminated=terminated, truncated=truncated), info)
+        return observation, reward, terminated, truncated, info
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        # the env is closed even if writing the end of the trace failed
+        try:
+            self.writer.close()
+        finally:
+            super().close()
+
+
+class TraceReader:
+    """ Lazily iterate over the records of a trace written by TraceRecorder. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.chunks = sorted(glob.glob(os.path.join(path, 'trace-*.jsonl.gz')))
+        self.templates = {}  # id -> template, of a trace with compact templates
+        templates_path = os.path.join(path, TEMPLATES_FILE)
+        if os.path.exists(templates_path):
+            with open(templates_path) as f:
+                self.templates = {int(tid): template for tid, template in json.load(f).items()}
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for chunk in self.chunks:
+            with gzip.open(chunk, 'rt', encoding='utf-8') as file:
+                try:
+                    for line in file:
+                        record = json.loads(line)
+                        if 'templates' in record:
+                            self._render(record)
+                        yield record
+                except EOFError:  # the last chunk of a trace that was not closed
+                    pass
+
+    def _render(self, record):
+        # Render back the text of the compact instruction and feedback.
+        def render(value):
+            if isinstance(value, list):  # the segments of the text
+                return render_segments(value, record['templates'], self.templates)
+            return value
+        observation = record['observation']
+        for key in COMPACT_KEYS:
+            if key in observation:
+                observation[key] = render(observation[key])
+        feedback = record.get('info', {}).get('feedback')
+        if isinstance(feedback, dict):
+            record['info']['feedback'] = {k: render(v) for k, v in feedback.items()}
+
+    def episodes(self) -> Iterator[List[Dict[str, Any]]]:
+        """ Iterate over the episodes, each of which is a list of records. """
+        episode = []
+        for record in self:
+            if episode and record['episode'] != episode[0]['episode']:
+                yield episode
+                episode = []
+            episode.append(record)
+        if episode:
+            yield episode
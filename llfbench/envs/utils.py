@@ -1,8 +1,13 @@
+import random
+import hashlib
+import contextlib
 import numpy as np
+import parse
 
+from types import ModuleType
 from typing import Dict, Any, Tuple, Union, List, Callable
 
-def format(prompts : List[str], method : Union[str, int] = 'random', **kwargs : Dict[str,str]):
+def format(prompts : List[str], method : Union[str, int] = 'random', rng : Union[np.random.Generator, None] = None, **kwargs : Dict[str,str]):
     """ A helper method for selecting from a set of paraphrased prompts.
 
         Args:
@@ -16,13 +21,154 @@ def format(prompts : List[str], method : Union[str, int] = 'random', **kwargs :
 
             If it is an integer, it is used as the index to select from the template in `prompts`.
 
+            rng: The random generator used when method is 'random'. If None,
+            a new generator with fresh entropy is used.
+
             **kwargs: The keyword arguments to be used in formatting the template.
 
     """
+    idx = sample_template_indices([len(prompts)], method, rng)[0]
+    return prompts[idx].format(**kwargs)
+
+
+def sample_template_indices(lengths : List[int], method : Union[str, int] = 'random', rng : Union[np.random.Generator, None] = None) -> np.ndarray:
+    """ Select the templates for many sets of paraphrased prompts in one call.
+
+        Args:
+            lengths: The number of templates in each set of prompts.
 
+            method: 'random' or an integer. See `format`.
+
+            rng: The random generator used when method is 'random'.
+
+        Returns:
+            An array of template indices, one for each set of prompts.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
     if method=='random':
-        return np.random.choice(prompts).format(**kwargs)
+        rng = np.random.default_rng() if rng is None else rng
+        return rng.integers(0, lengths)
     else:
         assert type(method)==int, "The method must be either 'random', 'llm', a callable, or an integer."
-        idx = method
-        return prompts[idx % len(prompts)].format(**kwargs)
+        return method % lengths
+
+
+# A process-wide registry of compiled templates used in reformatting.
+_PARSERS : Dict[str, parse.Parser] = {}
+
+def compile_template(template : str) -> parse.Parser:
+    """ Return the compiled parse.Parser of `template`. The template is
+        compiled only once and then cached in the registry.
+    """
+    parser = _PARSERS.get(template)
+    if parser is None:
+        parser = _PARSERS[template] = parse.compile(template)
+    return parser
+
+def register_templates(prompts : ModuleType):
+    """ Eagerly compile the templates in a prompts module.
+
+        These are the `*_template` strings and the first (default) template of
+        each set of paraphrased prompts, which are the templates used by
+        LLFWrapper.reformat.
+    """
+    for name, value in vars(prompts).items():
+        if name.startswith('_'):
+            continue
+        if isinstance(value, str) and name.endswith('_template'):
+            compile_template(value)
+        elif isinstance(value, (tuple, list)) and len(value) > 0 and isinstance(value[0], str):
+            compile_template(value[0])
+    intern_templates(prompts)
+
+
+# A process-wide bank of the interned paraphrased templates, keyed by id.
+_TEMPLATE_IDS : Dict[str, int] = {}
+_TEMPLATES : Dict[int, str] = {}
+
+def template_id(template : str) -> int:
+    """ Return the id of a template, adding it to the bank of templates.
+
+        The id is a 32-bit hash of the template, so it is the same in every
+        process and run, and (template_id, kwargs) records written by
+        different runs can be grouped by template.
+    """
+    tid = _TEMPLATE_IDS.get(template)
+    if tid is None:
+        tid = int.from_bytes(hashlib.blake2b(template.encode('utf-8'), digest_size=4).digest(), 'big')
+        other = _TEMPLATES.setdefault(tid, template)
+        assert other == template, f'The templates {other!r} and {template!r} have the same id {tid}.'
+        _TEMPLATE_IDS[template] = tid
+    return tid
+
+def intern_templates(prompts : ModuleType):
+    """ Add all the sets of paraphrased prompts of a prompts module to the
+        bank of templates, so that their ids can be looked up with
+        get_template, e.g. when reading a trace.
+    """
+    for name, value in vars(prompts).items():
+        if not name.startswith('_') and isinstance(value, (tuple, list)) and len(value) > 0 \
+                and all(isinstance(v, str) for v in value):
+            for template in value:
+                template_id(template)
+
+def get_template(tid : int) -> str:
+    """ Return the template of an id returned by template_id. """
+    return _TEMPLATES[tid]
+
+def template_bank() -> Dict[int, str]:
+    """ Return a copy of the bank of templates, i.e. a dict of id -> template. """
+    return dict(_TEMPLATES)
+
+def render_template_records(records : List[Tuple[int, Union[str, None], Dict[str, Any]]],
+                            templates : Union[Dict[int, str], None] = None) -> List[str]:
+    """ Render (template_id, field, kwargs) records, e.g. info['templates'] of
+        an LLFWrapper whose template records are enabled.
+
+        Args:
+            records: The records to render.
+
+            templates: A dict of id -> template, e.g. saved with a trace. If
+            None, the bank of templates of this process is used.
+    """
+    get = get_template if templates is None else templates.__getitem__
+    return [get(tid).format(**kwargs) for tid, _, kwargs in records]
+
+
+RNG = Union[random.Random, np.random.RandomState, np.random.Generator, None]
+
+def get_rng_state(rng : RNG) -> Any:
+    """ Return a snapshot of the state of a random generator, which can be
+        restored with set_rng_state. None is returned for None.
+    """
+    if rng is None:
+        return None
+    if isinstance(rng, random.Random):
+        return rng.getstate()
+    if isinstance(rng, np.random.RandomState):
+        return rng.get_state()
+    return rng.bit_generator.state
+
+def set_rng_state(rng : RNG, state : Any):
+    """ Restore the state returned by get_rng_state into `rng` in place. """
+    if isinstance(rng, random.Random):
+        rng.setstate(state)
+    elif isinstance(rng, np.random.RandomState):
+        rng.set_state(state)
+    else:
+        rng.bit_generator.state = state
+
+@contextlib.contextmanager
+def global_np_random(rng : np.random.RandomState):
+    """ Make the global numpy random state follow `rng` inside the context,
+        for code that samples from np.random (e.g. gym_bandits). The state
+        drawn inside the context is saved back into `rng`, and the global
+        state of the caller is restored when leaving the context.
+    """
+    saved = np.random.get_state()
+    np.random.set_state(rng.get_state())
+    try:
+        yield
+    finally:
+        rng.set_state(np.random.get_state())
+        np.random.set_state(saved)
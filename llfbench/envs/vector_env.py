@@ -0,0 +1,328 @@
+import traceback
+import multiprocessing as mp
+import multiprocessing.connection
+import numpy as np
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+from llfbench.utils.extraction import EXTRACT, RemoteExtractor
+
+"""
+
+A vectorized runner for LLF-Bench environments.
+
+Gymnasium's AsyncVectorEnv relies on the observation space to allocate shared
+memory and to stack observations, which does not work with the unbounded
+Text spaces used in LLF-Bench. Here observation dicts are sent back as python
+objects and batched into a dict of lists instead, e.g.
+
+    dict(instruction=[...], observation=[...], feedback=[...])
+
+while rewards, terminated and truncated are stacked into numpy arrays and
+infos are returned as a list of dicts.
+
+The LLM-backed extractors of the poem and reco envs run in the parent process
+when an extractor is given: the envs of the workers get a RemoteExtractor,
+and the parent runs the extractions requested by all the workers on a single
+ExtractionExecutor (see llfbench.utils.extraction), which deduplicates them
+and validates and retries them as it does for the envs of this process.
+
+"""
+
+OBSERVATION_KEYS = ('instruction', 'observation', 'feedback')
+
+# How often (in seconds) the parent checks the extractions of the workers.
+EXTRACTION_POLL_INTERVAL = 0.005
+
+# How long (in seconds) to wait for a worker to exit before terminating it.
+WORKER_CLOSE_TIMEOUT = 10
+
+
+def batch_observations(observations: Sequence[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """ Turn a list of observation dicts into a dict of lists. """
+    return {k: [observation[k] for observation in observations] for k in OBSERVATION_KEYS}
+
+
+def _get_attr(env, name):
+    # get_wrapper_attr searches through the wrapper stack without triggering
+    # the deprecation warning of gym.Wrapper.__getattr__.
+    if hasattr(env, 'get_wrapper_attr'):
+        return env.get_wrapper_attr(name)
+    return getattr(env, name)
+
+
+def _call(env, name, args, kwargs):
+    attr = _get_attr(env, name)
+    return attr(*args, **kwargs) if callable(attr) else attr
+
+
+def _step(env, action, autoreset):
+    observation, reward, terminated, truncated, info = env.step(action)
+    if autoreset and (terminated or truncated):
+        final_observation, final_info = observation, info
+        observation, info = env.reset()
+        info = dict(info, final_observation=final_observation, final_info=final_info)
+    return observation, reward, terminated, truncated, info
+
+
+def _worker(remote, parent_remote, env_fn, autoreset, remote_extraction=False):
+    parent_remote.close()
+    env = None
+    try:
+        env = env_fn()
+        if remote_extraction:
+            extractor = RemoteExtractor(remote)
+            _call(env, 'initialize_text_extractor', (extractor,), dict(executor=extractor))
+        remote.send((True, None))
+    except Exception:
+        remote.send((False, traceback.format_exc()))
+        remote.close()
+        return
+    while True:
+        try:
+            command, data = remote.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if command == 'close':
+            remote.send((True, None))
+            break
+        try:
+            if command == 'reset':
+                result = env.reset(**data)
+            elif command == 'step':
+                result = _step(env, data, autoreset)
+            elif command == 'call':
+                result = _call(env, *data)
+            else:
+                raise ValueError(f'Unknown command {command}.')
+            remote.send((True, result))
+        except Exception:
+            remote.send((False, traceback.format_exc()))
+    env.close()
+    remote.close()
+
+
+class LLFVectorEnv:
+    """
+        Step a batch of LLF-Bench environments together.
+
+        With `asynchronous=True`, each env lives in its own worker process and
+        is constructed there by calling its `env_fn`, so the env itself never
+        needs to be pickled. With `asynchronous=False`, the envs are stepped
+        one after another in the current process, which is useful for
+        debugging.
+
+        When `autoreset` is True, an env that is terminated or truncated is
+        reset right away; the returned observation is then the first
+        observation of the new episode, and the last observation and info of
+        the finished episode are stored in info['final_observation'] and
+        info['final_info'].
+    """
+
+    def __init__(self,
+                 env_fns: Sequence[Callable[[], Any]],
+                 asynchronous: bool = True,
+                 autoreset: bool = True,
+                 context: Union[str, None] = None,
+                 extractor: Union[Callable[[str], Any], None] = None,
+                 extraction_executor=None):
+        """
+            Args:
+                env_fns: A list of callables, each of which creates an env.
+
+                asynchronous: Whether to run the envs in worker processes.
+
+                autoreset: Whether to reset an env automatically at the end of
+                an episode.
+
+                context: The multiprocessing start method, e.g. 'fork' or
+                'spawn'. If None, the default of the platform is used.
+
+                extractor: The text extractor of the envs (e.g. a
+                PoemExtractor), passed to their initialize_text_extractor. It
+                is called in this process.
+
+                extraction_executor: The ExtractionExecutor of the extractions
+                of all the envs. If None and an extractor is given, the vector
+                env has its own, which is shut down by close.
+        """
+        assert len(env_fns) > 0, 'At least one env is needed.'
+        self.num_envs = len(env_fns)
+        self.asynchronous = asynchronous
+        self.autoreset = autoreset
+        self.closed = False
+        self._waiting = False
+        self.extractor = extractor
+        self._own_executor = extractor is not None and extraction_executor is None
+        if self._own_executor:
+            from llfbench.utils.extraction import ExtractionExecutor
+            extraction_executor = ExtractionExecutor()
+        self.extraction_executor = extraction_executor
+
+        self.remotes, self.processes, self.envs = [], [], []
+        try:
+            if asynchronous:
+                ctx = mp.get_context(context)
+                for env_fn in env_fns:
+                    remote, work_remote = ctx.Pipe()
+                    process = ctx.Process(target=_worker,
+                                          args=(work_remote, remote, env_fn, autoreset, extractor is not None),
+                                          daemon=True)
+                    process.start()
+                    work_remote.close()
+                    self.remotes.append(remote)
+                    self.processes.append(process)
+                self._receive_all()  # wait until all the envs are created
+                self.envs = None
+            else:
+                for env_fn in env_fns:
+                    self.envs.append(env_fn())
+                if extractor is not None:
+                    for env in self.envs:
+                        _call(env, 'initialize_text_extractor', (extractor,), dict(executor=extraction_executor))
+        except BaseException:
+            # do not leave the workers (or envs) that were started behind
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.num_envs
+
+    def _receive_all(self):
+        results, errors = [None] * len(self.remotes), {}
+        waiting = dict(zip(self.remotes, range(len(self.remotes))))  # the workers that have not answered yet
+        extractions = {}  # worker -> the Future of the extraction it waits for
+        while waiting:
+            remotes = [remote for remote in waiting if remote not in extractions]
+            for remote in mp.connection.wait(remotes, timeout=EXTRACTION_POLL_INTERVAL if extractions else None):
+                message = remote.recv()
+                if message[0] == EXTRACT:
+                    _, content, validate = message
+                    extractions[remote] = self.extraction_executor.submit(self.extractor, content, validate)
+                    continue
+                success, result = message
+                i = waiting.pop(remote)
+                if success:
+                    results[i] = result
+                else:
+                    errors[i] = f'Worker {i}:\n{result}'
+            for remote, future in list(extractions.items()):
+                if future.done():
+                    del extractions[remote]
+                    try:
+                        remote.send((True, future.result()))
+                    except Exception:
+                        remote.send((False, traceback.format_exc()))
+        if errors:
+            raise RuntimeError('\n'.join(errors[i] for i in sorted(errors)))
+        return results
+
+    def _send_all(self, command, data):
+        assert not self.closed, 'The vector env has been closed.'
+        for remote, d in zip(self.remotes, data):
+            remote.send((command, d))
+
+    @staticmethod
+    def _per_env(value, num_envs, name):
+        # broadcast a scalar (or None) argument to all the envs
+        if isinstance(value, (list, tuple)):
+            assert len(value) == num_envs, f'Expect {num_envs} {name}s, but got {len(value)}.'
+            return list(value)
+        return [value] * num_envs
+
+    def reset(self, *, seed: Union[int, List[int], None] = None, options: Union[Dict[str, Any], None] = None)\
+            -> Tuple[Dict[str, List[Any]], List[Dict[str, Any]]]:
+        """ Reset all the envs.
+
+            Args:
+                seed: If an int, env i is reset with seed + i. A list of seeds
+                can also be given, one for each env.
+
+                options: The options passed to all the envs.
+        """
+        if isinstance(seed, int):
+            seeds = [seed + i for i in range(self.num_envs)]
+        else:
+            seeds = self._per_env(seed, self.num_envs, 'seed')
+        data = [dict(seed=s, options=options) for s in seeds]
+        if self.asynchronous:
+            self._send_all('reset', data)
+            results = self._receive_all()
+        else:
+            results = [env.reset(**d) for env, d in zip(self.envs, data)]
+        observations, infos = zip(*results)
+        return batch_observations(observations), list(infos)
+
+    def step_async(self, actions: Sequence[Any]):
+        """ Send the actions to the workers without waiting for the results. """
+        assert len(actions) == self.num_envs, f'Expect {self.num_envs} actions, but got {len(actions)}.'
+        if self.asynchronous:
+            assert not self._waiting, 'step_wait must be called before calling step_async again.'
+            self._send_all('step', actions)
+            self._waiting = True
+        else:
+            self._actions = actions
+
+    def step_wait(self) -> Tuple[Dict[str, List[Any]], np.ndarray, np.ndarray, np.ndarray, List[Dict[str, Any]]]:
+        """ Wait for the results of step_async. """
+        if self.asynchronous:
+            assert self._waiting, 'step_async must be called before step_wait.'
+            self._waiting = False
+            results = self._receive_all()
+        else:
+            results = [_step(env, action, self.autoreset) for env, action in zip(self.envs, self._actions)]
+            self._actions = None
+        observations, rewards, terminated, truncated, infos = zip(*results)
+        return batch_observations(observations), \
+               np.array(rewards, dtype=np.float64), \
+               np.array(terminated, dtype=bool), \
+               np.array(truncated, dtype=bool), \
+               list(infos)
+
+    def step(self, actions: Sequence[Any]) \
+            -> Tuple[Dict[str, List[Any]], np.ndarray, np.ndarray, np.ndarray, List[Dict[str, Any]]]:
+        """ Step all the envs with a list of actions, one for each env. """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def call(self, name: str, *args, **kwargs) -> List[Any]:
+        """ Call a method (or get an attribute) of all the envs. """
+        data = [(name, args, kwargs)] * self.num_envs
+        if self.asynchronous:
+            self._send_all('call', data)
+            return self._receive_all()
+        return [_call(env, *d) for env, d in zip(self.envs, data)]
+
+    def close(self):
+        if self.closed:
+            return
+        if self.asynchronous:
+            if self._waiting:
+                self._receive_all()
+                self._waiting = False
+            for remote in self.remotes:
+                try:
+                    remote.send(('close', None))
+                    remote.recv()
+                except (OSError, EOFError):
+                    pass  # the worker has already exited, e.g. it failed to create its env
+                remote.close()
+            for process in self.processes:
+                process.join(timeout=WORKER_CLOSE_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+        else:
+            for env in self.envs:
+                env.close()
+        if self._own_executor:
+            self.extraction_executor.shutdown()
+        self.closed = True
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
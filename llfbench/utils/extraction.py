@@ -0,0 +1,167 @@
+import time
+import threading
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+"""
+
+An executor of the LLM-backed extractors (see PoemExtractor and
+RecContentExtractor) that several envs can share, e.g. the envs stepped in
+threads by llfbench.agents.async_utils.
+
+The extractions run on a thread pool of max_in_flight threads, which caps the
+number of requests in flight. A failed extraction (an exception raised by the
+extractor or by `validate`) is retried with exponential backoff. Identical
+requests, i.e. for the same content with extractors sharing the same llm, are
+deduplicated while they are pending, so that envs extracting the same content
+at the same time make only one call; with max_cached > 0, the results of the
+finished extractions are also reused.
+
+    executor = ExtractionExecutor(max_in_flight=16, max_cached=1024)
+    env.initialize_text_extractor(PoemExtractor(llm), executor=executor)
+
+The executor holds threads, so it cannot be sent to the worker processes of
+LLFVectorEnv. Instead, the workers get a RemoteExtractor, which sends the
+content to the vector env in the parent process, where the extractions of all
+the workers run on one executor, e.g.
+
+    envs = llfbench.make_vec('llf-poem-Haiku-v0', 64, extractor=PoemExtractor(llm),
+                             extraction_executor=ExtractionExecutor(max_in_flight=16, max_cached=1024))
+
+"""
+
+# The first element of the message of a worker requesting an extraction.
+EXTRACT = 'extract'
+
+
+class ExtractionExecutor:
+    """ Run extractor calls with bounded concurrency, retries and deduplication. """
+
+    def __init__(self, max_in_flight: int = 8, max_retries: int = 3, backoff: float = 0.5, max_backoff: float = 8.0,
+                 max_cached: int = 0):
+        """
+            Args:
+                max_in_flight: The maximal number of extractions running at the same time.
+
+                max_retries: The maximal number of attempts of an extraction.
+
+                backoff: The delay in seconds before the first retry, which
+                doubles after each failed attempt.
+
+                max_backoff: The maximal delay between two attempts.
+
+                max_cached: The maximal number of results of finished
+                extractions kept (least recently used first out) to answer
+                later identical requests. Note that this fixes the extraction
+                of a content even if the llm samples its responses.
+        """
+        assert max_in_flight > 0 and max_retries > 0 and max_cached >= 0
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='extraction')
+        self.max_cached = max_cached
+        self._pending = {}  # key -> Future
+        self._cached = collections.OrderedDict()  # key -> result
+        self._lock = threading.Lock()
+        self.n_requests = 0
+        self.n_calls = 0  # the calls of the extractors, including the retries
+        self.n_deduplicated = 0
+        self.n_cached = 0  # the requests answered by the result of a finished extraction
+
+    @staticmethod
+    def _key(extractor, content, validate):
+        # Extractors with the same llm give the same extraction of a content.
+        return type(extractor), id(getattr(extractor, 'llm', extractor)), content, validate
+
+    def submit(self, extractor: Callable[[str], Any], content: str,
+               validate: Optional[Callable[[Any], Any]] = None) -> Future:
+        """ Extract the content with the extractor, and return a Future of the
+            result, or of validate(result) if validate is given. validate
+            should raise an exception if the result is not valid, which is then
+            retried.
+        """
+        key = self._key(extractor, content, validate)
+        with self._lock:
+            self.n_requests += 1
+            if key in self._cached:
+                self._cached.move_to_end(key)
+                self.n_cached += 1
+                future = Future()
+                future.set_result(self._cached[key])
+                return future
+            future = self._pending.get(key)
+            if future is not None:
+                self.n_deduplicated += 1
+                return future
+            future = self._pool.submit(self._run, extractor, content, validate)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _done(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if self.max_cached > 0 and not future.cancelled() and future.exception() is None:
+                self._cached[key] = future.result()
+                self._cached.move_to_end(key)
+                while len(self._cached) > self.max_cached:
+                    self._cached.popitem(last=False)
+
+    def _run(self, extractor, content, validate):
+        delay = self.backoff
+        for attempt in range(self.max_retries):
+            try:
+                with self._lock:
+                    self.n_calls += 1
+                result = extractor(content)
+                return result if validate is None else validate(result)
+            except Exception:
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    def extract(self, extractor: Callable[[str], Any], content: str,
+                validate: Optional[Callable[[Any], Any]] = None) -> Any:
+        """ Like submit, but wait for the result. """
+        return self.submit(extractor, content, validate).result()
+
+    def stats(self):
+        return dict(n_requests=self.n_requests, n_calls=self.n_calls, n_deduplicated=self.n_deduplicated,
+                    n_cached=self.n_cached)
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+
+class RemoteExtractor:
+    """ The extractor, and executor, of an env in a worker process of
+        LLFVectorEnv, which sends the content (and the validate function, which
+        is pickled by reference) to the parent process through the pipe of the
+        worker and waits for the extraction. The extraction then runs on the
+        ExtractionExecutor of the parent, with the same retries and caching as
+        in-process.
+    """
+
+    def __init__(self, remote):
+        self.remote = remote
+
+    def extract(self, extractor: Callable[[str], Any], content: str,
+                validate: Optional[Callable[[Any], Any]] = None) -> Any:
+        # extractor is this RemoteExtractor; the parent uses its own extractor
+        self.remote.send((EXTRACT, content, validate))
+        success, result = self.remote.recv()
+        if not success:
+            raise RuntimeError(f'The extraction failed in the parent process:\n{result}')
+        return result
+
+    def __call__(self, content: str) -> Any:
+        return self.extract(self, content)
@@ -0,0 +1,192 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import collections
+from typing import Any, Dict, List, Optional, Tuple
+
+"""
+
+A content-addressed cache of LLM responses, for the LLM-backed extractors of
+the poem and reco envs (see PoemExtractor and RecContentExtractor).
+
+A response is keyed by the SHA-256 of the messages sent to the LLM and the
+generation parameters (e.g. temperature). ResponseCache keeps an in-memory
+LRU in front of an optional SQLite file, so cached responses survive across
+processes and reruns; both have a size cap, beyond which the least recently
+used responses are evicted. CachedLLM wraps an LLM with the interface of the
+extractors, i.e. `response, info = llm.generate(messages)`, e.g.
+
+    cache = ResponseCache('responses.sqlite')
+    extractor = RecContentExtractor(llm, cache=cache)
+    ...
+    cache.stats()  # {'memory_hits': ..., 'disk_hits': ..., 'misses': ..., 'hit_rate': ...}
+
+By default, only deterministic generations (temperature 0) are cached, since
+caching sampled responses would change the distribution of the responses.
+
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+def cache_key(messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+    """ The key of the response to messages generated with params. """
+    text = json.dumps(dict(messages=messages, params=params), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """ An LRU cache of (response, info) in memory, in front of an optional SQLite file. """
+
+    def __init__(self, path: Optional[str] = None, max_memory_items: int = 1024, max_disk_bytes: int = 2 ** 30):
+        """
+            Args:
+                path: The SQLite file of the cache. If None, the cache is only in memory.
+
+                max_memory_items: The maximal number of responses kept in memory.
+
+                max_disk_bytes: The maximal total size of the responses (encoded
+                as JSON) in the SQLite file.
+        """
+        assert max_memory_items > 0 and max_disk_bytes > 0
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()  # the extractors of envs stepped in threads may share a cache
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._connection = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            with self._connection:
+                self._connection.execute(SCHEMA)
+            self._disk_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key: str) -> Optional[Tuple[Any, Any]]:
+        """ The cached (response, info) of key, or None. """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            if self._connection is not None:
+                row = self._connection.execute('SELECT value FROM responses WHERE key=?', (key,)).fetchone()
+                if row is not None:
+                    with self._connection:
+                        self._connection.execute('UPDATE responses SET last_used=? WHERE key=?', (time.time(), key))
+                    value = tuple(json.loads(row[0]))
+                    self._put_memory(key, value)
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: Any, info: Any = None):
+        value = (response, info)
+        with self._lock:
+            self._put_memory(key, value)
+            if self._connection is not None:
+                self._put_disk(key, value)
+
+    def _put_memory(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _put_disk(self, key, value):
+        # info may hold objects that cannot be encoded, e.g. the raw response of an API
+        encoded = json.dumps(value, default=repr)
+        size = len(encoded)
+        with self._connection:
+            row = self._connection.execute('SELECT size FROM responses WHERE key=?', (key,)).fetchone()
+            if row is not None:
+                self._disk_bytes -= row[0]
+            self._connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                                     (key, encoded, size, time.time()))
+            self._disk_bytes += size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # Delete the least recently used responses until the total size is under the cap.
+        rows = self._connection.execute('SELECT key, size FROM responses ORDER BY last_used')
+        keys = []
+        for key, size in rows:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            keys.append((key,))
+            self._disk_bytes -= size
+        self._connection.executemany('DELETE FROM responses WHERE key=?', keys)
+
+    def stats(self) -> Dict[str, Any]:
+        n_requests = self.memory_hits + self.disk_hits + self.misses
+        return dict(memory_hits=self.memory_hits,
+                    disk_hits=self.disk_hits,
+                    misses=self.misses,
+                    hit_rate=(self.memory_hits + self.disk_hits) / n_requests if n_requests else 0.0,
+                    memory_items=len(self._memory),
+                    disk_bytes=self._disk_bytes if self._connection is not None else 0)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __len__(self):
+        return len(self._memory)
+
+
+class CachedLLM:
+    """ An LLM whose responses are cached in a ResponseCache. """
+
+    def __init__(self, llm, cache: ResponseCache, params: Optional[Dict[str, Any]] = None, cache_sampled: bool = False):
+        """
+            Args:
+                llm: An object with `generate(messages) -> (response, info)`.
+
+                cache: The ResponseCache.
+
+                params: The generation parameters, which are part of the key,
+                e.g. SimpleGuidanceParser.gen_params. The model of llm, if it
+                has a `model` attribute, is added to them.
+
+                cache_sampled: Whether to also cache the responses generated
+                with a nonzero temperature.
+        """
+        self.llm = llm
+        self.cache = cache
+        self.params = dict(params or {})
+        model = getattr(llm, 'model', None)
+        if isinstance(model, str):
+            self.params.setdefault('model', model)
+        self.cacheable = cache_sampled or self.params.get('temperature', 0) == 0
+
+    def generate(self, messages, **kwargs):
+        if not self.cacheable or kwargs:
+            return self.llm.generate(messages, **kwargs)
+        key = cache_key(messages, self.params)
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        response, info = self.llm.generate(messages)
+        self.cache.put(key, response, info)
+        return response, info
+
+    def __getattr__(self, name):
+        if name == 'llm':  # e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.llm, name)
@@ -1,8 +1,119 @@
 import re
 
-# Currently do not support nested if-statement or for-loop
 # Handlebar syntax: https://github.com/guidance-ai/guidance/tree/main#template-syntax
 # https://handlebarsjs.com/
+#
+# A template is parsed once into a tree of nodes per block, which is rendered in
+# a single pass. Nested {{#if}} and {{#each}} are supported; inside {{#each}},
+# {{this.key}} refers to the current item, and {{#each this.key}} iterates over
+# a list of the current item.
+
+BLOCK = re.compile(r"{{#(system|user|assistant)~}}(.*?){{~/\1}}", re.DOTALL)
+TAG = re.compile(r"{{~?(.*?)~?}}", re.DOTALL)
+LINEBREAKS = re.compile(r"(\n\s*){2,}")
+GEN = re.compile(r"{{gen\s+'(\w+)'(.*?)}}")
+GEN_PARAM = re.compile(r"(\w+)=('[^']*'|\"[^\"]*\"|\S+)")
+
+
+class Node:
+    """ A node of a parsed template: kind is 'text', 'var', 'if' or 'each'. """
+
+    __slots__ = ('kind', 'value', 'children')
+
+    def __init__(self, kind, value, children=None):
+        self.kind = kind
+        self.value = value  # the text, or the name of the variable
+        self.children = children
+
+    def __repr__(self):
+        return f'Node({self.kind!r}, {self.value!r}, {self.children!r})'
+
+
+def parse_template(text):
+    """ Parse the content of a block into a list of Nodes. """
+    root = []
+    stack = [('root', root)]
+    position = 0
+    for match in TAG.finditer(text):
+        if match.start() > position:
+            stack[-1][1].append(Node('text', text[position:match.start()]))
+        position = match.end()
+        tag = match.group(1).strip()
+        if tag.startswith('#if ') or tag.startswith('#each '):
+            kind, name = tag[1:].split(None, 1)
+            node = Node(kind, name.strip(), [])
+            stack[-1][1].append(node)
+            stack.append((kind, node.children))
+        elif tag in ('/if', '/each'):
+            if stack[-1][0] != tag[1:]:
+                raise ValueError(f"Unexpected {{{{{tag}}}}} in template:\n{text}")
+            _strip(stack.pop()[1])  # the content of if and each is stripped
+        else:
+            stack[-1][1].append(Node('var', tag))
+    if position < len(text):
+        root.append(Node('text', text[position:]))
+    if len(stack) > 1:
+        raise ValueError(f"Missing {{{{/{stack[-1][0]}}}}} in template:\n{text}")
+    _strip(root)
+    # The text around each is stripped, and the items are separated by line breaks.
+    for nodes in _all_children(root):
+        for i, node in enumerate(nodes):
+            if node.kind == 'each':
+                if i > 0 and nodes[i - 1].kind == 'text':
+                    nodes[i - 1].value = nodes[i - 1].value.rstrip()
+                if i + 1 < len(nodes) and nodes[i + 1].kind == 'text':
+                    nodes[i + 1].value = nodes[i + 1].value.lstrip()
+    return root
+
+
+def _strip(nodes):
+    if nodes and nodes[0].kind == 'text':
+        nodes[0].value = nodes[0].value.lstrip()
+    if nodes and nodes[-1].kind == 'text':
+        nodes[-1].value = nodes[-1].value.rstrip()
+
+
+def _all_children(nodes):
+    yield nodes
+    for node in nodes:
+        if node.children is not None:
+            yield from _all_children(node.children)
+
+
+def _lookup(name, kwargs, this):
+    if name.startswith('this.'):
+        if this is None or name[5:] not in this:
+            raise KeyError(f"Key '{name}' not found in the item of each.")
+        return this[name[5:]]
+    if name not in kwargs:
+        raise KeyError(f"Key '{name}' not found in provided arguments.")
+    return kwargs[name]
+
+
+def render_nodes(nodes, kwargs, this=None, out=None):
+    """ Render a list of Nodes with the variables in kwargs and the current
+        item `this` of each, and return the list of the rendered strings.
+    """
+    out = [] if out is None else out
+    for node in nodes:
+        kind = node.kind
+        if kind == 'text':
+            out.append(node.value)
+        elif kind == 'var':
+            value = _lookup(node.value, kwargs, this)
+            if value is not None:
+                out.append(value if isinstance(value, str) else str(value))
+        elif kind == 'if':
+            if _lookup(node.value, kwargs, this):
+                render_nodes(node.children, kwargs, this, out)
+        else:  # each
+            items = _lookup(node.value, kwargs, this)
+            for item in items:
+                out.append('\n')
+                render_nodes(node.children, kwargs, item, out)
+            out.append('\n')
+    return out
+
 
 class SimpleGuidanceParser:
 
@@ -10,29 +121,27 @@ class SimpleGuidanceParser:
         self.verbose = verbose
         self.template_text = template_text
         self.reduce_linebreaks = reduce_linebreaks
-
-    def __call__(self, **kwargs):
-        template_text = self.template_text
         labeled_blocks = self.extract_blocks(template_text)
-        if labeled_blocks[-1][0] == "assistant":
+        self.gen_params = {}
+        if labeled_blocks and labeled_blocks[-1][0] == "assistant":
+            self.gen_params = self.parse_gen_params(labeled_blocks[-1][1])
             labeled_blocks = labeled_blocks[:-1] # we remove the last assistant block, because that's for generation
+        self.blocks = [(block_type, parse_template(content)) for block_type, content in labeled_blocks]
 
+    def __call__(self, **kwargs):
         typed_messages = []
         # messages = [{"role": "system", "content": self.system_prompt},
         #             {"role": "user", "content": prompt}]
-        # assert labeled_blocks[0][0] == 'system', "The first block must be a system block"
-
-        for block_type, content in labeled_blocks:
-            # if statement is handled first, because this decides if the content should stay or disappear
-            content = self.parse_if_block(content, **kwargs)
-            each_keys = self.identify_loop_keywords(content)
-            for key in each_keys:
-                content = self.populate_template_for_each(content, key, **kwargs)
-            # content = self.populate_template_for_each(content , **kwargs)
-            content = self.populate_vars(content, **kwargs)
+        for block_type, nodes in self.blocks:
+            content = ''.join(render_nodes(nodes, kwargs))
+            # A block is also stripped after its if statements are resolved.
+            if nodes and nodes[0].kind == 'if':
+                content = content.lstrip()
+            if nodes and nodes[-1].kind == 'if':
+                content = content.rstrip()
             if self.reduce_linebreaks:
                 # match multiple line breaks and replace with a single line break
-                content = re.sub(r"(\n\s*){2,}", "\n", content)
+                content = LINEBREAKS.sub("\n", content)
             typed_messages.append({"role": block_type, "content": content})
 
             if self.verbose:
@@ -49,114 +158,28 @@ class SimpleGuidanceParser:
             messages += typed_message['role'] + ': ' + typed_message['content']
         return messages
 
-    def parse_if_block(self, parsed_text, **kwargs):
-        # Regular expression to capture the content inside the {{#if ...}} and {{/if}} tags
-        pattern = r"{{#if (\w+)}}(.*?){{/if}}"
-
-        matches = re.findall(pattern, parsed_text, re.DOTALL)
-        for condition_var, block_content in matches:
-            # If the condition variable exists in kwargs and its value is True
-            if condition_var not in kwargs:
-                raise Exception(f"Key '{condition_var}' for if statement not found in provided arguments.")
-            cond = kwargs[condition_var]
-            if cond:
-                # Remove the {{#if}} and {{/if}} tags, but keep the content
-                parsed_text = parsed_text.replace(r"{{#if " + condition_var + "}}" + block_content + "{{/if}}",
-                                                  block_content.strip())
+    def parse_gen_params(self, content):
+        # The parameters of {{gen 'name' key=value ...}}, e.g. dict(temperature=0.7)
+        match = GEN.search(content)
+        if match is None:
+            return {}
+        params = {}
+        for key, value in GEN_PARAM.findall(match.group(2)):
+            if value[0] in '\'"':
+                params[key] = value[1:-1]
             else:
-                # Remove the entire block
-                parsed_text = parsed_text.replace(r"{{#if " + condition_var + "}}" + block_content + "{{/if}}", "")
-
-        # Return the modified text
-        return parsed_text.strip()
-
-    def populate_vars(self, template, **kwargs):
-        # Regular expression to find all placeholders
-        placeholders = re.findall(r"{{(.*?)}}", template)
-
-        # Replace each placeholder with its corresponding value from kwargs
-        for placeholder in placeholders:
-            if placeholder in kwargs:
-                kwargs[placeholder] = self.none_to_empty_string(kwargs[placeholder])
-                template = template.replace(f"{{{{{placeholder}}}}}", kwargs[placeholder])
-            else:
-                template = template.replace(f"{{{{{placeholder}}}}}", f"Placeholder {placeholder} not provided")
-                raise Exception(template)
-
-        return template
-
-    def none_to_empty_string(self, value):
-        # this is only applicable to populate_vars and for_each
-        # if_exists takes None dddd
-        if value is None:
-            return ""
-        return value
-
-    def identify_loop_keywords(self, template):
-        pattern = r"{{#each (\w+)}}"
-
-        # Use findall to extract all matches
-        keywords = re.findall(pattern, template)
-
-        return keywords
-
-    def populate_template_for_each(self, template, each_key, **kwargs):
-        # We don't support nested for-loop
-
-        before_each_match = re.search(r"(.*?){{#each " + each_key + "}}", template, re.DOTALL)
-        before_each = before_each_match.group(1).strip() if before_each_match else None
-
-        # Extract the portion between {{~/each}} and {{~/user}}
-        after_each_match = re.search(r"{{~/each}}(.*?)$", template, re.DOTALL)
-        after_each = after_each_match.group(1).strip() if after_each_match else None
-
-        if each_key not in kwargs:
-            return template
-
-        examples = kwargs[each_key]
-
-        # Regular expression to extract keys after 'this.'
-        keys = re.findall(r"{{this\.(.*?)}}", template)
-
-        # Getting the template part inside the {{~#each}} and {{~/each}} tags
-        template_inside_each = re.search(r"{{#each "+each_key+"}}(.*?){{~/each}}", template, re.DOTALL).group(1).strip()
-
-        # Generating the text for each dictionary in examples
-        populated_texts = []
-        for example in examples:
-            populated_text = template_inside_each
-            for key in keys:
-                if key in example:
-                    example[key] = self.none_to_empty_string(example[key])
-                    populated_text = populated_text.replace("{{this."+key+"}}", example[key])
-            populated_texts.append(populated_text)
-
-        if before_each is not None:
-            populated_texts = [before_each.strip()] + populated_texts
-
-        if after_each is not None:
-            populated_texts = populated_texts + [after_each.strip()]
-
-        return "\n".join(populated_texts)
+                try:
+                    params[key] = int(value)
+                except ValueError:
+                    try:
+                        params[key] = float(value)
+                    except ValueError:
+                        params[key] = value
+        return params
 
     def extract_blocks(self, parsed_text):
-        # Define regex patterns for each block type
-        patterns = {
-            "system": re.compile(r"{{#system~}}(.*?){{~/system}}", re.DOTALL),
-            "user": re.compile(r"{{#user~}}(.*?){{~/user}}", re.DOTALL),
-            "assistant": re.compile(r"{{#assistant~}}(.*?){{~/assistant}}", re.DOTALL)
-        }
-
-        # Find all occurrences of each block and label them
-        labeled_blocks = []
-        for block_type, pattern in patterns.items():
-            for match in pattern.findall(parsed_text):
-                labeled_blocks.append((block_type, match.strip()))
-
-        # Sort by their appearance order in the parsed text
-        labeled_blocks.sort(key=lambda x: parsed_text.index(x[1]))
-
-        return labeled_blocks
+        # Find all the blocks, labeled by their type, in their order in the text
+        return [(match.group(1), match.group(2).strip()) for match in BLOCK.finditer(parsed_text)]
 
 def usage_test_1():
     # Test
@@ -0,0 +1,62 @@
+import time
+import asyncio
+from llfbench.agents.abstract_agent import AsyncAgent
+from llfbench.agents.async_utils import async_evaluate
+
+
+"""
+
+The throughput of async_evaluate with a mock agent that waits `latency`
+seconds before each action, like a remote LLM, for an increasing number of
+concurrent episodes, e.g.
+
+    python tests/bench_async.py llf-gridworld-v0 --latency 0.1 --max_concurrency 256
+
+Since the episodes mostly wait, the steps/sec should grow almost linearly with
+the concurrency, until stepping the envs becomes the bottleneck.
+
+"""
+
+
+class MockAgent(AsyncAgent):
+
+    def __init__(self, action_space, latency):
+        super().__init__()
+        self.action_space = action_space
+        self.latency = latency
+
+    async def act(self, observation, feedback, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self.action_space.sample()
+
+
+def bench(env_name, concurrency, latency, horizon, seed=0):
+    import llfbench
+    action_space = llfbench.make(env_name).action_space
+    action_space.seed(seed)
+    n_episodes = concurrency
+    start = time.perf_counter()
+    _, data = asyncio.run(async_evaluate(lambda: MockAgent(action_space, latency), env_name,
+                                         horizon=horizon, n_episodes=n_episodes, max_concurrency=concurrency,
+                                         seed=seed, log_data=True))
+    elapsed = time.perf_counter() - start
+    n_steps = sum(len(episode['actions']) for episode in data)
+    return n_steps / elapsed
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('env_name', type=str, nargs='?', default='llf-gridworld-v0')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds per action of the mock agent')
+    parser.add_argument('--horizon', type=int, default=10)
+    parser.add_argument('--max_concurrency', type=int, default=256)
+    args = parser.parse_args()
+
+    baseline = None
+    concurrency = 1
+    while concurrency <= args.max_concurrency:
+        steps_per_sec = bench(args.env_name, concurrency, args.latency, args.horizon)
+        baseline = baseline or steps_per_sec
+        print(f'concurrency {concurrency:4d}: {steps_per_sec:8.1f} steps/sec ({steps_per_sec / baseline:6.1f}x)')
+        concurrency *= 2
@@ -0,0 +1,198 @@
+import sys
+import json
+import time
+import random
+import platform
+import subprocess
+import numpy as np
+import gymnasium as gym
+import llfbench
+from test_basic_agents import get_random_action, get_expert_action
+
+
+"""
+
+A throughput benchmark of the registered llf-* envs.
+
+For every env id matching the prefix, every config in
+llfbench.supported_configs and every agent (random and expert, as in
+test_basic_agents.py), it measures the time of llfbench.make, the reset
+latency, the step latency (p50/p99) and the number of steps per second, e.g.
+
+    python tests/bench_envs.py llf-gridworld --n_steps 200 --output report.json
+
+The report is a JSON file whose results are keyed by
+'env_name|instruction_type|feedback_type|agent'. Two reports can be compared
+to catch regressions between versions,
+
+    python tests/bench_envs.py llf-gridworld --output new.json --baseline old.json
+    python tests/bench_envs.py --compare old.json new.json
+
+which exits with status 1 if steps/sec dropped or a step latency rose by more
+than --threshold (relative) for some key.
+
+"""
+
+AGENTS = {'random': get_random_action, 'expert': get_expert_action}
+# The action of the envs with a Text action space for which the agents have
+# none, by the prefix of the env id (as in test_envs.py).
+TEXT_ACTIONS = {
+    'llf-optimization-': 'x = [1.0, 2.0]',
+    'llf-poem-': 'An old silent pond\nA frog jumps into the pond\nSplash! Silence again.',
+    'llf-reco-': '[{"title": "John Wick"}]',
+}
+# metric -> whether larger is better
+METRICS = {'steps_per_sec': True, 'step_p50': False, 'step_p99': False, 'reset_mean': False, 'make_time': False}
+
+
+def result_key(env_name, config, agent):
+    return f"{env_name}|{config['instruction_type']}|{config['feedback_type']}|{agent}"
+
+
+def get_action(agent, env, env_name, info):
+    action = AGENTS[agent](env, env_name, info)
+    if action is None:
+        action = next((a for prefix, a in TEXT_ACTIONS.items() if env_name.startswith(prefix)), None)
+    return action
+
+
+def bench_config(env_name, config, agent, n_steps, seed=0):
+    """ Run the agent for n_steps and return the timing of make, reset and step. """
+    random.seed(seed)
+    np.random.seed(seed)
+    start = time.perf_counter()
+    env = llfbench.make(env_name, **config)
+    make_time = time.perf_counter() - start
+    env.action_space.seed(seed)
+
+    reset_times, step_times = [], []
+    episode = 0
+    while len(step_times) < n_steps:
+        start = time.perf_counter()
+        _, info = env.reset(seed=seed + episode)
+        reset_times.append(time.perf_counter() - start)
+        episode += 1
+        done = False
+        while not done and len(step_times) < n_steps:
+            action = get_action(agent, env, env_name, info)
+            if action is None:
+                return dict(skipped=f'{agent} agent has no action for {env_name}')
+            start = time.perf_counter()
+            _, _, terminated, truncated, info = env.step(action)
+            step_times.append(time.perf_counter() - start)
+            done = terminated or truncated
+    env.close()
+
+    step_times = np.array(step_times)
+    return dict(make_time=make_time,
+                reset_mean=float(np.mean(reset_times)),
+                step_p50=float(np.percentile(step_times, 50)),
+                step_p99=float(np.percentile(step_times, 99)),
+                steps_per_sec=float(len(step_times) / step_times.sum()),
+                n_steps=len(step_times),
+                n_episodes=episode)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(benchmark_prefix='llf-', agents=('random', 'expert'), n_steps=200, seed=0):
+    env_names = sorted(env_name for env_name in gym.envs.registry if env_name.startswith(benchmark_prefix))
+    print(f'Number of {benchmark_prefix} environments: ', len(env_names))
+    results = {}
+    for env_name in env_names:
+        for config in llfbench.supported_configs(env_name):
+            for agent in agents:
+                key = result_key(env_name, config, agent)
+                try:
+                    results[key] = bench_config(env_name, config, agent, n_steps, seed=seed)
+                except Exception as e:
+                    results[key] = dict(error=f'{type(e).__name__}: {e}')
+                print(key, format_result(results[key]))
+    # the configs that were not measured, which would be easy to miss in the log
+    unmeasured = [key for key, result in results.items() if 'steps_per_sec' not in result]
+    if unmeasured:
+        print(f'{len(unmeasured)} of {len(results)} configs were not measured:')
+        for key in unmeasured:
+            print('   ', key, format_result(results[key]))
+    return dict(metadata=dict(benchmark_prefix=benchmark_prefix,
+                              n_steps=n_steps,
+                              seed=seed,
+                              commit=git_commit(),
+                              python=sys.version.split()[0],
+                              platform=platform.platform(),
+                              time=time.strftime('%Y-%m-%dT%H:%M:%S')),
+                results=results)
+
+
+def format_result(result):
+    if 'steps_per_sec' not in result:
+        return result.get('skipped') or result.get('error')
+    return f"make {result['make_time'] * 1e3:.1f} ms, reset {result['reset_mean'] * 1e3:.2f} ms, " \
+           f"step p50 {result['step_p50'] * 1e3:.2f} ms, p99 {result['step_p99'] * 1e3:.2f} ms, " \
+           f"{result['steps_per_sec']:.0f} steps/sec"
+
+
+def compare_reports(old, new, threshold=0.2):
+    """ Print the relative change of each metric and return the list of
+        (key, metric, change) that regressed by more than threshold.
+    """
+    regressions = []
+    for key in sorted(set(old['results']) & set(new['results'])):
+        old_result, new_result = old['results'][key], new['results'][key]
+        if 'steps_per_sec' not in old_result or 'steps_per_sec' not in new_result:
+            continue
+        changes = []
+        for metric, larger_is_better in METRICS.items():
+            change = new_result[metric] / old_result[metric] - 1 if old_result[metric] > 0 else 0.0
+            changes.append(f'{metric} {change:+.1%}')
+            # make_time and reset are too noisy to fail on
+            if metric in ('steps_per_sec', 'step_p50', 'step_p99'):
+                regressed = -change > threshold if larger_is_better else change > threshold
+                if regressed:
+                    regressions.append((key, metric, change))
+        print(key, ', '.join(changes))
+    for key in sorted(set(old['results']) ^ set(new['results'])):
+        print(key, 'only in the', 'old' if key in old['results'] else 'new', 'report')
+    for key, metric, change in regressions:
+        print(f'REGRESSION {key} {metric} {change:+.1%}')
+    return regressions
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark_prefix', type=str, nargs='?', default='llf-')
+    parser.add_argument('--agents', type=str, nargs='+', default=['random', 'expert'], choices=list(AGENTS))
+    parser.add_argument('--n_steps', type=int, default=200, help='number of steps per env, config and agent')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='path of the JSON report')
+    parser.add_argument('--baseline', type=str, default=None, help='a report to compare the results with')
+    parser.add_argument('--compare', type=str, nargs=2, default=None, metavar=('OLD', 'NEW'),
+                        help='only compare two reports')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        old, new = map(load_report, args.compare)
+    else:
+        new = run_benchmark(args.benchmark_prefix, agents=args.agents, n_steps=args.n_steps, seed=args.seed)
+        if args.output is not None:
+            save_report(new, args.output)
+        old = None if args.baseline is None else load_report(args.baseline)
+    if old is not None:
+        sys.exit(1 if compare_reports(old, new, threshold=args.threshold) else 0)
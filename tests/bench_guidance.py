@@ -0,0 +1,39 @@
+import time
+from llfbench.utils.parser_utils import SimpleGuidanceParser
+from llfbench.envs.poem.formal_poems import PoemExtractor
+from llfbench.envs.reco.movie_rec import RecContentExtractor
+
+
+"""
+
+A micro-benchmark of SimpleGuidanceParser on the prompts of the LLM
+extractors of the poem and reco envs. The template is parsed once when the
+parser is created, and then rendered n_repeats times, e.g.
+
+    python tests/bench_guidance.py --n_repeats 100000
+
+"""
+
+CONTENT = 'The Shawshank Redemption (1994)\nThe Godfather (1972)\n\nPulp Fiction (1994)'
+
+
+def bench(extractor_cls, n_repeats):
+    template_text = extractor_cls(llm=None).prompt.template_text
+    start = time.perf_counter()
+    parser = SimpleGuidanceParser(template_text)
+    t_parse = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        parser(content=CONTENT)
+    t_render = time.perf_counter() - start
+    print(f'{extractor_cls.__name__}: parse {t_parse * 1e6:8.1f} us, render {t_render / n_repeats * 1e6:6.2f} us/call '
+          f'({n_repeats} calls in {t_render:.2f} s)')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_repeats', type=int, default=100000)
+    args = parser.parse_args()
+    bench(RecContentExtractor, args.n_repeats)
+    bench(PoemExtractor, args.n_repeats)
@@ -0,0 +1,97 @@
+import time
+import parse
+import llfbench
+from llfbench.envs.utils import compile_template
+from llfbench.envs.optimization import prompts
+
+
+"""
+
+A micro-benchmark of the template matching done in LLFWrapper.reformat.
+
+It compares parse.search, which compiles the template on every call, with the
+cached parsers in llfbench.envs.utils, and measures the per-step time of
+reformatting the feedback of an llf-optimization env, against rendering the
+same feedback from structured FeedbackTemplates.
+
+    python tests/bench_templates.py --n_repeats 1000
+
+"""
+
+
+def timeit(fun, n_repeats):
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        fun()
+    return (time.perf_counter() - start) / n_repeats
+
+
+def bench_search(n_repeats=1000):
+    template = prompts.hp_feedback_dim1_template
+    original = template.format(action='[1.0, 2.0]', prev_x='[0.0, 1.0]', increasing='Increasing', x2='more')
+    assert parse.search(template, original).named == compile_template(template).search(original).named
+
+    t_uncached = timeit(lambda: parse.search(template, original), n_repeats)
+    t_cached = timeit(lambda: compile_template(template).search(original), n_repeats)
+    print(f'parse.search:     {t_uncached * 1e6:8.1f} us/call')
+    print(f'compile_template: {t_cached * 1e6:8.1f} us/call  ({t_uncached / t_cached:.1f}x)')
+
+
+def bench_step(env_name='llf-optimization-Booth-v0', n_repeats=1000):
+    # the reformat calls that an llf-optimization env makes in one step with
+    # feedback_type='a'
+    env = llfbench.make(env_name, feedback_type='a')
+    while not hasattr(env, 'reformat'):
+        env = env.env
+    kwargs = dict(action='[1.0, 2.0]', prev_x='[0.0, 1.0]', increasing='Increasing', x2='more', y=0.5, prev_y=1.0,
+                  feedback='better', decreasing='Decreasing')
+    calls = [(prompts.r_feedback_pos_template, prompts.r_feedback_pos),
+             (prompts.r_feedback_neg_template, prompts.r_feedback_neg)]
+    for ft in ('hp', 'hn', 'fp', 'fn'):
+        for dim in ('dim1', 'dim2'):
+            calls.append((getattr(prompts, f'{ft}_feedback_{dim}_template'), getattr(prompts, f'{ft}_feedback_{dim}')))
+    calls = [(template.format(**{k: kwargs.get(k, 'x') for k in compile_template(template).named_fields}), template, paraphrases)
+             for template, paraphrases in calls]
+
+    def reformat_step():
+        for original, template, paraphrases in calls:
+            env.reformat(original, paraphrases, template=template)
+
+    def search_step():
+        for original, template, _ in calls:
+            parse.search(template, original)
+
+    def cached_search_step():
+        for original, template, _ in calls:
+            compile_template(template).search(original)
+
+    t_reformat = timeit(reformat_step, n_repeats)
+    saving = timeit(search_step, n_repeats) - timeit(cached_search_step, n_repeats)
+    print(f'{env_name}: reformat {t_reformat * 1e6:8.1f} us/step, '
+          f'saved by cached parsers {saving * 1e6:8.1f} us/step')
+
+
+def bench_render(env_name='llf-optimization-Booth-v0', n_repeats=1000):
+    # structured feedback is rendered without matching templates at all
+    from llfbench.envs.llf_env import Feedback, FeedbackTemplate
+    env = llfbench.make(env_name, feedback_type='a')
+    while not hasattr(env, 'render_feedback'):
+        env = env.env
+    kwargs = dict(action='[1.0, 2.0]', prev_x='[0.0, 1.0]', increasing='Increasing', x2=1.0)
+    feedback = Feedback(r=FeedbackTemplate('r_feedback_neg', {}),
+                        hp=[FeedbackTemplate('hp_feedback_dim1', kwargs), '\n', FeedbackTemplate('hp_feedback_dim2', kwargs)],
+                        hn=[],
+                        fp=[FeedbackTemplate(f'fp_feedback_dim{i}', dict(x='[1.0, 2.0]', smaller='smaller', x2=1.0)) for i in (1, 2)],
+                        fn=[FeedbackTemplate(f'fn_feedback_dim{i}', dict(x='[1.0, 2.0]', smaller='larger', x2=1.0)) for i in (1, 2)])
+    t_render = timeit(lambda: env.render_feedback(feedback), n_repeats)
+    print(f'{env_name}: render_feedback {t_render * 1e6:8.1f} us/step')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_repeats', type=int, default=1000)
+    args = parser.parse_args()
+    bench_search(args.n_repeats)
+    bench_step(n_repeats=args.n_repeats)
+    bench_render(n_repeats=args.n_repeats)
@@ -0,0 +1,270 @@
+import time
+import asyncio
+import numpy as np
+from llfbench.agents.abstract_agent import Agent, AsyncAgent
+from llfbench.agents import utils
+from llfbench.agents.async_utils import evaluate_agent_async
+from llfbench.agents.result_store import ResultStore
+from llfbench.agents.utils import ReplayBuffer, HistoryRenderer, evaluate_agent, iter_evaluate, episode_seeds, make_env, \
+    evaluate_agent_lockstep
+
+
+def test_replay_buffer(buffer_size=5):
+    buffer = ReplayBuffer(buffer_size)
+    assert len(buffer) == 0 and list(buffer) == []
+    buffer.update(feedback='ignored')  # no item to update yet
+    for t in range(8):
+        buffer.update(feedback=f'f{t - 1}', next_observation=t)
+        buffer.append(observation=t, action=f'a{t}', reward=float(t))
+    assert len(buffer) == buffer_size
+    # the oldest items were overwritten
+    assert [item['observation'] for item in buffer] == [3, 4, 5, 6, 7]
+    assert buffer[0]['feedback'] == 'f3' and 'feedback' not in buffer[-1]
+    assert buffer[-2] == dict(observation=6, action='a6', feedback='f6', next_observation=7, reward=6.0)
+    assert [item['action'] for item in buffer[1:3]] == ['a4', 'a5']
+
+    # the last k items, as views when they do not wrap around
+    assert buffer.column('observation', 2).tolist() == [6, 7]
+    assert buffer.column('reward').tolist() == [3.0, 4.0, 5.0, 6.0, 7.0]
+    assert buffer.last(4)['action'].tolist() == ['a4', 'a5', 'a6', 'a7']
+    assert np.shares_memory(buffer.column('reward', 2), buffer._columns['reward'])
+
+    # new fields and missing fields
+    buffer.append(observation=8, extra='x')
+    assert buffer[-1] == dict(observation=8, extra='x') and 'extra' not in buffer[-2]
+    assert buffer.column('action', 1)[0] is None and np.isnan(buffer.column('reward', 1)[0])
+    assert buffer.column('extra', 2)[0] is None
+    # a missing reward is stored as nan
+    buffer.append(observation=9, action='a9', reward=None)
+    assert np.isnan(buffer[-1]['reward']) and list(buffer[-1]) == ['observation', 'action', 'reward']
+
+    batch = buffer.sample(16, rng=np.random.default_rng(0))
+    assert batch['observation'].shape == (16,)
+    assert set(batch['observation'].tolist()) <= {5, 6, 7, 8, 9}
+    assert all(o == int(a[1:]) for o, a in zip(batch['observation'], batch['action']) if a is not None)
+
+    buffer.reset()
+    assert len(buffer) == 0 and list(buffer) == []
+
+
+def test_history_renderer():
+    history = HistoryRenderer(separator='\n')
+    items = [f'item {i}' for i in range(10)]
+    for i, item in enumerate(items):
+        history.append(item)
+        assert history.text == '\n'.join(items[:i + 1])
+        assert history.size == len(history.text)
+
+    # sliding window over the number of items and the size of the text
+    history = HistoryRenderer(separator='\n', max_items=3)
+    for item in items:
+        history.append(item)
+    assert history.text == '\n'.join(items[-3:]) and len(history) == 3
+    history = HistoryRenderer(separator='\n', budget=19)
+    for item in items:
+        history.append(item)
+        assert history.size <= 19 and history.text == '\n'.join(items[:items.index(item) + 1])[-len(history.text):]
+    assert history.text == 'item 8\nitem 9'
+
+    # a budget in "tokens"
+    history = HistoryRenderer(separator=' ', budget=5, count=lambda text: len(text.split()))
+    for item in items:
+        history.append(item)
+    assert history.text == 'item 8 item 9' and history.size == 4
+    history.append('a very long item that exceeds the budget')  # the newest item is always kept
+    assert history.text == 'a very long item that exceeds the budget'
+    history.reset()
+    assert history.text == '' and len(history) == 0
+
+
+def test_user_agent_world_info(monkeypatch, n_steps=20):
+    from llfbench.agents import user_agent
+    for ignore_observation in (False, True):
+        responses = iter(f'Action: {t}' for t in range(n_steps))
+        monkeypatch.setattr(user_agent, 'get_multiline_input', lambda: next(responses))
+        monkeypatch.setattr('builtins.print', lambda *args, **kwargs: None)
+        agent = user_agent.UserAgent(buffer_size=5, ignore_observation=ignore_observation)
+        agent.reset('docstring')
+        feedback = None
+        for t in range(n_steps):
+            agent.act(f'observation {t}', feedback)
+            feedback = f'feedback {t}'
+            # the incremental history is the same as rendering the last
+            # buffer_size complete items
+            expected = '\n'.join(agent.render_item(dict(observation=f'observation {i}', action=f' {i}',
+                                                         feedback=f'feedback {i}')) for i in range(max(t - 5, 0), t))
+            assert agent.world_info == (expected or 'None')
+
+
+class CyclicAgent(Agent):
+    """ Take the actions 0, 1, 2, ... in turn. """
+
+    def reset(self, docstring):
+        super().reset(docstring)
+        self.t = 0
+
+    def act(self, observation, feedback, **kwargs):
+        self.t += 1
+        return (self.t - 1) % 4
+
+
+def test_episode_seeds():
+    seeds = episode_seeds(0, 10)
+    assert len(set(seeds)) == 10 and seeds == episode_seeds(0, 10)
+    assert episode_seeds(0, 3) == seeds[:3]
+    assert episode_seeds(1, 10) != seeds
+
+
+def test_evaluate_agent(monkeypatch, env_name='llf-gridworld-v0', n_episodes=4, horizon=10):
+    monkeypatch.setattr('builtins.print', lambda *args, **kwargs: None)
+    kwargs = dict(horizon=horizon, n_episodes=n_episodes, seed=0, log_data=True, env_kwargs=dict(feedback_type='a'))
+    scores, data = evaluate_agent(CyclicAgent(), env_name, **kwargs)
+    assert scores.shape == (n_episodes,)
+    for episode in data:
+        assert 0 < len(episode['actions']) <= horizon
+        assert len(episode['observations']) == len(episode['actions']) + 1
+        assert len(episode['rewards']) == len(episode['dones']) == len(episode['infos']) == len(episode['actions'])
+    # each episode has its own seed
+    assert len(set(str(episode['observations'][0]) for episode in data)) > 1
+    # the episodes run in-process with a local env, not the one of the worker processes
+    assert utils._worker_env is None and utils._worker_agent is None
+
+    # the same results with an env, or in worker processes
+    env_scores, env_data = evaluate_agent(CyclicAgent(), make_env(env_name, dict(feedback_type='a')),
+                                          **{k: v for k, v in kwargs.items() if k != 'env_kwargs'})
+    assert np.array_equal(scores, env_scores) and env_data == data
+    pool_scores, pool_data = evaluate_agent(CyclicAgent(), env_name, n_workers=2, context='fork', **kwargs)
+    assert np.array_equal(scores, pool_scores) and pool_data == data
+
+    results = list(iter_evaluate(CyclicAgent(), env_name, horizon=horizon, n_episodes=n_episodes, seed=0,
+                                 n_workers=2, context='fork', return_full_information=True))
+    assert sorted(episode for episode, *_ in results) == list(range(n_episodes))
+    assert [seed for *_, seed, _, _ in sorted(results, key=lambda result: result[0])] == episode_seeds(0, n_episodes)
+
+
+class SleepyAgent(AsyncAgent):
+    """ A CyclicAgent that waits latency seconds before each action, like a remote LLM. """
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def reset(self, docstring):
+        super().reset(docstring)
+        self.t = 0
+
+    async def act(self, observation, feedback, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.t += 1
+        return (self.t - 1) % 4
+
+
+def test_async_evaluate(monkeypatch, env_name='llf-gridworld-v0', n_episodes=32, horizon=5, latency=0.02):
+    monkeypatch.setattr('builtins.print', lambda *args, **kwargs: None)
+    kwargs = dict(horizon=horizon, n_episodes=n_episodes, seed=0, log_data=True, env_kwargs=dict(feedback_type='a'))
+    start = time.perf_counter()
+    scores, data = evaluate_agent_async(lambda: SleepyAgent(latency), env_name, max_concurrency=n_episodes, **kwargs)
+    elapsed = time.perf_counter() - start
+    # the same results as the synchronous evaluation
+    expected_scores, expected_data = evaluate_agent(CyclicAgent(), env_name, **kwargs)
+    assert np.array_equal(scores, expected_scores) and data == expected_data
+    # the episodes wait concurrently
+    assert elapsed < n_episodes * horizon * latency / 4
+
+    # a failing agent stops the evaluation
+    class FailingAgent(SleepyAgent):
+        async def act(self, observation, feedback, **kwargs):
+            raise RuntimeError('no response')
+    try:
+        evaluate_agent_async(lambda: FailingAgent(latency), env_name, horizon=horizon, n_episodes=4)
+        assert False
+    except RuntimeError as e:
+        assert str(e) == 'no response'
+
+
+class BatchCyclicAgent(Agent):
+    """ A CyclicAgent for a batch of episodes, with a step counter per slot. """
+
+    def __init__(self):
+        super().__init__()
+        self.t = {}
+        self.batch_sizes = []
+
+    def reset_batch(self, docstrings, slots):
+        for slot in slots:
+            self.t[slot] = 0
+
+    def act_batch(self, observations, feedbacks, slots, **kwargs):
+        self.batch_sizes.append(len(slots))
+        actions = [self.t[slot] % 4 for slot in slots]
+        for slot in slots:
+            self.t[slot] += 1
+        return actions
+
+
+def test_lockstep(monkeypatch, env_name='llf-gridworld-v0', n_episodes=7, batch_size=3, horizon=10):
+    monkeypatch.setattr('builtins.print', lambda *args, **kwargs: None)
+    kwargs = dict(horizon=horizon, n_episodes=n_episodes, seed=0, log_data=True, env_kwargs=dict(feedback_type='a'))
+    agent = BatchCyclicAgent()
+    scores, data = evaluate_agent_lockstep(agent, env_name, batch_size=batch_size, **kwargs)
+    expected_scores, expected_data = evaluate_agent(CyclicAgent(), env_name, **kwargs)
+    assert np.array_equal(scores, expected_scores) and data == expected_data
+    # the batch is refilled until the queue is empty
+    assert max(agent.batch_sizes) == batch_size and agent.batch_sizes[0] == batch_size
+    assert sum(agent.batch_sizes) == sum(len(episode['actions']) for episode in data)
+
+    # by default, each slot has its own copy of a (stateful) agent
+    agent = CyclicAgent()
+    agent.reset_batch(['docstring', 'docstring'], [0, 1])
+    assert agent.act_batch(['o1', 'o2'], [None, None], [0, 1], full_information=[{}, {}]) == [0, 0]
+    assert agent.act_batch(['o1'], [None], [1]) == [1]
+    agent.reset_batch(['docstring'], [1])
+    assert agent.act_batch(['o1', 'o2'], [None, None], [0, 1]) == [1, 0]
+    scores, data = evaluate_agent_lockstep(CyclicAgent(), env_name, batch_size=batch_size, **kwargs)
+    assert np.array_equal(scores, expected_scores) and data == expected_data
+
+
+class CrashingAgent(CyclicAgent):
+    """ A CyclicAgent that crashes at the start of an episode after n_resets. """
+
+    def __init__(self, n_resets):
+        super().__init__()
+        self.n_resets = n_resets
+
+    def reset(self, docstring):
+        if self.n_resets == 0:
+            raise RuntimeError('crash')
+        self.n_resets -= 1
+        super().reset(docstring)
+
+
+def test_result_store(tmp_path, monkeypatch, env_name='llf-gridworld-v0', n_episodes=6, horizon=5):
+    monkeypatch.setattr('builtins.print', lambda *args, **kwargs: None)
+    path = str(tmp_path / 'results.sqlite')
+    kwargs = dict(horizon=horizon, n_episodes=n_episodes, seed=0, env_kwargs=dict(instruction_type='b'))
+    expected_scores = evaluate_agent(CyclicAgent(), env_name, **kwargs)
+
+    with ResultStore(path) as store:
+        try:  # the evaluation is interrupted after 4 episodes
+            evaluate_agent(CrashingAgent(4), env_name, store=store, **kwargs)
+            assert False
+        except RuntimeError:
+            pass
+        key = (env_name, 'b', 'a', 0)  # feedback_type 'a' is the registered default
+        assert store.completed(*key) == {0, 1, 2, 3}
+        assert store.summary(env_name=env_name)[0]['n_episodes'] == 4
+
+    with ResultStore(path) as store:  # the rerun only runs the missing episodes
+        results = list(iter_evaluate(CrashingAgent(2), env_name, store=store, **kwargs))
+        assert [episode for episode, *_ in results] == [4, 5]
+        scores = evaluate_agent(CrashingAgent(0), env_name, store=store, **kwargs)
+        assert np.array_equal(scores, expected_scores)
+        assert np.array_equal(store.scores(*key), expected_scores)
+        summary, = store.summary()
+        assert summary['n_episodes'] == n_episodes and np.isclose(summary['mean'], expected_scores.mean())
+        assert np.isclose(summary['std'], expected_scores.std())
+
+        # the data is stored with log_data
+        scores, data = evaluate_agent(CyclicAgent(), env_name, store=store, log_data=True,
+                                      **dict(kwargs, seed=1, n_episodes=2))
+        assert len(data) == 2 and data[0]['actions'][:2] == [0, 1]
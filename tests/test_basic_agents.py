@@ -6,7 +6,6 @@ import gymnasium as gym
 
 from tqdm import tqdm
 from llfbench.envs.llf_env import LLFWrapper
-from llfbench.utils.utils import generate_combinations_dict
 
 
 def get_random_action(env, env_name, info):
@@ -93,9 +92,7 @@ def test_wrapper(env):
 
 def test_env(env_name, agent, num_eps=1, seed=0):
 
-    instruction_types, feedback_types = llfbench.supported_types(env_name)
-    feedback_types = list(feedback_types) + ['n', 'a', 'm']
-    configs = generate_combinations_dict(dict(instruction_type=instruction_types, feedback_type=feedback_types))
+    configs = llfbench.supported_configs(env_name)
 
     for config in configs:
 
@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import subprocess
+import multiprocessing as mp
+import functools
+import numpy as np
+import llfbench
+from llfbench.envs.vector_env import LLFVectorEnv
+from llfbench.envs.trace import TraceRecorder, TraceReader, TraceEncoder
+from llfbench.envs.env_wrappers import FullInformationWrapper, TextWrapper, RandomActionOrderWrapper
+from llfbench.envs.action_parser import ActionParser, ActionParseError
+from llfbench.envs.accounting import PromptAccountant, PromptAccountingWrapper
+
+
+def check_batch(observations, num_envs):
+    assert set(observations.keys()) == {'instruction', 'observation', 'feedback'}
+    for v in observations.values():
+        assert len(v) == num_envs
+
+
+def test_vector_env(env_name='llf-gridworld-v0', num_envs=3, asynchronous=True):
+    envs = llfbench.make_vec(env_name, num_envs, feedback_type='a', asynchronous=asynchronous)
+    observations, infos = envs.reset(seed=0)
+    check_batch(observations, num_envs)
+    assert all(o is not None for o in observations['instruction'])
+    assert all(f is None for f in observations['feedback'])
+    assert len(infos) == num_envs
+
+    for _ in range(25):  # longer than the horizon of gridworld
+        actions = [info['expert_action'] if info['expert_action'] is not None else 0 for info in infos]
+        observations, rewards, terminated, truncated, infos = envs.step(actions)
+        check_batch(observations, num_envs)
+        assert rewards.shape == terminated.shape == truncated.shape == (num_envs,)
+        for i in range(num_envs):
+            if terminated[i] or truncated[i]:  # autoreset
+                assert 'final_observation' in infos[i]
+                assert observations['instruction'][i] is not None
+            else:
+                assert isinstance(observations['feedback'][i], str)
+
+    assert envs.call('instruction_type') == ['b'] * num_envs
+    envs.close()
+
+
+def test_vector_env_sync():
+    test_vector_env(asynchronous=False)
+
+
+def test_vector_env_failure(env_name='llf-gridworld-v0'):
+    # the workers that were started are closed when one of the envs cannot be created
+    env_fns = [functools.partial(llfbench.make, env_name)] * 2 + \
+              [functools.partial(llfbench.make, env_name, feedback_type='unsupported')]
+    for asynchronous in (True, False):
+        try:
+            LLFVectorEnv(env_fns, asynchronous=asynchronous)
+            assert False
+        except (RuntimeError, AssertionError) as e:
+            assert 'unsupported' in str(e)
+        assert not mp.active_children()
+
+
+def test_vector_env_determinism(env_name='llf-gridworld-v0', num_envs=2):
+    outputs = []
+    for asynchronous in (True, False):
+        with llfbench.make_vec(env_name, num_envs, asynchronous=asynchronous) as envs:
+            observations, _ = envs.reset(seed=[1, 2])
+            next_observations, rewards, *_ = envs.step([0] * num_envs)
+            outputs.append((observations, next_observations, rewards))
+    assert outputs[0][0] == outputs[1][0]
+    assert outputs[0][1] == outputs[1][1]
+    assert np.array_equal(outputs[0][2], outputs[1][2])
+
+
+def test_trace_recorder(tmp_path, env_name='llf-gridworld-v0', n_episodes=3):
+    env = TraceRecorder(llfbench.make(env_name, feedback_type='a'), str(tmp_path), chunk_size=4, buffer_size=2)
+    rollouts = []
+    for seed in range(n_episodes):
+        observation, info = env.reset(seed=seed)
+        rollout = [(observation, None)]
+        for _ in range(5):
+            action = info['expert_action'] if info['expert_action'] is not None else 0
+            observation, reward, terminated, truncated, info = env.step(action)
+            rollout.append((observation, reward))
+            if terminated or truncated:
+                break
+        rollouts.append(rollout)
+    env.close()
+
+    reader = TraceReader(str(tmp_path))
+    n_records = sum(len(rollout) for rollout in rollouts)
+    assert len(reader.chunks) == (n_records + 3) // 4
+    episodes = list(reader.episodes())
+    assert len(episodes) == n_episodes
+    for i, (episode, rollout) in enumerate(zip(episodes, rollouts)):
+        assert episode[0]['seed'] == i and 'action' not in episode[0]
+        assert [record['step'] for record in episode] == list(range(len(rollout)))
+        for record, (observation, reward) in zip(episode, rollout):
+            assert record['episode'] == i
+            assert record['observation'] == observation
+            assert record.get('reward') == reward
+
+
+def test_unclosed_trace_recorder(tmp_path, env_name='llf-gridworld-v0'):
+    # the last chunk of a recorder that is never closed is written at exit
+    script = (f'import llfbench\n'
+              f'from llfbench.envs.trace import TraceRecorder\n'
+              f'env = TraceRecorder(llfbench.make({env_name!r}), {str(tmp_path)!r}, compact_templates=True)\n'
+              f'env.reset(seed=0)\n'
+              f'env.step(0)\n')
+    subprocess.run([sys.executable, '-c', script], check=True, capture_output=True)
+    records = list(TraceReader(str(tmp_path)))
+    assert [record['step'] for record in records] == [0, 1]
+    assert isinstance(records[0]['observation']['instruction'], str)
+
+
+def test_compact_trace(tmp_path, env_name='llf-gridworld-v0', n_episodes=3):
+    sizes, infos = {}, {}
+    for compact in (False, True):
+        path = tmp_path / str(compact)
+        env = TraceRecorder(llfbench.make(env_name, feedback_type='a'), str(path), compresslevel=0,
+                            compact_templates=compact)
+        rollouts = []
+        for seed in range(n_episodes):
+            observation, info = env.reset(seed=seed)
+            rollout = [observation]
+            for _ in range(5):
+                action = info['expert_action'] if info['expert_action'] is not None else 0
+                observation, _, terminated, truncated, info = env.step(action)
+                rollout.append(observation)
+                if terminated or truncated:
+                    break
+            rollouts.append(rollout)
+        env.close()
+        sizes[compact] = sum(os.path.getsize(chunk) for chunk in TraceReader(str(path)).chunks)
+
+        # the text is rendered back from the template records
+        records = list(TraceReader(str(path)))
+        assert [record['observation'] for record in records] == [o for rollout in rollouts for o in rollout]
+        assert all(('templates' in record) == compact and 'templates' not in record.get('info', {})
+                   for record in records)
+        infos[compact] = [record['info'] for record in records]
+    assert infos[True] == infos[False]
+    assert sizes[True] < 0.75 * sizes[False]
+
+
+def test_trace_encoder():
+    from llfbench.envs.llf_env import Feedback
+    record = dict(feedback=Feedback(r='good'), x=np.array([1.0, 2.0]), y=np.float32(0.5), z={'a'})
+    decoded = json.loads(TraceEncoder().encode(record))
+    assert decoded['feedback'] == dict(r='good', hp=None, hn=None, fp=None, fn=None)
+    assert decoded['x'] == [1.0, 2.0] and decoded['y'] == 0.5 and decoded['z'] == ['a']
+
+
+def check_oracle_info(env, oracle_info, seed=0, n_steps=5):
+    # The oracle must predict the outcome of every action without changing the
+    # rollout, so taking an action must give what the oracle predicted.
+    for _ in range(n_steps):
+        assert set(oracle_info) == set(range(env.action_space.n))
+        action = int(np.argmax([oracle_info[a]['reward'] for a in oracle_info]))
+        observation, reward, terminated, truncated, info = env.step(action)
+        assert reward == oracle_info[action]['reward']
+        assert observation == oracle_info[action]['observation']
+        assert observation['feedback'] == oracle_info[action]['feedback']
+        assert (terminated, truncated) == (oracle_info[action]['terminated'], oracle_info[action]['truncated'])
+        if terminated or truncated:
+            break
+        oracle_info = info['oracle_info']
+
+
+def test_full_information(env_name='llf-gridworld-v0', seed=0):
+    env = FullInformationWrapper(llfbench.make(env_name, feedback_type='a'))
+    _, info = env.reset(seed=seed)
+    check_oracle_info(env, info['oracle_info'], seed=seed)
+
+    # The oracle does not change the rollout.
+    env_ref = llfbench.make(env_name, feedback_type='a')
+    assert env.reset(seed=seed)[0] == env_ref.reset(seed=seed)[0]
+    for action in (0, 1, 2, 3):
+        assert env.step(action)[0] == env_ref.step(action)[0]
+
+    # nor the timing and the template records of the env, which count only the steps taken
+    llf_env, llf_env_ref = env.env, env_ref
+    for e in (llf_env, llf_env_ref):
+        e.get_wrapper_attr('enable_timing')()
+        e.get_wrapper_attr('enable_template_records')()
+        e.reset(seed=seed)
+    for action in (0, 1):
+        assert env.step(action)[4]['templates'] == env_ref.step(action)[4]['templates']
+    records = [e.get_wrapper_attr('_template_records') for e in (llf_env, llf_env_ref)]
+    assert records[0] == records[1]
+    stats = llf_env.get_wrapper_attr('timing_stats')()
+    assert stats['reset']['count'] == 1 and stats['step']['count'] == 2
+
+
+def test_full_information_pool(env_name='llf-gridworld-v0', seed=0):
+    env_fn = functools.partial(llfbench.make, env_name, feedback_type='a')
+    env = FullInformationWrapper(env_fn(), n_workers=2, env_fn=env_fn)
+    _, info = env.reset(seed=seed)
+    env_ref = FullInformationWrapper(env_fn())
+    _, info_ref = env_ref.reset(seed=seed)
+    assert info['oracle_info'] == info_ref['oracle_info']
+    check_oracle_info(env, info['oracle_info'], seed=seed)
+    env.close()
+
+
+def test_action_parser():
+    import gymnasium as gym
+    box = ActionParser(gym.spaces.Box(low=-1, high=1, shape=(4,)))
+    for text in ('[0.1, -0.2, 0.3, 1e-2]', 'Action: 0.1 -0.2 .3 0.01', 'Step 2: [0.1,-0.2,0.3,0.01].',
+                 'I move 0.1 -0.2 0.3 0.01.'):
+        action = box.parse(text)
+        assert action.shape == (4,) and action.dtype == np.float32
+        assert np.allclose(action, [0.1, -0.2, 0.3, 0.01], atol=0.1)
+    discrete = ActionParser(gym.spaces.Discrete(5))
+    assert discrete.parse(' 3 ') == 3 and discrete.parse('I choose action 2.') == 2
+    multi_discrete = ActionParser(gym.spaces.MultiDiscrete([2, 3]))
+    assert multi_discrete.parse('[1, 2]').tolist() == [1, 2]
+    assert ActionParser(gym.spaces.Text(10)).parse('go north') == 'go north'
+
+    # nothing is evaluated, and bad actions give structured errors
+    for parser, text in ((box, '__import__("os").getcwd()'), (box, '[0.1, 0.2]'), (discrete, '7'),
+                         (discrete, '1 or 2'), (discrete, 1.5), (multi_discrete, '[1, 3]'),
+                         # malformed numbers are not split into several ones
+                         (box, '1.2.3 4 5'), (box, '[0.1, 0.2, 0.3, 0.4x]'), (box, '0.1 0.2 0.3 1e-2.5')):
+        try:
+            parser.parse(text)
+            assert False, text
+        except ActionParseError as e:
+            assert set(e.asdict()) == {'text', 'reason'}
+
+    actions = box.parse_batch(['[1, 2, 3, 4]', 'left', '0 0 0 0'])
+    assert isinstance(actions[1], ActionParseError)
+    assert actions[0].tolist() == [1, 2, 3, 4] and actions[2].tolist() == [0, 0, 0, 0]
+
+
+def test_text_wrapper(env_name='llf-gridworld-v0', seed=0):
+    env = TextWrapper(llfbench.make(env_name, feedback_type='a'))
+    env_ref = llfbench.make(env_name, feedback_type='a')
+    env.reset(seed=seed)
+    env_ref.reset(seed=seed)
+    assert env.step('2')[0] == env_ref.step(2)[0]
+    observation, reward, terminated, truncated, info = env.step('north')
+    assert observation['feedback'] == "Cannot parse action 'north': expected 1 number, but found 0"
+    assert 'Traceback' not in observation['feedback']
+    assert info['parse_error'] == dict(text='north', reason='expected 1 number, but found 0')
+    assert env.parse_actions(['0', 'x'])[0] == 0
+
+
+def test_random_action_order(n=1000, seed=0):
+    import gymnasium as gym
+
+    class ArmEnv(gym.Env):
+        action_space = gym.spaces.Discrete(n)
+        observation_space = gym.spaces.Discrete(1)
+
+        def reset(self, *, seed=None, options=None):
+            super().reset(seed=seed)
+            return 0, {}
+
+        def step(self, action):
+            return 0, float(action), False, False, {}
+
+    env = RandomActionOrderWrapper(ArmEnv())
+    env.reset(seed=seed)
+    actions = np.arange(n)
+    internal = env.internal_action(actions)
+    assert sorted(internal.tolist()) == actions.tolist()
+    assert np.array_equal(env.external_action(internal), actions)
+    assert all(env.step(a)[1] == env.internal_action(a) == internal[a] for a in (0, 1, n - 1))
+    assert isinstance(env.external_action(3), int)
+
+    # The permutation only depends on the seed, and can be saved and restored.
+    state = env.get_state()
+    env.reset(seed=seed + 1)
+    assert not np.array_equal(env.internal_action(actions), internal)
+    env.set_state(state)
+    assert np.array_equal(env.internal_action(actions), internal)
+    env.reset(seed=seed)
+    assert np.array_equal(env.internal_action(actions), internal)
+
+
+def test_prompt_accounting(env_name='llf-gridworld-v0', seed=0, actions=(0, 1, 2)):
+    accountant = PromptAccountant()
+    texts = []  # the texts given to the tokenizer
+    count_tokens = lambda text: texts.append(text) or len(text.split())
+    env_a = PromptAccountingWrapper(llfbench.make(env_name, feedback_type='a'), accountant,
+                                    count_tokens=count_tokens, attach_to_info=True)
+    observation, info = env_a.reset(seed=seed)
+    observations = [observation]
+    assert info['prompt_size']['instruction'] == (len(observation['instruction']),
+                                                  len(observation['instruction'].split()))
+    assert 'feedback' not in info['prompt_size']
+    for action in actions:
+        observations.append(env_a.step(action)[0])
+
+    # a second env of another feedback type shares the accountant
+    env = PromptAccountingWrapper(llfbench.make(env_name, feedback_type=('r', 'hn')), accountant)
+    env.reset(seed=seed)
+    env.step(0)
+
+    stats = accountant.stats()
+    assert set(stats) == {env_name} and set(stats[env_name]) == {'a', 'hn,r'}
+    stats = stats[env_name]['a']
+    assert stats['total']['count'] == stats['observation']['count'] == len(actions) + 1
+    assert stats['feedback']['count'] == len(actions)
+    assert stats['feedback']['chars'] == sum(len(o['feedback']) for o in observations[1:])
+    assert stats['feedback']['tokens'] == sum(len(o['feedback'].split()) for o in observations[1:])
+    assert stats['total']['chars'] == sum(stats[f]['chars'] for f in ('instruction', 'observation', 'feedback'))
+    assert stats['instruction']['max_chars'] >= stats['instruction']['mean_chars'] > 0
+    # a field repeating its previous text is not tokenized again
+    n_texts = len(texts)
+    assert env_a.measure(observations[-1]) == env_a.measure(observations[-1]) and len(texts) == n_texts
+    assert accountant.stats()['llf-gridworld-v0']['hn,r']['total']['tokens'] == 0  # no tokenizer
+
+    accountant.reset()
+    assert accountant.stats() == {}
@@ -3,7 +3,6 @@ import llfbench
 import numpy as np
 import random
 from tqdm import tqdm
-from llfbench.utils.utils import generate_combinations_dict
 from llfbench.envs.llf_env import LLFWrapper
 
 
@@ -85,9 +84,7 @@ def test_wrapper(env):
 
 def test_env(env_name, seed=0):
     print(env_name)
-    instruction_types, feedback_types = llfbench.supported_types(env_name)
-    feedback_types = list(feedback_types) + ['n', 'a', 'm']
-    configs = generate_combinations_dict(dict(instruction_type=instruction_types, feedback_type=feedback_types))
+    configs = llfbench.supported_configs(env_name)
     for config in configs:
         env = llfbench.make(env_name, **config)  # test llfbench.make
         assert test_wrapper(env) # test LLFWrapper is used
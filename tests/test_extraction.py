@@ -0,0 +1,169 @@
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import llfbench
+from llfbench.utils.extraction import ExtractionExecutor
+from llfbench.envs.poem.formal_poems import PoemExtractor, Haiku
+from llfbench.envs.reco.movie_rec import MovieRec, RecContentExtractor
+
+
+class GatedLLM:
+    """ A fake LLM whose calls wait until the gate is open, which echoes the
+        content of the last message (or returns a fixed response) and counts
+        the calls.
+    """
+
+    def __init__(self, response=None, n_failures=0, open=True):
+        self.response = response
+        self.n_failures = n_failures  # the number of first calls that raise an exception
+        self.gate = threading.Event()
+        if open:
+            self.gate.set()
+        self.n_calls = 0
+        self.n_in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def generate(self, messages):
+        with self._lock:
+            self.n_calls += 1
+            n_calls = self.n_calls
+            self.n_in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.n_in_flight)
+        assert self.gate.wait(timeout=10)
+        with self._lock:
+            self.n_in_flight -= 1
+        if n_calls <= self.n_failures:
+            raise ConnectionError('rate limited')
+        return self.response or messages[-1]['content'], {}
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timeout'
+        time.sleep(0.001)
+
+
+def open_when(llm, condition):
+    # open the gate of llm in the background once condition holds
+    thread = threading.Thread(target=lambda: (wait_until(condition), llm.gate.set()), daemon=True)
+    thread.start()
+    return thread
+
+
+def test_extraction_executor():
+    llm = GatedLLM(open=False)
+    extractor = PoemExtractor(llm)
+    contents = [f'poem {i}' for i in range(8)]
+    with ExtractionExecutor(max_in_flight=4) as executor:
+        futures = [executor.submit(extractor, contents[i % 8]) for i in range(64)]
+        # 4 calls run in parallel while the others wait for a thread
+        wait_until(lambda: llm.n_in_flight == 4)
+        llm.gate.set()
+        results = [f.result() for f in futures]
+        # identical pending requests are deduplicated
+        assert llm.n_calls == 8 and llm.max_in_flight == 4
+        assert executor.stats() == dict(n_requests=64, n_calls=8, n_deduplicated=56, n_cached=0)
+        for i, result in enumerate(results):
+            assert contents[i % 8] in result
+
+        # a finished request is no longer pending, so it is called again
+        executor.extract(extractor, contents[0])
+        assert llm.n_calls == 9
+
+    # unless the results are cached
+    llm = GatedLLM()
+    with ExtractionExecutor(max_cached=1) as executor:
+        for content in [contents[0], contents[0], contents[1], contents[0]]:
+            executor.extract(PoemExtractor(llm), content)
+        assert llm.n_calls == 3 and executor.stats()['n_cached'] == 1
+
+
+def test_extraction_executor_retry():
+    llm = GatedLLM(n_failures=2)
+    extractor = PoemExtractor(llm)
+    with ExtractionExecutor(max_retries=3, backoff=0.01, max_cached=8) as executor:
+        assert 'poem' in executor.extract(extractor, 'poem')
+        assert llm.n_calls == 3
+
+    llm = GatedLLM(n_failures=3)
+    with ExtractionExecutor(max_retries=3, backoff=0.01, max_cached=8) as executor:
+        try:
+            executor.extract(PoemExtractor(llm), 'poem')
+            assert False
+        except ConnectionError:
+            pass
+        assert llm.n_calls == 3
+        # failures are not cached
+        assert 'poem' in executor.extract(PoemExtractor(llm), 'poem') and llm.n_calls == 4
+
+
+def test_shared_extraction_executor():
+    # envs stepped in threads share the executor
+    llm = GatedLLM(open=False)
+    with ExtractionExecutor(max_in_flight=8) as executor:
+        envs = [Haiku() for _ in range(8)]
+        for env in envs:
+            env.initialize_text_extractor(PoemExtractor(llm), executor=executor)
+            env.reset(seed=0)
+        open_when(llm, lambda: executor.stats()['n_requests'] == len(envs))
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda env: env.step('An old silent pond'), envs))
+        assert llm.n_calls == 1
+
+    # the recommendations are validated and retried
+    llm = GatedLLM(response=json.dumps([dict(title='Up')]), n_failures=1)
+    with ExtractionExecutor(backoff=0.01) as executor:
+        env = MovieRec()
+        env.initialize_text_extractor(RecContentExtractor(llm), executor=executor)
+        assert env.extract_with_retry('I recommend Up.') == [dict(title='Up')]
+        assert llm.n_calls == 2
+        llm.response = 'Up'
+        assert env.extract_with_retry('I recommend Up.') is None
+        # a failed extraction keeps the action of the agent in the feedback
+        env.reset(seed=0)
+        info = env.step('I recommend Up.')[3]
+        assert 'I recommend Up.' in info['original_feedback']
+    env.initialize_text_extractor(RecContentExtractor(llm))
+    assert env.extract_with_retry('I recommend Up.') is None
+
+
+def test_vector_env_extraction(env_name='llf-poem-Haiku-v0', num_envs=8):
+    # the workers send their extractions to the parent process, where they are deduplicated
+    llm = GatedLLM(open=False)
+    executor = ExtractionExecutor(max_in_flight=4, max_cached=16)
+    with llfbench.make_vec(env_name, num_envs, extractor=PoemExtractor(llm), extraction_executor=executor) as envs:
+        envs.reset(seed=0)
+        open_when(llm, lambda: executor.stats()['n_requests'] == num_envs)
+        observations, _, _, _, _ = envs.step(['An old silent pond'] * num_envs)
+        assert llm.n_calls == 1 and all(f is not None for f in observations['feedback'])
+        # the same poem in a later step is answered from the cache
+        envs.step(['An old silent pond'] * num_envs)
+        assert llm.n_calls == 1 and executor.stats()['n_cached'] == num_envs
+    executor.shutdown()
+
+    # the recommendations of the reco env are validated and retried in the parent, as in-process,
+    # and the invalid ones are not cached
+    llm = GatedLLM(response='Up')
+    executor = ExtractionExecutor(backoff=0.01, max_cached=16)
+    with llfbench.make_vec('llf-reco-movie-v0', 2, extractor=RecContentExtractor(llm),
+                           extraction_executor=executor) as envs:
+        envs.reset(seed=0)
+        for i in range(1, 3):
+            envs.step(['I recommend Up.'] * 2)
+            assert llm.n_calls == i * executor.max_retries
+    executor.shutdown()
+
+    # and an extraction that fails is raised in the worker
+    llm = GatedLLM(n_failures=100)
+    executor = ExtractionExecutor(max_retries=1)
+    with llfbench.make_vec(env_name, 2, extractor=PoemExtractor(llm), extraction_executor=executor) as envs:
+        envs.reset(seed=0)
+        try:
+            envs.step(['An old silent pond'] * 2)
+            assert False
+        except RuntimeError as e:
+            assert 'ConnectionError' in str(e)
+    executor.shutdown()
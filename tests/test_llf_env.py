@@ -0,0 +1,229 @@
+import numpy as np
+import llfbench
+from llfbench.envs.llf_env import LLFWrapper
+from llfbench.envs.utils import sample_template_indices
+
+
+def get_llf_wrapper(env):
+    while not isinstance(env, LLFWrapper):
+        env = env.env
+    return env
+
+
+def rollout(env, seed, actions):
+    observation, _ = env.reset(seed=seed)
+    observations = [observation]
+    for action in actions:
+        observations.append(env.step(action)[0])
+    return observations
+
+
+def test_paraphrase_rng(env_name='llf-gridworld-v0', seed=0):
+    # Envs in the same process should not affect each other's randomness.
+    actions = [0, 1, 2, 3] * 3
+    env = llfbench.make(env_name, feedback_type='m')
+    expected = rollout(env, seed, actions)
+
+    env1 = llfbench.make(env_name, feedback_type='m')
+    env2 = llfbench.make(env_name, feedback_type='m')
+    observations1 = [env1.reset(seed=seed)[0]]
+    env2.reset(seed=seed + 1)
+    for action in actions:
+        observations1.append(env1.step(action)[0])
+        env2.step(action)
+    assert observations1 == expected
+
+
+def test_sample_template_indices():
+    lengths = [3, 5, 1]
+    indices = sample_template_indices(lengths, 'random', np.random.default_rng(0))
+    assert np.array_equal(indices, sample_template_indices(lengths, 'random', np.random.default_rng(0)))
+    assert all(0 <= i < n for i, n in zip(indices, lengths))
+    assert list(sample_template_indices(lengths, 4)) == [1, 4, 0]
+
+
+def test_format_batch(env_name='llf-gridworld-v0'):
+    env = get_llf_wrapper(llfbench.make(env_name))
+    requests = [(('a {x}', 'b {x}'), dict(x=1)), (('c',), dict())]
+    env.set_paraphrase_method(1)
+    assert env.format_batch(requests) == ['b 1', 'c']
+    env.set_paraphrase_method('random')
+    assert env.format_batch([]) == []
+
+
+def test_render_feedback(env_name='llf-optimization-Booth-v0'):
+    from llfbench.envs.llf_env import Feedback, FeedbackTemplate
+    env = get_llf_wrapper(llfbench.make(env_name))
+    env.set_paraphrase_method(0)
+    prompts = env.PROMPTS
+    feedback = Feedback(r=FeedbackTemplate('r_feedback_neg', {}),
+                        fp=['Hint: ', FeedbackTemplate('fp_feedback_dim1', dict(x='[1, 2]', smaller='smaller', x2=1))],
+                        fn=[])
+    rendered = env.render_feedback(feedback)
+    assert rendered.r == prompts.r_feedback_neg[0]
+    assert rendered.fp == 'Hint: ' + prompts.fp_feedback_dim1[0].format(x='[1, 2]', smaller='smaller', x2=1)
+    assert rendered.hp is None and rendered.hn is None and rendered.fn is None
+    assert env.render_feedback(feedback, feedback_type={'r'}).fp is None
+
+
+def test_feedback():
+    import copy, pickle
+    from llfbench.envs.llf_env import Feedback
+    feedback = Feedback(r='reward', fp='do this')
+    feedback['hn'] = 'not that'
+    feedback.fn = 'avoid that'
+    del feedback['fn']
+    assert feedback['r'] == feedback.r == 'reward'
+    assert 'hp' in feedback and 'x' not in feedback
+    assert list(feedback.items()) == [('r', 'reward'), ('hp', None), ('hn', 'not that'), ('fp', 'do this'), ('fn', None)]
+    assert feedback.asdict() == dict(feedback.items())
+    assert feedback == copy.deepcopy(feedback) == pickle.loads(pickle.dumps(feedback))
+    assert feedback != Feedback(r='reward')
+    assert not hasattr(feedback, '__dict__')
+
+
+def test_timing(env_name='llf-optimization-Booth-v0', seed=0):
+    env = llfbench.make(env_name, feedback_type='a')
+    llf_env = get_llf_wrapper(env)
+    assert llf_env.timing_stats() == {}
+    expected = rollout(env, seed, ['x = [1.0, 2.0]', 'x = [0.5, 1.0]'])
+
+    llf_env.enable_timing(attach_to_info=True)
+    observation, info = env.reset(seed=seed)
+    assert set(info['timing']) == {'reset', 'obs_check'}
+    observations = [observation]
+    for action in ['x = [1.0, 2.0]', 'x = [0.5, 1.0]']:
+        observation, _, _, _, info = env.step(action)
+        observations.append(observation)
+        assert {'step', 'paraphrase', 'verbalize', 'obs_check'} <= set(info['timing'])
+    assert observations == expected  # timing does not change the rollout
+
+    stats = llf_env.timing_stats()
+    assert stats['reset']['count'] == 1 and stats['step']['count'] == 2
+    for s in stats.values():
+        assert sum(s['histogram'].values()) == s['count']
+        assert s['min'] <= s['mean'] <= s['max']
+
+    llf_env.disable_timing()
+    _, info = env.reset(seed=seed)
+    assert 'timing' not in info and llf_env.timing_stats() == {}
+
+
+def assert_same(x, y):
+    if isinstance(x, dict):
+        assert x.keys() == y.keys()
+        for k in x:
+            assert_same(x[k], y[k])
+    elif isinstance(x, np.ndarray):
+        assert np.array_equal(x, y)
+    else:
+        assert x == y
+
+
+def branch(env, actions):
+    outputs = []
+    for action in actions:
+        observation, reward, terminated, truncated, info = env.step(action)
+        outputs.append((observation, reward, terminated, truncated))
+    return outputs
+
+
+def check_state(env_name, actions, seed=0):
+    env = llfbench.make(env_name, feedback_type='m')
+    llf_env = get_llf_wrapper(env)
+    env.reset(seed=seed)
+    branch(env, actions[:2])
+    state = llf_env.get_state()
+    expected = branch(env, actions[2:])
+    for _ in range(2):  # a snapshot can be restored many times
+        llf_env.set_state(state)
+        for output, expected_output in zip(branch(env, actions[2:]), expected):
+            for x, y in zip(output, expected_output):
+                assert_same(x, y)
+    env.reset(seed=seed + 1)  # and after a reset
+    llf_env.set_state(state)
+    for output, expected_output in zip(branch(env, actions[2:]), expected):
+        assert_same(output[0], expected_output[0])
+
+
+def test_state():
+    check_state('llf-gridworld-v0', [0, 1, 2, 3, 0, 1])
+    check_state('llf-optimization-Rosenbrock-v0', ['x = [1.0, 2.0]', 'x = [0.5, 1.0]', 'x = [0.1, 0.2]', 'x = [3.0, 1.0]'])
+    check_state('llf-highway-parking-v0', [np.array([0.5, 0.1]), np.array([0.2, -0.3]), np.array([1.0, 0.0]),
+                                           np.array([-0.5, 0.5])])
+
+
+def test_state_poem():
+    check_state('llf-poem-LineSyllableConstrainedPoem-v0', ['The sun is bright\nThe sky is blue\nI love you'] * 4)
+
+
+def test_template_records(env_name='llf-gridworld-v0', seed=0):
+    from llfbench.envs.utils import template_id, get_template, render_template_records
+    from llfbench.envs.llf_env import Feedback
+    from llfbench.envs.gridworld import prompts
+    actions = [0, 1, 2, 3]
+    env = llfbench.make(env_name, feedback_type='a')
+    expected = rollout(env, seed, actions)
+
+    llf_env = get_llf_wrapper(env)
+    llf_env.enable_template_records()
+    observation, info = env.reset(seed=seed)
+    observations = [observation]
+    assert get_template(info['templates'][0][0]) in prompts.instructions
+    assert info['templates'][0][1] == 'instruction'
+    for action in actions:
+        observation, _, _, _, info = env.step(action)
+        observations.append(observation)
+        # the feedback is made of the rendered templates
+        for text in render_template_records(info['templates']):
+            assert text in observation['feedback']
+        # each record is tagged with the feedback field it fills
+        assert {field for _, field, _ in info['templates']} <= set(Feedback.FIELDS)
+        assert {field for _, field, _ in info['templates']} == \
+            {field for field, value in info['feedback'].items() if value is not None}
+    assert observations == expected  # recording does not change the rollout
+
+    # the ids are 32-bit hashes of the templates
+    ids = [template_id(t) for t in prompts.instructions]
+    assert all(0 <= tid < 2 ** 32 and get_template(tid) == t for tid, t in zip(ids, prompts.instructions))
+    assert len(set(ids)) == len(set(prompts.instructions))
+
+    llf_env.disable_template_records()
+    assert 'templates' not in env.reset(seed=seed)[1]
+
+
+def test_global_np_random():
+    from llfbench.envs.utils import global_np_random
+    np.random.seed(1)
+    expected = np.random.uniform(size=2)
+    np.random.seed(1)
+    rng = np.random.RandomState(0)
+    with global_np_random(rng):
+        x = np.random.uniform()
+    with global_np_random(rng):  # continues from the state drawn in the first context
+        y = np.random.uniform()
+    assert [x, y] == list(np.random.RandomState(0).uniform(size=2))
+    assert np.array_equal(np.random.uniform(size=2), expected)  # the caller's global state is untouched
+
+
+def test_reset_keeps_global_random_state(seed=0):
+    # making and resetting an env does not reseed the global random states
+    import random
+    import gym as old_gym
+    import gymnasium as gym
+    env_names = ('llf-gridworld-v0', 'llf-bandits-BanditTwoArmedHighLowFixed-v0', 'llf-optimization-Booth-v0',
+                 'llf-poem-Haiku-v0', 'llf-reco-movie-v0', 'llf-highway-parking-v0', 'llf-metaworld-reach-v2')
+    for env_name in env_names:
+        try:
+            llfbench.make(env_name).close()  # the modules of the env are imported, e.g. jax seeds numpy once
+        except (ImportError, gym.error.Error, old_gym.error.Error):  # e.g. metaworld is not installed
+            continue
+        random.seed(1)
+        np.random.seed(1)
+        random_state, np_state = random.getstate(), np.random.get_state()
+        env = llfbench.make(env_name)
+        env.reset(seed=seed)
+        env.reset(seed=seed + 1)
+        assert random.getstate() == random_state, env_name
+        assert all(np.array_equal(a, b) for a, b in zip(np.random.get_state(), np_state)), env_name
+        env.close()
@@ -0,0 +1,71 @@
+from llfbench.utils.llm_cache import ResponseCache, CachedLLM, cache_key
+
+
+class CountingLLM:
+    """ A fake LLM that echoes the last message and counts the calls. """
+
+    model = 'fake'
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def generate(self, messages):
+        self.n_calls += 1
+        return messages[-1]['content'].upper(), dict(n_calls=self.n_calls)
+
+
+def test_response_cache(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    llm = CountingLLM()
+    cache = ResponseCache(path, max_memory_items=2)
+    cached_llm = CachedLLM(llm, cache, params=dict(temperature=0))
+    messages = [[dict(role='user', content=f'message {i}')] for i in range(3)]
+    for m in messages + messages[::-1]:
+        assert cached_llm.generate(m)[0] == m[0]['content'].upper()
+    # message 0 was evicted from the memory by messages 1 and 2, but is on disk
+    assert llm.n_calls == 3
+    stats = cache.stats()
+    assert (stats['misses'], stats['disk_hits'], stats['memory_hits']) == (3, 1, 2) and stats['hit_rate'] == 0.5
+    cache.close()
+
+    # the responses persist across caches, e.g. reruns
+    cache = ResponseCache(path)
+    cached_llm = CachedLLM(CountingLLM(), cache, params=dict(temperature=0))
+    assert cached_llm.generate(messages[0]) == ('MESSAGE 0', dict(n_calls=1))
+    assert cached_llm.llm.n_calls == 0 and cache.stats()['disk_hits'] == 1
+    # the params and the model are part of the key
+    assert cache_key(messages[0], dict(temperature=0)) != cache_key(messages[0], dict(temperature=0, model='fake'))
+    CachedLLM(cached_llm.llm, cache, params=dict(temperature=0, max_tokens=10)).generate(messages[0])
+    assert cached_llm.llm.n_calls == 1
+    cache.close()
+
+
+def test_response_cache_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'), max_memory_items=1, max_disk_bytes=100)
+    for i in range(10):
+        cache.put(f'key {i}', 'x' * 30)
+    assert cache.stats()['disk_bytes'] <= 100
+    assert cache.get('key 9') is not None and cache.get('key 8') is not None
+    assert cache.get('key 0') is None
+
+
+def test_sampled_responses_are_not_cached():
+    llm = CountingLLM()
+    cached_llm = CachedLLM(llm, ResponseCache(), params=dict(temperature=0.7))
+    for _ in range(2):
+        cached_llm.generate([dict(role='user', content='poem')])
+    assert llm.n_calls == 2
+    cached_llm = CachedLLM(llm, ResponseCache(), params=dict(temperature=0.7), cache_sampled=True)
+    for _ in range(2):
+        cached_llm.generate([dict(role='user', content='poem')])
+    assert llm.n_calls == 3
+
+
+def test_extractor_cache():
+    from llfbench.envs.reco.movie_rec import RecContentExtractor
+    llm = CountingLLM()
+    cache = ResponseCache()
+    extractor = RecContentExtractor(llm, cache=cache)
+    assert extractor('The Godfather') == extractor('The Godfather')
+    extractor('Pulp Fiction')
+    assert llm.n_calls == 2 and cache.stats()['memory_hits'] == 1
@@ -0,0 +1,67 @@
+import pytest
+from llfbench.utils.parser_utils import SimpleGuidanceParser
+
+
+def test_blocks():
+    parser = SimpleGuidanceParser("""
+    {{#system~}}
+    You are a helpful assistant.
+    {{~/system}}
+
+    {{#user~}}
+    Extract the poem:
+    ```
+    {{content}}
+    ```
+    {{~/user}}
+
+    {{#assistant~}}
+    {{gen 'poem' temperature=0.7}}
+    {{~/assistant}}
+    """)
+    # the last assistant block is for generation, and line breaks are reduced
+    assert parser(content='line one\n\n\nline two') == [
+        {'role': 'system', 'content': 'You are a helpful assistant.'},
+        {'role': 'user', 'content': 'Extract the poem:\n    ```\n    line one\nline two\n    ```'}]
+    with pytest.raises(KeyError):
+        parser()
+
+
+def test_if_each():
+    parser = SimpleGuidanceParser("""{{#user~}}
+    {{#if exists_instruction}}
+    Advice: {{instruction}}
+    {{/if}}
+    {{#each examples}}
+    {{role}}'s Assignment: {{this.assignment}}
+    ---
+    {{~/each}}
+    Done.
+    {{~/user}}""")
+    examples = [{'assignment': 'rain'}, {'assignment': 'sun'}]
+    assert parser(exists_instruction=True, instruction='Use metaphors.', examples=examples, role='Teacher') == [
+        {'role': 'user', 'content': "Advice: Use metaphors.\nTeacher's Assignment: rain\n    ---\n"
+                                    "Teacher's Assignment: sun\n    ---\nDone."}]
+    assert parser(exists_instruction=False, examples=[], role='Teacher') == [{'role': 'user', 'content': 'Done.'}]
+
+
+def test_nested():
+    parser = SimpleGuidanceParser("""{{#user~}}
+    {{#each poems}}
+    Poem {{this.title}}:
+    {{#if show_lines}}{{#each this.lines}}{{this.text}}{{/each}}{{/if}}
+    {{#if this.feedback}}Feedback: {{this.feedback}}{{/if}}
+    {{/each}}
+    {{~/user}}""")
+    poems = [dict(title='A', lines=[dict(text='a1'), dict(text='a2')], feedback='good'),
+             dict(title='B', lines=[dict(text='b1')], feedback=None)]
+    content = parser(poems=poems, show_lines=True)[0]['content']
+    # the items of each are separated by line breaks, also from the text around
+    assert content == '\nPoem A:\na1\na2\nFeedback: good\nPoem B:\nb1\n'
+    assert parser(poems=poems, show_lines=False)[0]['content'] == '\nPoem A:\nFeedback: good\nPoem B:\n'
+
+
+def test_parse_errors():
+    for template in ('{{#user~}}{{#if a}}x{{~/user}}', '{{#user~}}{{#if a}}x{{/each}}{{/if}}{{~/user}}'):
+        with pytest.raises(ValueError):
+            SimpleGuidanceParser(template)
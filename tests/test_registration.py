@@ -0,0 +1,127 @@
+import sys
+import importlib
+import subprocess
+import numpy as np
+import gym as old_gym
+import gymnasium as gym
+import llfbench
+from llfbench.envs import gridworld, bandits, optimization, poem, highway, metaworld
+from llfbench.envs.registration import MetadataRegistry
+
+
+# modules that should only be imported when an env is made
+HEAVY_MODULES = (
+    'gym_bandits',
+    'jax',
+    'requests',
+    'metaworld',
+    'alfworld',
+    'llfbench.envs.gridworld.gridworld',
+    'llfbench.envs.bandits.wrapper',
+    'llfbench.envs.optimization.loss_descent',
+    'llfbench.envs.poem.formal_poems',
+    'llfbench.envs.reco.movie_rec',
+    'llfbench.envs.highway.wrapper',
+    'llfbench.envs.metaworld.wrapper',
+)
+
+# the time that `import llfbench` may add on top of `import gymnasium`
+IMPORT_BUDGET = 0.5  # seconds
+
+
+def run_python(code):
+    return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+
+
+def import_time(module, n_repeats=3):
+    code = f'import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+    return min(float(run_python(code)) for _ in range(n_repeats))
+
+
+def test_lazy_imports():
+    code = 'import sys, llfbench; print(" ".join(sys.modules))'
+    loaded = set(run_python(code).split())
+    assert not loaded.intersection(HEAVY_MODULES), loaded.intersection(HEAVY_MODULES)
+
+
+def test_import_budget():
+    overhead = import_time('llfbench') - import_time('gymnasium')
+    assert overhead < IMPORT_BUDGET, f'import llfbench takes {overhead:.2f}s more than import gymnasium.'
+
+
+def test_registered_envs():
+    expected = [f'llf-{env_name}' for env_name in gridworld.ENVIRONMENTS] + \
+               [f'llf-bandits-{env_name}' for env_name in bandits.ENVIRONMENTS] + \
+               [f'llf-optimization-{env_name}-v0' for env_name in optimization.ENVIRONMENTS] + \
+               [f'llf-poem-{env_name}-v0' for env_name in poem.ENVIRONMENTS] + \
+               ['llf-reco-movie-v0'] + \
+               [f'llf-highway-{env_name}' for env_name in highway.ENVIRONMENTS]
+    for env_id in expected:
+        assert env_id in gym.envs.registry, env_id
+    assert len(metaworld.ENVIRONMENTS) == 50
+
+
+def test_make_imports_on_demand():
+    code = 'import sys, llfbench; llfbench.make("llf-gridworld-v0"); print(" ".join(sys.modules))'
+    loaded = set(run_python(code).split())
+    assert 'llfbench.envs.gridworld.gridworld' in loaded
+    assert 'llfbench.envs.reco.movie_rec' not in loaded
+
+
+def test_supported_types_without_make():
+    code = 'import sys, llfbench; llfbench.supported_configs("llf-gridworld-v0"); llfbench.reward_range("llf-gridworld-v0");' \
+           'print(" ".join(sys.modules))'
+    loaded = set(run_python(code).split())
+    assert 'llfbench.envs.gridworld.gridworld' not in loaded
+    configs = llfbench.supported_configs('llf-gridworld-v0')
+    assert len(configs) == 3 * (5 + 3)
+    assert dict(instruction_type='p', feedback_type='m') in configs
+
+
+# the wrapper of each env family, by the prefix of the env ids
+WRAPPERS = {
+    'llf-gridworld-': 'llfbench.envs.gridworld.wrapper:GridworldWrapper',
+    'llf-bandits-': 'llfbench.envs.bandits.wrapper:BanditGymWrapper',
+    'llf-optimization-': 'llfbench.envs.optimization.wrapper:LossLandscapeGymWrapper',
+    'llf-poem-': 'llfbench.envs.poem.wrapper:PoemGymWrapper',
+    'llf-reco-': 'llfbench.envs.reco.wrapper:MovieRecGymWrapper',
+    'llf-highway-': 'llfbench.envs.highway.wrapper:HighwayWrapper',
+    'llf-metaworld-': 'llfbench.envs.metaworld.wrapper:MetaworldWrapper',
+    'llf-alfworld-': 'llfbench.envs.alfworld.wrapper:AlfworldWrapper',
+}
+
+
+def import_wrapper(path):
+    module, name = path.split(':')
+    try:
+        return getattr(importlib.import_module(module), name)
+    except ImportError:  # e.g. metaworld is not installed
+        return None
+
+
+def test_metadata():
+    # the registered metadata of every env family should agree with its wrapper
+    env_ids = MetadataRegistry.env_ids()
+    for prefix, path in WRAPPERS.items():
+        family = [env_id for env_id in env_ids if env_id.startswith(prefix)]
+        if not family:
+            assert prefix == 'llf-alfworld-', prefix  # alfworld is only registered if it is installed
+            continue
+        wrapper = import_wrapper(path)
+        for env_id in family:
+            instruction_types, feedback_types = llfbench.supported_types(env_id)
+            if wrapper is not None:
+                assert instruction_types == tuple(wrapper.INSTRUCTION_TYPES), env_id
+                assert feedback_types == tuple(wrapper.FEEDBACK_TYPES), env_id
+
+        # and with the envs that can be built, one per distinct reward range
+        reward_ranges = {llfbench.reward_range(env_id): env_id for env_id in reversed(family)}
+        for env_id in reward_ranges.values():
+            try:
+                env = llfbench.make(env_id)
+            except (ImportError, old_gym.error.Error):  # e.g. gym_bandits is not installed
+                continue
+            assert instruction_types == tuple(env.get_wrapper_attr('INSTRUCTION_TYPES'))
+            assert feedback_types == tuple(env.get_wrapper_attr('FEEDBACK_TYPES'))
+            assert np.allclose(llfbench.reward_range(env_id), env.reward_range), env_id
+            env.close()